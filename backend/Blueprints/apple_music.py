@@ -7,7 +7,7 @@ from pydantic import ValidationError
 
 # Ensure your settings include apple_developer_token
 from config.config import settings
-import requests
+from util.http_client import http_client
 import logging
 import database.firebase_operations as firebase_operations
 from util.utils import (
@@ -57,7 +57,7 @@ def get_albums():
 
     url = "https://api.music.apple.com/v1/me/library/albums"
     try:
-        response = requests.get(url, headers=headers)
+        response = http_client.get(url, headers=headers)
         if response.status_code != 200:
             logger.error("Error fetching albums: %s", response.text)
             return (
@@ -126,7 +126,7 @@ def get_playlists():
 
     url = "https://api.music.apple.com/v1/me/library/playlists"
     try:
-        response = requests.get(url, headers=headers)
+        response = http_client.get(url, headers=headers)
         if response.status_code != 200:
             logger.error("Error fetching playlists: %s", response.text)
             return (
@@ -152,7 +152,7 @@ def get_playlists():
             # Build the URL to fetch tracks for the playlist.
             tracks_url = f"https://api.music.apple.com/v1/me/library/playlists/{playlist_id}/tracks"
             try:
-                tracks_response = requests.get(tracks_url, headers=headers)
+                tracks_response = http_client.get(tracks_url, headers=headers)
                 if tracks_response.status_code == 200:
                     tracks_data = tracks_response.json()
                     # Extract the list of tracks; this response is assumed to
@@ -252,7 +252,7 @@ def get_album_tracks(album_id):
 
     url = f"https://api.music.apple.com/v1/me/library/albums/{album_id}/tracks"
     try:
-        response = requests.get(url, headers=headers)
+        response = http_client.get(url, headers=headers)
         if response.status_code != 200:
             logger.error(
                 "Error fetching tracks for album %s: %s", album_id, response.text
@@ -326,7 +326,7 @@ def playlist_duration():
 
     url = f"https://api.music.apple.com/v1/me/library/playlists/{playlist_id}/tracks"
     try:
-        response = requests.get(url, headers=headers)
+        response = http_client.get(url, headers=headers)
         if response.status_code != 200:
             logger.error(
                 "Error fetching tracks for playlist %s: %s", playlist_id, response.text
@@ -1,17 +1,24 @@
-from flask import Blueprint, Response, request, jsonify
+from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
 from flask_limiter import Limiter
 from flask_cors import CORS
 from flask_limiter.util import get_remote_address
 from util.spotify import get_current_user_profile
+from util.google import get_current_user_profile_google
 from Blueprints.google_api import get_google_profile
 from util.models import LinkedAppRequest, UserEmailRequest  # Import the model
 from util.logit import get_logger
 from util.utils import get_email_username, obfuscate
 import database.firebase_operations as firebase_operations
+from database.app_registry import APPLE_MUSIC, GOOGLE, SPOTIFY, YOUTUBE_MUSIC, app_registry
 from pydantic import ValidationError
 from config.config import settings
 from util.authlib import requires_scope
+from util import fanout
+from util.deadline import DeadlineExceeded
+from util.rate_limit import RateLimitTimeout
+from util.tokens import TokenRevoked
+from requests.exceptions import RequestException
 
 apps_bp = Blueprint("apps", __name__)
 limiter = Limiter(key_func=get_remote_address)
@@ -35,29 +42,21 @@ def apps_healthcheck():
     return jsonify({"status": "ok", "service": "Apps Service"}), 200
 
 
-APP_ALIAS_TO_ID = {
-    "Spotify": 1,
-    "AppleMusic": 2,
-    "YoutubeMusic": 3,
-    "Google API": 4,
-}
-
-
 def get_app_id_by_alias(alias: str) -> int:
     """
     Retrieves the application ID based on the given application alias.
 
     Parameters:
-    alias (str): The alias of the application. The alias should be one of the keys in the APP_ALIAS_TO_ID dictionary.
+    alias (str): The alias of the application, as known to the app registry.
 
     Returns:
     int: The ID of the application corresponding to the given alias.
-         Raises ValueError if the alias is not found in the APP_ALIAS_TO_ID dictionary.
+         Raises ValueError if the alias is not found in the app registry.
 
     Raises:
-    ValueError: If the alias is not found in the APP_ALIAS_TO_ID dictionary.
+    ValueError: If the alias is not found in the app registry.
     """
-    app_id = APP_ALIAS_TO_ID.get(alias)
+    app_id = app_registry.get_app_id(alias)
     if app_id is None:
         raise ValueError(f"App alias '{alias}' not configured.")
     return app_id
@@ -75,12 +74,12 @@ def get_app_name_by_alias(app_id: int) -> str:
          Raises ValueError if the application ID is not found.
 
     Raises:
-    ValueError: If the application ID is not found in the APP_ALIAS_TO_ID dictionary.
+    ValueError: If the application ID is not found in the app registry.
     """
-    for alias, id_value in APP_ALIAS_TO_ID.items():
-        if id_value == app_id:
-            return alias
-    raise ValueError(f"App ID '{app_id}' not found.")
+    alias = app_registry.get_alias(app_id)
+    if alias is None:
+        raise ValueError(f"App ID '{app_id}' not found.")
+    return alias
 
 
 @apps_bp.route("/check_linked_app", methods=["POST"])
@@ -111,7 +110,7 @@ def check_linked_app():
     user_email = payload.user_email
 
     user_id = firebase_operations.get_user_id_by_email(user_email)
-    app_id = firebase_operations.get_app_id_by_name(app_name)
+    app_id = app_registry.get_app_id(app_name)
     # print(app_id, user_id, app_name, user_email)
 
     if not app_name or not user_email:
@@ -148,16 +147,16 @@ def check_linked_app():
 
         if user_linked:
 
-            linked_app = get_app_name_by_alias(app_id)
+            kind = app_registry.get_kind(app_id)
 
-            if linked_app == "Spotify":
+            if kind == SPOTIFY:
 
                 user_profile = get_current_user_profile(
                     access_token, user_id, app_id)
                 return jsonify(
                     {"user_linked": True, "user_profile": user_profile}), 200
 
-            elif linked_app == "AppleMusic":
+            elif kind == APPLE_MUSIC:
                 return (
                     jsonify(
                         {
@@ -167,11 +166,11 @@ def check_linked_app():
                     ),
                     200,
                 )
-            elif linked_app == "YoutubeMusic":
+            elif kind == YOUTUBE_MUSIC:
                 user_profile = get_google_profile(user_email)
                 return jsonify(
                     {"user_linked": True, "user_profile": user_profile}), 200
-            elif linked_app == "Google API":
+            elif kind == GOOGLE:
                 return (
                     jsonify(
                         {
@@ -217,7 +216,7 @@ def unlink_app():
     This function receives a POST request containing the user's email and the application name.
     It validates the request payload, retrieves the user ID and application ID from the database,
     and then deletes the user-application link from the database.
-    If the application ID is 3 (Youtube Music), it also deletes the link with Google API.
+    Unlinking Youtube Music also deletes the link with Google API, which shares its token.
 
     Parameters:
     - request.get_json(): A JSON object containing the user's email and the application name.
@@ -235,12 +234,14 @@ def unlink_app():
     user_email = payload.user_email
 
     user_id = firebase_operations.get_user_id_by_email(user_email)
-    app_id = firebase_operations.get_app_id_by_name(app_name)
+    app_id = app_registry.get_app_id(app_name)
 
     if not app_id:
         return jsonify({"error": "All fields are required"}), 400
-    if app_id == 3:
-        firebase_operations.delete_userlinkedapps(user_id, 4)
+    if app_registry.get_kind(app_id) == YOUTUBE_MUSIC:
+        google_app_id = app_registry.get_app_id_by_kind(GOOGLE)
+        if google_app_id:
+            firebase_operations.delete_userlinkedapps(user_id, google_app_id)
 
     firebase_operations.delete_userlinkedapps(user_id, app_id)
 
@@ -289,47 +290,75 @@ def get_all_apps_binding():
     if not user_id:
         return jsonify({"error": "User not found."}), 400
 
+    registered_apps = app_registry.items()
+
+    # One batched read for every app's tokens instead of one query per app
+    linked_rows = firebase_operations.get_userlinkedapps_for_user(
+        user_id, [app_id for _, app_id in registered_apps])
+
+    # Start every provider check at once, so the endpoint takes as long as
+    # the slowest provider instead of the sum. YoutubeMusic and Google API
+    # share one Google token, so their profile is fetched once.
+    checks = {}
+    google_checks = {}
+    for app_name, app_id in registered_apps:
+        row = linked_rows.get(app_id)
+        if not row or not row.get("access_token"):
+            continue
+        access_token = row["access_token"]
+        kind = app_registry.get_kind(app_id)
+        if kind == SPOTIFY:
+            checks[app_id] = fanout.submit(
+                get_current_user_profile, access_token, user_id, app_id, raise_revoked=True
+            )
+        elif kind in (YOUTUBE_MUSIC, GOOGLE):
+            if access_token not in google_checks:
+                google_checks[access_token] = fanout.submit(
+                    get_current_user_profile_google, access_token, user_id, raise_revoked=True
+                )
+            checks[app_id] = google_checks[access_token]
+
     apps_status = []
-    for app_name, app_id in APP_ALIAS_TO_ID.items():
-        response = firebase_operations.get_userlinkedapps_tokens(user_id, app_id)
+    for app_name, app_id in registered_apps:
+        row = linked_rows.get(app_id)
         user_linked = False
         user_profile = None
 
-        if response and response[0].get("access_token"):
-            tokens = response[0]["access_token"]
+        if row and row.get("access_token"):
+            kind = app_registry.get_kind(app_id)
             try:
-                if app_name == "Spotify":
-                    user_profile_candidate = get_current_user_profile(tokens[0], user_id, app_id)
-                    if user_profile_candidate is None:
-                        raise Exception("Spotify token/profile fetch failed")
+                if kind == SPOTIFY:
+                    # None is a failed lookup (e.g. a 5xx), not a broken link.
                     user_linked = True
-                    user_profile = user_profile_candidate
-                elif app_name == "AppleMusic":
+                    user_profile = fanout.result(checks[app_id], f"checking {app_name}")
+                elif kind == APPLE_MUSIC:
                     user_linked = True
                     user_profile = {"name": get_email_username(user_email)}
-                elif app_name in ("YoutubeMusic", "Google API"):
-                    profile = get_google_profile(user_email)
-                    # If it's a Flask response (error), handle as failure!
-                    if isinstance(profile, Response):
-                        # Optionally log: logger.warning(f"Google profile for {app_name} is a Response object!")
-                        firebase_operations.delete_userlinkedapps(user_id, app_id)
-                        user_linked = False
-                        user_profile = None
-                    elif isinstance(profile, dict) and profile.get("error"):
-                        firebase_operations.delete_userlinkedapps(user_id, app_id)
-                        user_linked = False
-                        user_profile = None
-                    else:
-                        user_linked = True
-                        user_profile = profile
+                elif kind in (YOUTUBE_MUSIC, GOOGLE):
+                    # The stored row already carries the Google token, so there
+                    # is no need to look the user, app and tokens up again.
+                    profile = fanout.result(checks[app_id], f"checking {app_name}")
+                    user_linked = True
+                    user_profile = None if profile is None or profile.get("error") else profile
                 else:
                     user_profile = None
                     user_linked = True  # Or False depending on logic
-            except Exception as e:
-                logger.info(f"Deleted {app_name} binding for user {obfuscate(user_email)} due to expired token/profile error.", e)
+            except TokenRevoked as e:
+                # The provider refused the credentials: the link is dead.
+                logger.info(f"Deleted {app_name} binding for user {obfuscate(user_email)} due to revoked credentials: {e}")
                 firebase_operations.delete_userlinkedapps(user_id, app_id)
                 user_linked = False
                 user_profile = None
+            except (DeadlineExceeded, RateLimitTimeout, RequestException):
+                # Out of time, a full rate-limit queue, an open circuit
+                # (CircuitOpenError) or a network error is not a broken link:
+                # keep it, without a profile.
+                user_linked = True
+                user_profile = None
+            except Exception as e:
+                logger.error(f"Checking the {app_name} binding of user {obfuscate(user_email)} failed: {e}")
+                user_linked = True
+                user_profile = None
 
         if not user_linked:
             user_profile = None
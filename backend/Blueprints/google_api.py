@@ -5,9 +5,10 @@ from flask_cors import CORS
 from flask_limiter.util import get_remote_address
 from pydantic import ValidationError
 import database.firebase_operations as firebase_operations
+from database.app_registry import GOOGLE, app_registry
 from util.models import UserEmailRequest
 from util.utils import get_email_username
-from util.google import get_current_user_profile_google
+from util.google import get_current_user_profile_google, google_app_ids
 from util.logit import get_logger
 from google_auth_oauthlib.flow import Flow
 from util.authlib import requires_scope
@@ -153,9 +154,8 @@ def google_api_callback():
             logger.error("User not found for email: %s", user_email)
             return jsonify({"error": "User not found."}), 404
 
-        # Fetch the app_id for the Google app from the Apps table.
-        # Assumes your app is registered with the name "Google".
-        app_id = firebase_operations.get_app_id_by_name("Google")
+        # Look up the app_id of the Google app in the app registry.
+        app_id = app_registry.get_app_id_by_kind(GOOGLE)
         if not app_id:
             logger.error("Google app not configured in Apps table.")
             return jsonify({"error": "Google app not configured."}), 400
@@ -180,15 +180,10 @@ def google_api_callback():
             #    "scopes": scopes
             # }), 200
 
-        # Save the token details into the database.
-        firebase_operations.delete_userlinkedapps(user_id, 4)
-        firebase_operations.delete_userlinkedapps(user_id, 3)
-
-        firebase_operations.insert_userlinkedapps(
-            user_id, 4, access_token, refresh_token, token_expires_at, scopes
-        )
-        firebase_operations.insert_userlinkedapps(
-            user_id, 3, access_token, refresh_token, token_expires_at, scopes
+        # Save the token details for YouTube Music and Google API in one
+        # atomic batch.
+        firebase_operations.replace_userlinkedapps(
+            user_id, google_app_ids(), access_token, refresh_token, token_expires_at, scopes
         )
         logger.info(
             "Google API token saved for user_id: %s, app_id: %s", user_id, app_id
@@ -254,7 +249,7 @@ def google_profile():
 
         # Retrieve the Google app id (assumes your app is registered with the
         # name "Google")
-        app_id_data = firebase_operations.get_app_id_by_name("Google")
+        app_id_data = app_registry.get_app_id_by_kind(GOOGLE)
         if not app_id_data:
             return jsonify({"error": "Google app not configured."}), 400
         app_id = app_id_data
@@ -323,7 +318,7 @@ def get_google_profile(user_email):
 
         # Retrieve the Google app id (assumes your app is registered with the
         # name "Google")
-        app_id_data = firebase_operations.get_app_id_by_name("Google")
+        app_id_data = app_registry.get_app_id_by_kind(GOOGLE)
         if not app_id_data:
             return jsonify({"error": "Google app not configured."}), 400
         app_id = app_id_data
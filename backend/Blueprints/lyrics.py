@@ -1,7 +1,7 @@
 from flask import Blueprint, request, jsonify
 from flask_cors import CORS
 from flask_jwt_extended import jwt_required
-import requests
+from util.http_client import http_client
 from config.config import settings
 from util.logit import get_logger
 from util.authlib import requires_scope
@@ -61,7 +61,7 @@ def get_lyrics():
     params = {"apikey": api_key, "q_track": track, "q_artist": artist}
 
     # Make the GET request to Musixmatch API
-    response = requests.get(endpoint, params=params)
+    response = http_client.get(endpoint, params=params)
 
     if response.status_code != 200:
         return (
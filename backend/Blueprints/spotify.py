@@ -4,7 +4,7 @@ from flask_jwt_extended import jwt_required
 from flask_limiter import Limiter
 from flask_cors import CORS
 from flask_limiter.util import get_remote_address
-import requests
+from util.http_client import http_client
 from util.spotify import (
     get_user_profile,
     fetch_user_playlists,
@@ -261,7 +261,7 @@ def callback():
     "client_id": CLIENT_ID,
     "client_secret": CLIENT_SECRET,
     }
-    resp = requests.post(token_url,
+    resp = http_client.post(token_url,
                          data=token_data,
                          headers={"Content-Type": "application/x-www-form-urlencoded"})
     if resp.status_code != 200:
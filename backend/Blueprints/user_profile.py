@@ -82,7 +82,12 @@ def view_profile():
 def get_current_user_chain_status():
     current_user = get_jwt_identity()
     user_id = firebase_operations.get_user_id_by_email(current_user)
-    chain_status = firebase_operations.get_user_chain_status(user_id)
+    # "history" covers the recent calendar window by default (the mobile chain
+    # page reads it); include_history=true returns every active day.
+    include_history = request.args.get("include_history", "false").lower() == "true"
+    chain_status = firebase_operations.get_user_chain_status(
+        user_id, include_history=include_history
+    )
     if chain_status:
         return jsonify(chain_status), 200
     return jsonify({"error": "Chain not found"}), 404
@@ -4,6 +4,8 @@ from util.logit import get_logger
 from util.utils import route_descriptions
 from util.authlib import requires_scope
 from config.config import settings
+from database.metrics import storage_metrics
+from util.http_client import http_client
 
 util_bp = Blueprint("util", __name__)
 logger = get_logger("logs", "App Utils")
@@ -74,6 +76,31 @@ def list_endpoints():
         return text_output, 200, {"Content-Type": "text/plain"}
 
 
+@util_bp.route("/firestore_metrics", methods=["GET", "DELETE"])
+@requires_scope("admin")
+def firestore_metrics():
+    """
+    Returns the per-endpoint storage operation aggregates of this process:
+    request count, reads/queries/writes/transactions per request (average and
+    maximum) and a latency histogram per operation kind. DELETE resets them.
+    """
+    if request.method == "DELETE":
+        storage_metrics.reset()
+        return jsonify({"message": "Firestore metrics reset."}), 200
+    return jsonify(endpoints=storage_metrics.snapshot()), 200
+
+
+@util_bp.route("/upstream_metrics", methods=["GET"])
+@requires_scope("admin")
+def upstream_metrics():
+    """
+    Returns the outbound HTTP state of this process per upstream host:
+    circuit breaker state, consecutive failures and request, retry, error
+    and short-circuit counters.
+    """
+    return jsonify(hosts=http_client.stats()), 200
+
+
 @util_bp.route("/healthcheck", methods=["POST", "GET"])
 def app_healthcheck():
     # gui.log("App healthcheck requested")
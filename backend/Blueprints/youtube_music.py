@@ -4,13 +4,14 @@ from flask_limiter import Limiter
 from flask_cors import CORS
 from flask_limiter.util import get_remote_address
 from config.config import settings
-from util.youtube import playlist_items
+from util.youtube import playlist_items, youtube_get
 from util.utils import ms2FormattedDuration
 from util.logit import get_logger
-import requests
 from pydantic import ValidationError
 import database.firebase_operations as firebase_operations
-from util.google import refresh_access_token_and_update_db_for_Google
+from database.app_registry import YOUTUBE_MUSIC, app_registry
+from util.google import google_credentials
+from util.deadline import DeadlineExceeded
 from util.models import PlaylistItemsRequest
 from util.authlib import requires_scope
 from util.models import UserEmailRequest
@@ -59,6 +60,16 @@ GOOGLE_CLIENT_SECRETS_FILE = f"keys/{settings.google_client_secret_file}"
 # configuration
 
 
+def _token_renewer(user_id, app_id):
+    """
+    Returns the renew_token callable of util.youtube for the user: it
+    replaces a token the YouTube API rejected with 401 by a new one.
+    """
+    return lambda stale_token: google_credentials.get_access_token(
+        user_id, app_id, stale_token=stale_token
+    )
+
+
 @youtubeMusic_bp.route("/playlists", methods=["POST"])
 @jwt_required()
 @requires_scope("youtube")
@@ -90,24 +101,14 @@ def get_playlists():
         if not user_id:
             return jsonify({"error": "User not found."}), 404
 
-        # Retrieve the YouTube Music app ID (assumed to be 3 for YouTube Music)
-        app_id = 3
+        # Retrieve the YouTube Music app ID from the app registry
+        app_id = app_registry.get_app_id_by_kind(YOUTUBE_MUSIC)
         if not app_id:
             return jsonify({"error": "YouTube Music app not configured."}), 400
 
-        # Retrieve stored token details for the user
-        result = firebase_operations.get_userlinkedapps_access_refresh(user_id, app_id)[
-            0
-        ]
-        access_token, refresh_token = result["access_token"], result["refresh_token"]
-        # access_token)
-        # print(refresh_token)
-
-        # Refresh the access token if needed
-        new_access_token = refresh_access_token_and_update_db_for_Google(
-            user_id, refresh_token
-        )
-        if not new_access_token or not new_access_token[0]:
+        # Cached token, refreshed when it is about to expire or rejected
+        new_access_token = google_credentials.get_access_token(user_id, app_id)
+        if not new_access_token:
             return (
                 jsonify(
                     {
@@ -118,6 +119,7 @@ def get_playlists():
             )
 
         access_token = new_access_token
+        renew_token = _token_renewer(user_id, app_id)
         # print(access_token, "Access")
 
         # Fetch playlists from the YouTube API
@@ -128,8 +130,7 @@ def get_playlists():
             "client_id": settings.google_client_id,
             "maxResults": playlist_count_limit,  # Optional: adjust as needed
         }
-        headers = {"Authorization": f"Bearer {access_token}"}
-        response = requests.get(url, headers=headers, params=params)
+        response, access_token = youtube_get(url, access_token, renew_token, params=params)
         if response.status_code != 200:
             logger.error("Error fetching playlists: %s", response.text)
             return (
@@ -156,9 +157,14 @@ def get_playlists():
                 "client_id": settings.google_client_id,
                 "maxResults": 50,
             }
-            channels_response = requests.get(
-                channels_url, headers=headers, params=channels_params
-            )
+            try:
+                channels_response, access_token = youtube_get(
+                    channels_url, access_token, renew_token, params=channels_params
+                )
+            except DeadlineExceeded:
+                # Out of time: return the playlists without images and tracks.
+                playlists_data["partial"] = True
+                return jsonify(playlists_data), 200
             if channels_response.status_code == 200:
                 channels_data = channels_response.json()
                 # Build a mapping from channelId to channel image URL
@@ -186,7 +192,7 @@ def get_playlists():
                     # print(playlist_id)
                     try:
                         tracks, total_duration, total_tracks = playlist_items(
-                            access_token, playlist_id
+                            access_token, playlist_id, renew_token
                         )
                         item["tracks"] = tracks
                         item["total_duration"] = total_duration
@@ -195,6 +201,10 @@ def get_playlists():
                         )
                         item["total_tracks"] = total_tracks
 
+                    except DeadlineExceeded:
+                        # Out of time and nothing cached for this playlist.
+                        item["tracks"] = []
+                        playlists_data["partial"] = True
                     except Exception as err:
                         logger.error(
                             "Error fetching tracks for playlist %s: %s",
@@ -253,18 +263,13 @@ def playlist_tracks():
         if not user_id:
             return jsonify({"error": "User not found."}), 404
 
-        # Retrieve YouTube Music app ID (assumed to be 3)
-        app_id = 3
-        result = firebase_operations.get_userlinkedapps_access_refresh(user_id, app_id)[
-            0
-        ]
-        access_token, refresh_token = result["access_token"], result["refresh_token"]
-
-        # Refresh the access token if needed
-        new_access_token = refresh_access_token_and_update_db_for_Google(
-            user_id, refresh_token
-        )
-        if not new_access_token or not new_access_token[0]:
+        # Retrieve the YouTube Music app ID from the app registry
+        app_id = app_registry.get_app_id_by_kind(YOUTUBE_MUSIC)
+        if not app_id:
+            return jsonify({"error": "YouTube Music app not configured."}), 400
+        # Cached token, refreshed when it is about to expire or rejected
+        new_access_token = google_credentials.get_access_token(user_id, app_id)
+        if not new_access_token:
             return (
                 jsonify(
                     {
@@ -284,7 +289,7 @@ def playlist_tracks():
         )
 
     tracks, total_duration, total_tracks = playlist_items(
-        access_token, playlist_id)
+        access_token, playlist_id, _token_renewer(user_id, app_id))
     logger.info(
         "Successfully fetched %d tracks for playlist %s", total_tracks, playlist_id
     )
@@ -333,18 +338,13 @@ def get_playlist_duration():
         if not user_id:
             return jsonify({"error": "User not found."}), 404
 
-        # Retrieve YouTube Music app ID (assumed to be 3)
-        app_id = 3
-        result = firebase_operations.get_userlinkedapps_access_refresh(user_id, app_id)[
-            0
-        ]
-        access_token, refresh_token = result["access_token"], result["refresh_token"]
-
-        # Refresh the access token if needed
-        new_access_token = refresh_access_token_and_update_db_for_Google(
-            user_id, refresh_token
-        )
-        if not new_access_token or not new_access_token[0]:
+        # Retrieve the YouTube Music app ID from the app registry
+        app_id = app_registry.get_app_id_by_kind(YOUTUBE_MUSIC)
+        if not app_id:
+            return jsonify({"error": "YouTube Music app not configured."}), 400
+        # Cached token, refreshed when it is about to expire or rejected
+        new_access_token = google_credentials.get_access_token(user_id, app_id)
+        if not new_access_token:
             return (
                 jsonify(
                     {
@@ -363,7 +363,8 @@ def get_playlist_duration():
             500,
         )
 
-    _, total_duration, total_tracks = playlist_items(access_token, playlist_id)
+    _, total_duration, total_tracks = playlist_items(
+        access_token, playlist_id, _token_renewer(user_id, app_id))
     return (
         jsonify(
             {
@@ -405,24 +406,14 @@ def fetch_first_video_id():
         if not user_id:
             return jsonify({"error": "User not found."}), 404
 
-        # Retrieve the YouTube Music app ID (assumed to be 3 for YouTube Music)
-        app_id = 3
+        # Retrieve the YouTube Music app ID from the app registry
+        app_id = app_registry.get_app_id_by_kind(YOUTUBE_MUSIC)
         if not app_id:
             return jsonify({"error": "YouTube Music app not configured."}), 400
 
-        # Retrieve stored token details for the user
-        result = firebase_operations.get_userlinkedapps_access_refresh(user_id, app_id)[
-            0
-        ]
-        access_token, refresh_token = result["access_token"], result["refresh_token"]
-        # print(access_token)
-        # print(refresh_token)
-
-        # Refresh the access token if needed
-        new_access_token = refresh_access_token_and_update_db_for_Google(
-            user_id, refresh_token
-        )
-        if not new_access_token or not new_access_token[0]:
+        # Cached token, refreshed when it is about to expire or rejected
+        new_access_token = google_credentials.get_access_token(user_id, app_id)
+        if not new_access_token:
             return (
                 jsonify(
                     {
@@ -450,10 +441,11 @@ def fetch_first_video_id():
         "maxResults": "1",
         "client_id": settings.google_client_id,
     }
-    headers = {"Authorization": f"Bearer {access_token}"}
 
     try:
-        response = requests.get(url, headers=headers, params=params)
+        response, _ = youtube_get(
+            url, access_token, _token_renewer(user_id, app_id), params=params
+        )
         if response.status_code == 200:
             data = response.json()
             if data and "items" in data and len(data["items"]) > 0:
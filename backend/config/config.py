@@ -20,6 +20,38 @@ class Settings(BaseSettings):
     SECRET_KEY: str = Field(default_factory=lambda: secrets.token_hex(16))
     apple_developer_token: str = Field(..., env="APPLE_DEVELOPER_TOKEN")
     firebase_json: str = Field(..., env="FIREBASE_CC_JSON")
+    storage_backend: str = Field(default="firestore", env="STORAGE_BACKEND")
+    storage_warm_up: bool = Field(default=False, env="STORAGE_WARM_UP")
+    user_cache_ttl: int = Field(default=600, env="USER_CACHE_TTL")
+    user_cache_maxsize: int = Field(default=10000, env="USER_CACHE_MAXSIZE")
+    user_id_block_size: int = Field(default=20, env="USER_ID_BLOCK_SIZE")
+    app_registry_refresh_seconds: int = Field(default=300, env="APP_REGISTRY_REFRESH_SECONDS")
+    token_refresh_lease_seconds: int = Field(default=0, env="TOKEN_REFRESH_LEASE_SECONDS")
+    token_refresher_enabled: bool = Field(default=False, env="TOKEN_REFRESHER_ENABLED")
+    token_refresher_interval_seconds: int = Field(default=60, env="TOKEN_REFRESHER_INTERVAL_SECONDS")
+    token_refresh_ahead_minutes: int = Field(default=10, env="TOKEN_REFRESH_AHEAD_MINUTES")
+    token_refresher_concurrency: int = Field(default=4, env="TOKEN_REFRESHER_CONCURRENCY")
+    token_refresher_batch_size: int = Field(default=500, env="TOKEN_REFRESHER_BATCH_SIZE")
+    token_refresher_active_days: int = Field(default=7, env="TOKEN_REFRESHER_ACTIVE_DAYS")
+    http_pool_maxsize: int = Field(default=20, env="HTTP_POOL_MAXSIZE")
+    http_connect_timeout: float = Field(default=3.05, env="HTTP_CONNECT_TIMEOUT")
+    http_read_timeout: float = Field(default=20, env="HTTP_READ_TIMEOUT")
+    http_max_retries: int = Field(default=3, env="HTTP_MAX_RETRIES")
+    http_backoff_base: float = Field(default=0.5, env="HTTP_BACKOFF_BASE")
+    http_backoff_max: float = Field(default=10, env="HTTP_BACKOFF_MAX")
+    http_breaker_threshold: int = Field(default=5, env="HTTP_BREAKER_THRESHOLD")
+    http_breaker_reset_seconds: float = Field(default=30, env="HTTP_BREAKER_RESET_SECONDS")
+    rate_limit_backend: str = Field(default="memory", env="RATE_LIMIT_BACKEND")
+    rate_limit_dir: str = Field(default="ratelimits", env="RATE_LIMIT_DIR")
+    rate_limit_max_wait: float = Field(default=5, env="RATE_LIMIT_MAX_WAIT")
+    rate_limits: dict = Field(default_factory=dict, env="RATE_LIMITS")
+    request_budget_seconds: float = Field(default=25, env="REQUEST_BUDGET_SECONDS")
+    endpoint_budgets: dict = Field(default_factory=dict, env="ENDPOINT_BUDGETS")
+    firestore_timeout: float = Field(default=10, env="FIRESTORE_TIMEOUT")
+    firestore_min_write_timeout: float = Field(default=3, env="FIRESTORE_MIN_WRITE_TIMEOUT")
+    fanout_workers: int = Field(default=8, env="FANOUT_WORKERS")
+    playlist_cache_maxsize: int = Field(default=2000, env="PLAYLIST_CACHE_MAXSIZE")
+    playlist_cache_stale_seconds: int = Field(default=6 * 3600, env="PLAYLIST_CACHE_STALE_SECONDS")
 
     class Config:
         env_file = ".env"
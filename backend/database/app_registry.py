@@ -0,0 +1,160 @@
+# app_registry.py
+"""
+In-memory registry of the Apps table.
+
+The Apps table changes only when an integration is added, yet the blueprints
+used to query it on every request. The registry keeps it in memory with O(1)
+lookups in both directions (name -> app_id, app_id -> name), and reloads it
+from the storage backend every ``settings.app_registry_refresh_seconds``, or
+as soon as the invalidation bus reports a change to the Apps table.
+
+It is seeded with DEFAULT_APPS, so lookups work before the first load and
+keep working if the backend is unreachable.
+
+Code that needs a specific integration looks it up by its ``kind`` (one of
+the constants below), never by app_id or by display name: both are data of
+the Apps table and may differ between deployments.
+"""
+
+import threading
+import time
+from config.config import settings
+from database.invalidation import invalidation_bus
+from database.storage import get_storage
+from util.logit import get_logger
+
+logger = get_logger("logs", "AppRegistry")
+
+# Stable identifiers of the integrations, stored in the "kind" field of Apps.
+SPOTIFY = "spotify"
+APPLE_MUSIC = "apple_music"
+YOUTUBE_MUSIC = "youtube_music"
+GOOGLE = "google"
+
+# The production Apps table, used until the first successful load. A
+# "display_name" is the name shown to API clients where it differs from
+# app_name.
+DEFAULT_APPS = [
+    {"app_id": 1, "app_name": "Spotify", "kind": SPOTIFY},
+    {"app_id": 2, "app_name": "AppleMusic", "kind": APPLE_MUSIC},
+    {"app_id": 3, "app_name": "YoutubeMusic", "kind": YOUTUBE_MUSIC},
+    {"app_id": 4, "app_name": "Google", "kind": GOOGLE, "display_name": "Google API"},
+]
+
+# Apps documents written before "kind" and "display_name" existed get them
+# from the default row of the same app_name.
+_LEGACY_APPS = {app["app_name"]: app for app in DEFAULT_APPS}
+
+
+class AppRegistry:
+    """
+    Thread-safe name <-> app_id <-> kind lookup table for the Apps collection.
+
+    Parameters:
+    refresh_seconds (float): How long a loaded table is used before it is
+                             reloaded on the next lookup.
+    apps (list): The table used until the first load, as returned by
+                 StorageBackend.list_apps.
+    """
+
+    def __init__(self, refresh_seconds: float, apps: list = DEFAULT_APPS):
+        self.refresh_seconds = refresh_seconds
+        self._refresh_lock = threading.Lock()
+        self._loaded_at = None
+        self._set_apps(apps)
+
+    def _set_apps(self, apps: list) -> None:
+        names, aliases, kinds = {}, {}, {}
+        for app in apps:
+            app_id, name = app["app_id"], app["app_name"]
+            legacy = _LEGACY_APPS.get(name, {})
+            names[app_id] = name
+            aliases[app_id] = app.get("display_name") or legacy.get("display_name") or name
+            kinds[app_id] = app.get("kind") or legacy.get("kind")
+        ids = {name: app_id for app_id, name in names.items()}
+        ids.update({alias: app_id for app_id, alias in aliases.items()})
+        # Swap all maps at once; readers never see a half-built table.
+        ids_by_kind = {kind: app_id for app_id, kind in kinds.items() if kind}
+        self._maps = (ids, names, aliases, kinds, ids_by_kind)
+
+    def refresh(self) -> bool:
+        """
+        Reloads the table from the storage backend. On failure the current
+        table is kept and the error is logged.
+
+        Returns:
+        bool: Whether the table was reloaded.
+        """
+        with self._refresh_lock:
+            self._loaded_at = time.monotonic()
+            try:
+                apps = get_storage().list_apps()
+            except Exception as e:
+                logger.error("Could not load the Apps table: %s", e)
+                return False
+            if apps:
+                self._set_apps(apps)
+            logger.info("Loaded %s apps into the registry", len(apps))
+            return True
+
+    def invalidate(self) -> None:
+        """
+        Marks the table stale so the next lookup reloads it.
+        """
+        self._loaded_at = None
+
+    def _ensure_fresh(self) -> None:
+        loaded_at = self._loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < self.refresh_seconds:
+            return
+        # Only one thread reloads; the others keep using the current table.
+        if self._refresh_lock.locked():
+            return
+        self.refresh()
+
+    def get_app_id(self, name: str):
+        """
+        Returns the app_id of an app name or display alias, or None.
+        """
+        self._ensure_fresh()
+        return self._maps[0].get(name)
+
+    def get_app_name(self, app_id: int):
+        """
+        Returns the Apps table name of app_id, or None.
+        """
+        self._ensure_fresh()
+        return self._maps[1].get(app_id)
+
+    def get_alias(self, app_id: int):
+        """
+        Returns the display name of app_id (its alias, else its table name), or None.
+        """
+        self._ensure_fresh()
+        return self._maps[2].get(app_id)
+
+    def get_app_id_by_kind(self, kind: str):
+        """
+        Returns the app_id of the integration kind (e.g. YOUTUBE_MUSIC), or None.
+        """
+        self._ensure_fresh()
+        return self._maps[4].get(kind)
+
+    def get_kind(self, app_id: int):
+        """
+        Returns the integration kind of app_id, or None for unknown apps.
+        """
+        self._ensure_fresh()
+        return self._maps[3].get(app_id)
+
+    def items(self) -> list:
+        """
+        Returns [(display name, app_id), ...] for every app, ordered by app_id.
+        """
+        self._ensure_fresh()
+        return [(alias, app_id) for app_id, alias in sorted(self._maps[2].items())]
+
+
+app_registry = AppRegistry(settings.app_registry_refresh_seconds)
+# Any change to the Apps table, on any node, triggers a reload.
+invalidation_bus.subscribe("apps", lambda data: app_registry.invalidate())
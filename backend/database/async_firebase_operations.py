@@ -0,0 +1,391 @@
+# async_firebase_operations.py
+"""
+asyncio variant of database.firebase_operations.
+
+Every function mirrors the synchronous function of the same name (same
+arguments, same return values) as a coroutine, so independent lookups can
+run concurrently:
+
+    profile, chain = await asyncio.gather(
+        get_user_profile(user_id), get_user_chain_status(user_id)
+    )
+
+With STORAGE_BACKEND=firestore the calls go through AsyncFirestoreStorage
+(firestore.AsyncClient). Other backends have no network I/O and are called
+directly. The in-process caches (user IDs, today's chains) are shared with
+the synchronous module.
+"""
+
+import asyncio
+import copy
+import datetime as DT
+import threading
+import bcrypt
+from config.config import settings
+from database.chains import status_view, updated_on
+from database.firebase_operations import (
+    PROFILE_FIELDS,
+    TOKEN_FIELDS,
+    _token_row,
+    chain_update_cache,
+    user_id_cache,
+)
+from database.storage import get_storage
+
+_async_storage = None
+_async_storage_lock = threading.Lock()
+
+
+class AsyncStorageAdapter:
+    """
+    Exposes a synchronous, in-process backend (such as InMemoryStorage)
+    through the async interface. Its calls never block on I/O, so they run
+    directly on the event loop.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def __getattr__(self, name):
+        method = getattr(self.storage, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return call
+
+
+def get_async_storage():
+    """
+    Returns the process-wide async backend for settings.storage_backend.
+    """
+    global _async_storage
+    if _async_storage is None:
+        with _async_storage_lock:
+            if _async_storage is None:
+                if settings.storage_backend == "firestore":
+                    from database.async_firestore_storage import AsyncFirestoreStorage
+
+                    _async_storage = AsyncFirestoreStorage()
+                else:
+                    _async_storage = AsyncStorageAdapter(get_storage())
+    return _async_storage
+
+
+# ---------------------------
+# Users and Apps Commands
+# ---------------------------
+
+
+async def get_user_id_by_email(email: str):
+    """
+    Emulates:
+      SELECT user_id FROM users WHERE email = ?
+    """
+    user_id = user_id_cache.get(email)
+    if user_id is not None:
+        return user_id
+
+    user_id = await get_async_storage().get_user_id_by_email(email)
+    if user_id is not None:
+        user_id_cache.set(email, user_id)
+    return user_id
+
+
+async def get_app_id_by_name(app_name: str):
+    """
+    Emulates:
+      SELECT app_id FROM Apps WHERE app_name = ?
+    """
+    return await get_async_storage().get_app_id_by_name(app_name)
+
+
+async def list_apps() -> list:
+    """
+    Emulates:
+      SELECT app_id, app_name FROM Apps
+    """
+    return await get_async_storage().list_apps()
+
+
+async def get_userlinkedapps_count_and_access_token(app_id: int, user_id: int):
+    """
+    Emulates:
+      SELECT COUNT(*), access_token FROM UserLinkedApps WHERE app_id = ? AND user_id = ?
+
+    Returns a tuple: (count, [list of access_tokens])
+    """
+    data = await get_async_storage().get_userlinkedapp(user_id, app_id, fields=["access_token"])
+    if data is None:
+        return 0, []
+    access_tokens = [data["access_token"]] if "access_token" in data else []
+    return 1, access_tokens
+
+
+async def delete_userlinkedapps(user_id: int, app_id: int):
+    """
+    Emulates:
+      DELETE FROM UserLinkedApps WHERE app_id = ? AND user_id = ?
+    """
+    await get_async_storage().delete_userlinkedapp(user_id, app_id)
+
+
+# ---------------------------
+# Auth Commands
+# ---------------------------
+
+
+async def get_next_user_id() -> int:
+    return await get_async_storage().next_user_id()
+
+
+async def insert_user(email: str, password: str) -> int:
+    """
+    Emulates:
+      INSERT INTO users (email, password) VALUES (?, ?)
+
+    bcrypt runs in a worker thread so hashing does not stall the event loop.
+    Returns the new user_id.
+    """
+    hashed = await asyncio.to_thread(
+        bcrypt.hashpw, password.encode("utf-8"), bcrypt.gensalt()
+    )
+    storage = get_async_storage()
+    user_id = await storage.next_user_id()
+    await storage.insert_user(user_id, email, hashed.decode("utf-8"))
+    user_id_cache.set(email, user_id)
+    return user_id
+
+
+async def get_user_password_and_email(email: str):
+    """
+    Emulates:
+      SELECT password, email FROM users WHERE email = ?
+    """
+    return await get_async_storage().get_user_password_and_email(email)
+
+
+# ---------------------------
+# Linked Apps Commands
+# ---------------------------
+
+
+async def get_userlinkedapps_tokens(user_id: int, app_id: int):
+    """
+    Emulates:
+      SELECT access_token, refresh_token, token_expires_at, scopes
+      FROM UserLinkedApps
+      WHERE user_id = ? AND app_id = ?
+    """
+    data = await get_async_storage().get_userlinkedapp(user_id, app_id, fields=TOKEN_FIELDS)
+    if data is None:
+        return []
+    return [_token_row(data)]
+
+
+async def get_userlinkedapps_for_user(user_id: int, app_ids) -> dict:
+    """
+    Emulates:
+      SELECT app_id, access_token, refresh_token, token_expires_at, scopes
+      FROM UserLinkedApps
+      WHERE user_id = ? AND app_id IN (?, ?, ...)
+    """
+    rows = await get_async_storage().get_userlinkedapps_for_user(
+        user_id, list(app_ids), fields=TOKEN_FIELDS
+    )
+    return {app_id: _token_row(data) for app_id, data in rows.items()}
+
+
+async def insert_userlinkedapps(
+    user_id: int,
+    app_id: int,
+    access_token: str,
+    refresh_token: str,
+    token_expires_at: int,
+    scopes: str,
+):
+    await replace_userlinkedapps(
+        user_id, (app_id,), access_token, refresh_token, token_expires_at, scopes
+    )
+
+
+async def replace_userlinkedapps(
+    user_id: int,
+    app_ids,
+    access_token: str,
+    refresh_token: str,
+    token_expires_at,
+    scopes: str,
+):
+    """
+    Replaces the rows of every app in app_ids in one atomic write.
+    """
+    await get_async_storage().set_userlinkedapps(
+        user_id,
+        list(app_ids),
+        {
+            "access_token": access_token,
+            "refresh_token": refresh_token,
+            "token_expires_at": token_expires_at,
+            "scopes": scopes,
+        },
+    )
+
+
+async def if_not_exists_insert_userlinkedapps(
+    user_id: int,
+    app_id: int,
+    access_token: str,
+    refresh_token: str,
+    scopes: str,
+):
+    expires = DT.datetime.utcnow() + DT.timedelta(hours=1)
+    await get_async_storage().create_userlinkedapp(
+        user_id,
+        app_id,
+        {
+            "access_token": access_token,
+            "refresh_token": refresh_token,
+            "token_expires_at": expires,
+            "scopes": scopes,
+        },
+    )
+
+
+async def if_not_exists_insert_userlinkedapps_spotify(
+    user_id: int,
+    app_id: int,
+    access_token: str,
+    refresh_token: str,
+    scopes: str,
+):
+    await if_not_exists_insert_userlinkedapps(
+        user_id, app_id, access_token, refresh_token, scopes
+    )
+
+
+async def get_userlinkedapps_access_refresh(user_id: int, app_id: int):
+    """
+    Emulates:
+      SELECT access_token, refresh_token
+      FROM UserLinkedApps
+      WHERE user_id = ? AND app_id = ?
+    """
+    data = await get_async_storage().get_userlinkedapp(
+        user_id, app_id, fields=["access_token", "refresh_token"]
+    )
+    if data is None:
+        return []
+    return [
+        {
+            "access_token": data.get("access_token"),
+            "refresh_token": data.get("refresh_token"),
+        }
+    ]
+
+
+async def update_userlinkedapps_tokens(
+    new_access_token: str,
+    new_refresh_token: str,
+    seconds_from_now: int,
+    user_id: int,
+    app_id: int,
+):
+    await update_userlinkedapps_tokens_for_apps(
+        new_access_token, new_refresh_token, seconds_from_now, user_id, (app_id,)
+    )
+
+
+async def update_userlinkedapps_tokens_for_apps(
+    new_access_token: str,
+    new_refresh_token: str,
+    seconds_from_now: int,
+    user_id: int,
+    app_ids,
+):
+    """
+    Emulates:
+      UPDATE UserLinkedApps
+      SET access_token = ?, refresh_token = ?,
+          token_expires_at = DATEADD(SECOND, ?, GETDATE())
+      WHERE user_id = ? AND app_id IN (?, ...)
+    """
+    new_expires = DT.datetime.utcnow() + DT.timedelta(seconds=seconds_from_now)
+    await get_async_storage().update_userlinkedapps(
+        user_id,
+        list(app_ids),
+        {
+            "access_token": new_access_token,
+            "refresh_token": new_refresh_token,
+            "token_expires_at": new_expires,
+        },
+    )
+
+
+# ---------------------------
+# User Profile Commands
+# ---------------------------
+
+
+async def get_user_profile(user_id: int):
+    """
+    Emulates:
+      SELECT first_name, last_name, avatar_url, bio
+      FROM UserProfiles
+      WHERE user_id = ?
+    """
+    rows = await get_async_storage().get_user_profiles(user_id, fields=PROFILE_FIELDS)
+    return [{field: data.get(field) for field in PROFILE_FIELDS} for data in rows]
+
+
+async def get_user_chain_status(user_id: int, include_history: bool = False):
+    """
+    Retrieve the current chain status for a user, or None, shaped like the
+    synchronous get_user_chain_status().
+    """
+    doc_data = await get_async_storage().get_user_chain_status(
+        user_id, include_history=include_history
+    )
+    if doc_data is None:
+        return None
+    return status_view(doc_data, DT.datetime.utcnow().date(), include_history=include_history)
+
+
+async def upsert_user_chain(user_id: int, action_data: dict):
+    """
+    Upsert (update or insert) the chain status for a user. Once the chain was
+    updated today the cached document is returned without a backend call.
+    """
+    cached = chain_update_cache.get(user_id)
+    if cached is not None and updated_on(cached, DT.datetime.utcnow().date()):
+        return copy.deepcopy(cached)
+
+    doc_data = await get_async_storage().upsert_user_chain(user_id, action_data)
+    chain_update_cache.set(user_id, copy.deepcopy(doc_data))
+    return doc_data
+
+
+async def get_user_overview(email: str, app_ids) -> dict:
+    """
+    Fetches a user's profile, chain status and linked-app tokens concurrently,
+    so the request costs one user lookup plus the slowest of the three reads
+    instead of their sum.
+
+    Returns None if the email is unknown, else:
+      {"user_id": ..., "profile": [...], "chain_status": {...} | None,
+       "linked_apps": {app_id: token row}}
+    """
+    user_id = await get_user_id_by_email(email)
+    if user_id is None:
+        return None
+    profile, chain_status, linked_apps = await asyncio.gather(
+        get_user_profile(user_id),
+        get_user_chain_status(user_id),
+        get_userlinkedapps_for_user(user_id, app_ids),
+    )
+    return {
+        "user_id": user_id,
+        "profile": profile,
+        "chain_status": chain_status,
+        "linked_apps": linked_apps,
+    }
@@ -0,0 +1,273 @@
+# async_firestore_storage.py
+"""
+asyncio counterpart of FirestoreStorage, built on firestore.AsyncClient.
+
+Every method mirrors the StorageBackend method of the same name (same
+arguments, same return values) as a coroutine. Documents are stored exactly
+as the synchronous backend stores them, so both layers can serve the same
+database side by side.
+"""
+
+import asyncio
+import datetime as DT
+import os
+import weakref
+from google.api_core.exceptions import Conflict, NotFound
+from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.transforms import SERVER_TIMESTAMP
+from firebase_admin import firestore
+from config.config import firebase_config
+from database.chains import CHAIN_STATUS_FIELDS, advance_chain, new_chain, updated_on
+from database.firestore_storage import (
+    FirestoreStorage,
+    alias_map,
+    get_userlinkedapps_doc_id,
+    get_users_by_email_doc_id,
+    init_firebase,
+)
+from database.metrics import instrument_storage
+from database.storage import APP_FIELDS, get_storage
+
+
+@instrument_storage
+class AsyncFirestoreStorage:
+    """
+    Async data access on Cloud Firestore, using the collections in alias_map.
+
+    An AsyncClient is bound to the event loop it first runs on, so one client
+    is created per process and event loop, on first use.
+
+    RPC timeouts are derived from the request's budget, as in FirestoreStorage.
+    """
+
+    read_timeout = staticmethod(FirestoreStorage.read_timeout)
+    write_timeout = staticmethod(FirestoreStorage.write_timeout)
+
+    def __init__(self, alias_map: dict = alias_map):
+        self.alias_map = alias_map
+        self._clients = weakref.WeakKeyDictionary()
+        self._pid = None
+
+    @property
+    def db(self):
+        loop = asyncio.get_running_loop()
+        if self._pid != os.getpid():
+            self._clients = weakref.WeakKeyDictionary()
+            self._pid = os.getpid()
+        client = self._clients.get(loop)
+        if client is None:
+            client = init_firebase(firebase_config, client_class=firestore.AsyncClient)
+            self._clients[loop] = client
+        return client
+
+    def get_collection(self, table: str):
+        collection_path = self.alias_map.get(table.lower(), table)
+        return self.db.collection(collection_path)
+
+    def get_userlinkedapps_ref(self, user_id: int, app_id: int):
+        col = self.get_collection("userlinkedapps")
+        return col.document(get_userlinkedapps_doc_id(user_id, app_id))
+
+    # ---------------------------
+    # Users and Apps
+    # ---------------------------
+
+    async def get_user_id_by_email(self, email: str):
+        index_ref = self.get_collection("users_by_email").document(
+            get_users_by_email_doc_id(email)
+        )
+        snap = await index_ref.get(field_paths=["user_id"], timeout=self.read_timeout())
+        if snap.exists:
+            return snap.to_dict().get("user_id")
+
+        user_id = None
+        col = self.get_collection("users")
+        filt = FieldFilter(field_path="email", op_string="==", value=email)
+        async for doc in col.where(filter=filt).select(["user_id"]).limit(1).stream(
+            timeout=self.read_timeout()
+        ):
+            user_id = doc.to_dict().get("user_id")
+        if user_id is not None:
+            await index_ref.set(
+                {"email": email, "user_id": user_id}, timeout=self.write_timeout()
+            )
+        return user_id
+
+    async def next_user_id(self) -> int:
+        # ID blocks are reserved by the synchronous backend's allocator, so
+        # both layers draw from the same process-local block.
+        return await asyncio.to_thread(get_storage().next_user_id)
+
+    async def insert_user(self, user_id: int, email: str, hashed_password: str) -> None:
+        now = DT.datetime.utcnow()
+        index_ref = self.get_collection("users_by_email").document(
+            get_users_by_email_doc_id(email)
+        )
+        batch = self.db.batch()
+        batch.set(self.get_collection("users").document(str(user_id)), {
+            "user_id": user_id,
+            "email": email,
+            "password": hashed_password,
+            "created_at": now,
+            "updated_at": now,
+        })
+        batch.set(index_ref, {"email": email, "user_id": user_id})
+        await batch.commit(timeout=self.write_timeout())
+
+    async def get_user_password_and_email(self, email: str) -> list:
+        col = self.get_collection("users")
+        filt = FieldFilter(field_path="email", op_string="==", value=email)
+        results = []
+        async for doc in col.where(filter=filt).select(["email", "password"]).stream(
+            timeout=self.read_timeout()
+        ):
+            data = doc.to_dict()
+            results.append({"email": data.get("email"),
+                            "password": data.get("password")})
+        return results
+
+    async def get_app_id_by_name(self, app_name: str):
+        col = self.get_collection("apps")
+        filt = FieldFilter(field_path="app_name", op_string="==", value=app_name)
+        async for doc in col.where(filter=filt).select(["app_id"]).stream(timeout=self.read_timeout()):
+            data = doc.to_dict()
+            if "app_id" in data:
+                return data["app_id"]
+        return None
+
+    async def list_apps(self) -> list:
+        col = self.get_collection("apps")
+        apps = []
+        async for doc in col.select(APP_FIELDS).stream(timeout=self.read_timeout()):
+            data = doc.to_dict()
+            if "app_id" in data:
+                apps.append({field: data[field] for field in APP_FIELDS if field in data})
+        return apps
+
+    # ---------------------------
+    # Linked Apps
+    # ---------------------------
+
+    async def get_userlinkedapp(self, user_id: int, app_id: int, fields: list = None):
+        snap = await self.get_userlinkedapps_ref(user_id, app_id).get(
+            field_paths=fields, timeout=self.read_timeout()
+        )
+        return snap.to_dict() if snap.exists else None
+
+    async def get_userlinkedapps_for_user(self, user_id: int, app_ids: list, fields: list = None) -> dict:
+        app_ids = list(app_ids)
+        refs = [self.get_userlinkedapps_ref(user_id, app_id) for app_id in app_ids]
+        if not refs:
+            return {}
+        app_id_by_doc_id = {ref.id: app_id for ref, app_id in zip(refs, app_ids)}
+
+        rows = {}
+        async for snap in self.db.get_all(
+            refs, field_paths=fields, timeout=self.read_timeout()
+        ):
+            if snap.exists:
+                rows[app_id_by_doc_id[snap.id]] = snap.to_dict()
+        return rows
+
+    async def set_userlinkedapps(self, user_id: int, app_ids: list, data: dict) -> None:
+        batch = self.db.batch()
+        for app_id in app_ids:
+            batch.set(
+                self.get_userlinkedapps_ref(user_id, app_id),
+                {
+                    "user_id": user_id,
+                    "app_id": app_id,
+                    "connected_at": SERVER_TIMESTAMP,
+                    "updated_at": SERVER_TIMESTAMP,
+                    **data,
+                },
+            )
+        await batch.commit(timeout=self.write_timeout())
+
+    async def create_userlinkedapp(self, user_id: int, app_id: int, data: dict) -> bool:
+        try:
+            await self.get_userlinkedapps_ref(user_id, app_id).create(
+                {"user_id": user_id, "app_id": app_id, "updated_at": SERVER_TIMESTAMP, **data},
+                timeout=self.write_timeout(),
+            )
+        except Conflict:
+            return False
+        return True
+
+    async def update_userlinkedapps(self, user_id: int, app_ids: list, data: dict) -> None:
+        app_ids = list(app_ids)
+        data = {**data, "updated_at": SERVER_TIMESTAMP}
+        batch = self.db.batch()
+        for app_id in app_ids:
+            batch.update(self.get_userlinkedapps_ref(user_id, app_id), data)
+        try:
+            await batch.commit(timeout=self.write_timeout())
+        except NotFound:
+            for app_id in app_ids:
+                try:
+                    await self.get_userlinkedapps_ref(user_id, app_id).update(
+                        data, timeout=self.write_timeout()
+                    )
+                except NotFound:
+                    pass
+
+    async def delete_userlinkedapp(self, user_id: int, app_id: int) -> None:
+        batch = self.db.batch()
+        batch.delete(self.get_userlinkedapps_ref(user_id, app_id))
+        batch.set(
+            self.get_collection("userlinkedapps_removed").document(
+                get_userlinkedapps_doc_id(user_id, app_id)
+            ),
+            {"user_id": user_id, "app_id": app_id, "removed": True, "updated_at": SERVER_TIMESTAMP},
+        )
+        await batch.commit(timeout=self.write_timeout())
+
+    # ---------------------------
+    # Profiles and Chains
+    # ---------------------------
+
+    async def get_user_profiles(self, user_id: int, fields: list = None) -> list:
+        col = self.get_collection("userprofiles")
+        filt = FieldFilter(field_path="user_id", op_string="==", value=user_id)
+        query = col.where(filter=filt)
+        if fields is not None:
+            query = query.select(fields)
+        return [doc.to_dict() async for doc in query.stream(timeout=self.read_timeout())]
+
+    async def get_user_chain_status(self, user_id: int, include_history: bool = False):
+        col = self.get_collection("userchains")
+        filt = FieldFilter(field_path="user_id", op_string="==", value=user_id)
+        query = col.where(filter=filt)
+        if not include_history:
+            query = query.select(CHAIN_STATUS_FIELDS)
+        async for doc in query.limit(1).stream(timeout=self.read_timeout()):
+            return doc.to_dict()
+        return None
+
+    async def upsert_user_chain(self, user_id: int, action_data: dict) -> dict:
+        col = self.get_collection("userchains")
+        filt = FieldFilter(field_path="user_id", op_string="==", value=user_id)
+        query = col.where(filter=filt).limit(1)
+
+        @firestore.async_transactional
+        async def upsert(transaction):
+            now = DT.datetime.utcnow()
+            docs = [
+                doc async for doc in await transaction.get(query, timeout=self.write_timeout())
+            ]
+
+            if not docs:
+                doc_data = new_chain(user_id, action_data, now)
+                transaction.set(col.document(str(user_id)), doc_data)
+                return doc_data
+
+            doc = docs[0]
+            doc_data = doc.to_dict()
+            if updated_on(doc_data, now.date()):
+                return doc_data
+
+            doc_data = advance_chain(doc_data, action_data, now)
+            transaction.set(doc.reference, doc_data)
+            return doc_data
+
+        return await upsert(self.db.transaction())
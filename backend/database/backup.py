@@ -0,0 +1,308 @@
+# backup.py
+"""
+Streaming export and import of the Firestore collections in ``alias_map``.
+
+Export writes one gzip-compressed NDJSON file per collection
+(``<alias>.ndjson.gz``), one document per line:
+
+  {"id": "<document id>", "data": {...}}
+
+Values JSON cannot represent (timestamps, bytes, geo points, document
+references) are written as {"__type__": ..., "value": ...} and restored with
+their Firestore type on import. Documents are read one page at a time, so
+memory stays bounded by the page size whatever the collection size.
+
+Each exported page is a complete gzip member, so a file cut short by a crash
+is truncated back to its last checkpointed page on resume.
+
+Import replays the files with a BulkWriter per collection, collections in
+parallel. Both modes record progress in a checkpoint file after every page,
+so an interrupted run resumes where it stopped when given the same
+``--checkpoint``.
+
+Usage (from the backend directory):
+  python -m database.backup export DIR [--collections users apps ...]
+                                       [--page-size 500] [--checkpoint FILE]
+  python -m database.backup import DIR [--collections users apps ...]
+                                       [--page-size 500] [--workers 4]
+                                       [--checkpoint FILE]
+"""
+
+import argparse
+import base64
+import datetime as DT
+import gzip
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from google.cloud.firestore_v1 import GeoPoint
+from google.cloud.firestore_v1.document import DocumentReference
+from database.firestore_storage import alias_map
+from database.migrations import get_firestore_storage, save_checkpoint, stream_pages
+from util.logit import get_logger
+
+logger = get_logger("logs", "Backup")
+
+# Every aliased collection, plus the counters the user ID allocator reserves
+# blocks from; without them a restored environment would reissue user IDs.
+COLLECTIONS = sorted(alias_map) + ["counters"]
+
+DEFAULT_PAGE_SIZE = 500
+TYPE_KEY = "__type__"
+
+
+# ---------------------------
+# Value encoding
+# ---------------------------
+
+
+def encode_value(value):
+    """
+    Converts a Firestore value into plain JSON, tagging the types JSON lacks.
+    """
+    if isinstance(value, DT.datetime):
+        return {TYPE_KEY: "datetime", "value": value.isoformat()}
+    if isinstance(value, bytes):
+        return {TYPE_KEY: "bytes", "value": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, GeoPoint):
+        return {TYPE_KEY: "geopoint", "value": [value.latitude, value.longitude]}
+    if isinstance(value, DocumentReference):
+        return {TYPE_KEY: "reference", "value": value.path}
+    if isinstance(value, dict):
+        return {key: encode_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [encode_value(item) for item in value]
+    return value
+
+
+def decode_value(value, db):
+    """
+    Reverses encode_value; references are resolved against db.
+    """
+    if isinstance(value, dict):
+        kind = value.get(TYPE_KEY)
+        if kind == "datetime":
+            return DT.datetime.fromisoformat(value["value"])
+        if kind == "bytes":
+            return base64.b64decode(value["value"])
+        if kind == "geopoint":
+            return GeoPoint(*value["value"])
+        if kind == "reference":
+            return db.document(value["value"])
+        return {key: decode_value(item, db) for key, item in value.items()}
+    if isinstance(value, list):
+        return [decode_value(item, db) for item in value]
+    return value
+
+
+# ---------------------------
+# Checkpoints
+# ---------------------------
+
+
+def load_progress(path: str) -> dict:
+    """
+    Loads the per-collection progress of an earlier run, or returns {}.
+    """
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    return {}
+
+
+def export_path(directory: str, collection: str) -> str:
+    return os.path.join(directory, f"{collection}.ndjson.gz")
+
+
+# ---------------------------
+# Export
+# ---------------------------
+
+
+def export_collection(storage, collection: str, directory: str, progress: dict,
+                      page_size: int, checkpoint_path: str, lock: threading.Lock) -> int:
+    """
+    Streams one collection to its NDJSON file, appending after the last
+    exported document when resuming. Returns the number of documents written.
+
+    Every page is written as a complete gzip member, and the checkpoint
+    records the file size after it. A resumed run first truncates the file to
+    that size, dropping a member a killed run left unfinished (or finished
+    but never checkpointed), so the file always decompresses and no page is
+    written twice.
+    """
+    state = progress.setdefault(collection, {"last_doc_id": None, "count": 0, "done": False})
+    if state["done"]:
+        return state["count"]
+    if "bytes" not in state:
+        # Checkpoints written before the size was recorded cannot be trusted
+        # to match the file; export the collection again.
+        state.update(last_doc_id=None, count=0, bytes=0)
+
+    col = storage.get_collection(collection)
+    path = export_path(directory, collection)
+    mode = "r+b" if state["last_doc_id"] and os.path.exists(path) else "wb"
+    if mode == "wb":
+        state.update(last_doc_id=None, count=0, bytes=0)
+    with open(path, mode) as file:
+        file.truncate(state["bytes"])
+        file.seek(state["bytes"])
+        for page in stream_pages(col, page_size, state["last_doc_id"]):
+            lines = "".join(
+                json.dumps({"id": doc.id, "data": encode_value(doc.to_dict())},
+                           separators=(",", ":")) + "\n"
+                for doc in page
+            )
+            # A closed member per page; readers see one continuous stream.
+            file.write(gzip.compress(lines.encode("utf-8")))
+            file.flush()
+            os.fsync(file.fileno())
+            state["bytes"] = file.tell()
+            state["last_doc_id"] = page[-1].id
+            state["count"] += len(page)
+            with lock:
+                save_checkpoint(checkpoint_path, progress)
+            logger.info("export %s: %s documents", collection, state["count"])
+
+    state["done"] = True
+    with lock:
+        save_checkpoint(checkpoint_path, progress)
+    return state["count"]
+
+
+def export_collections(directory: str, collections: list = COLLECTIONS,
+                       page_size: int = DEFAULT_PAGE_SIZE,
+                       checkpoint_path: str = None) -> dict:
+    """
+    Exports the collections one after another into directory and writes a
+    manifest.json with the document count of each file.
+
+    Returns {collection: document count}.
+    """
+    os.makedirs(directory, exist_ok=True)
+    storage = get_firestore_storage()
+    progress = load_progress(checkpoint_path)
+    lock = threading.Lock()
+
+    counts = {
+        collection: export_collection(
+            storage, collection, directory, progress, page_size, checkpoint_path, lock
+        )
+        for collection in collections
+    }
+    manifest = {
+        "exported_at": DT.datetime.now(DT.timezone.utc).isoformat(),
+        "collections": {
+            collection: {"path": alias_map.get(collection, collection), "documents": count}
+            for collection, count in counts.items()
+        },
+    }
+    with open(os.path.join(directory, "manifest.json"), "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+    return counts
+
+
+# ---------------------------
+# Import
+# ---------------------------
+
+
+def import_collection(storage, collection: str, directory: str, progress: dict,
+                      page_size: int, checkpoint_path: str, lock: threading.Lock) -> int:
+    """
+    Writes one collection's NDJSON file back with a BulkWriter, skipping the
+    lines an earlier run already committed. Returns the number of documents
+    written in total.
+    """
+    path = export_path(directory, collection)
+    if not os.path.exists(path):
+        logger.warning("import %s: %s not found, skipping", collection, path)
+        return 0
+
+    with lock:
+        state = progress.setdefault(collection, {"lines": 0, "done": False})
+    if state["done"]:
+        return state["lines"]
+
+    db = storage.db
+    col = storage.get_collection(collection)
+    writer = db.bulk_writer()
+    pending = 0
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            for line_number, line in enumerate(file):
+                if line_number < state["lines"]:
+                    continue
+                record = json.loads(line)
+                writer.set(col.document(record["id"]), decode_value(record["data"], db))
+                pending += 1
+                if pending == page_size:
+                    # Only count lines as done once the server has accepted them.
+                    writer.flush()
+                    with lock:
+                        state["lines"] += pending
+                        save_checkpoint(checkpoint_path, progress)
+                    logger.info("import %s: %s documents", collection, state["lines"])
+                    pending = 0
+        writer.flush()
+    finally:
+        writer.close()
+
+    with lock:
+        state["lines"] += pending
+        state["done"] = True
+        save_checkpoint(checkpoint_path, progress)
+    return state["lines"]
+
+
+def import_collections(directory: str, collections: list = COLLECTIONS,
+                       page_size: int = DEFAULT_PAGE_SIZE, workers: int = 4,
+                       checkpoint_path: str = None) -> dict:
+    """
+    Imports the collections found in directory, up to ``workers`` in
+    parallel. Documents are written with set(), so re-importing a file
+    overwrites rather than duplicates.
+
+    Returns {collection: documents written}.
+    """
+    storage = get_firestore_storage()
+    progress = load_progress(checkpoint_path)
+    lock = threading.Lock()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {
+            collection: executor.submit(
+                import_collection,
+                storage, collection, directory, progress, page_size, checkpoint_path, lock,
+            )
+            for collection in collections
+        }
+        return {collection: future.result() for collection, future in futures.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export or import Firestore collections.")
+    parser.add_argument("mode", choices=["export", "import"])
+    parser.add_argument("directory", help="Directory holding the <collection>.ndjson.gz files.")
+    parser.add_argument("--collections", nargs="+", choices=COLLECTIONS, default=COLLECTIONS)
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE,
+                        help="Documents read or written per round trip.")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="Collections imported in parallel.")
+    parser.add_argument("--checkpoint", default=None,
+                        help="JSON file used to resume an interrupted run.")
+    args = parser.parse_args(argv)
+
+    page_size = max(1, args.page_size)
+    if args.mode == "export":
+        result = export_collections(args.directory, args.collections, page_size, args.checkpoint)
+    else:
+        result = import_collections(
+            args.directory, args.collections, page_size, args.workers, args.checkpoint
+        )
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+# chains.py
+"""
+Chain (daily streak) documents shared by every storage backend.
+
+Instead of an ever-growing ``history`` array, a chain document stores:
+
+  active_ranges   run-length encoded active days, sorted and non-overlapping,
+                  e.g. [{"start": "2025-01-01", "end": "2025-01-09"}, ...].
+                  It grows by one entry per broken streak, not per action.
+  recent_actions  the last RECENT_ACTIONS_LIMIT actions, newest last.
+
+chain_streak and max_chain_streak stay plain fields, so reading them is O(1);
+"was the user active on day X" is a binary search over active_ranges.
+
+Clients still read a ``history`` list of {"action", "date"} entries from the
+chain status; status_view() derives it from active_ranges.
+"""
+
+import datetime as DT
+from dateutil.parser import parse
+
+# Number of {"date", "action"} entries kept in recent_actions.
+RECENT_ACTIONS_LIMIT = 30
+
+# Number of days, counted back from today, covered by the history of a default
+# chain status read. The client calendar shows the current month.
+HISTORY_WINDOW_DAYS = 62
+
+# Fields returned by a chain status read; recent_actions is only fetched when a
+# caller asks for the full history. "history" only exists on documents the
+# compaction migration has not reached yet.
+CHAIN_STATUS_FIELDS = [
+    "user_id",
+    "chain_start_date",
+    "chain_streak",
+    "max_chain_streak",
+    "last_update_date",
+    "broken",
+    "active_ranges",
+    "history",
+]
+
+
+def _add_active_day(ranges: list, day: DT.date) -> None:
+    """
+    Marks day as active in ranges, extending the last range when day follows
+    it and opening a new one after a gap. Days before the last range end are
+    already covered or out of order and are ignored.
+    """
+    day_iso = day.isoformat()
+    if ranges:
+        last = ranges[-1]
+        if day_iso <= last["end"]:
+            return
+        if (day - DT.date.fromisoformat(last["end"])).days == 1:
+            last["end"] = day_iso
+            return
+    ranges.append({"start": day_iso, "end": day_iso})
+
+
+def _record_action(doc_data: dict, day: DT.date, action_data: dict) -> None:
+    _add_active_day(doc_data.setdefault("active_ranges", []), day)
+    recent = doc_data.setdefault("recent_actions", [])
+    recent.append({"date": day.isoformat(), "action": action_data.get("action")})
+    del recent[:-RECENT_ACTIONS_LIMIT]
+
+
+def compact_history(doc_data: dict) -> dict:
+    """
+    Converts a legacy chain document with a ``history`` array to the compact
+    layout (active_ranges + recent_actions) in place and returns it. Documents
+    without history are returned unchanged.
+    """
+    history = doc_data.pop("history", None)
+    if history is None:
+        return doc_data
+
+    ranges = doc_data.setdefault("active_ranges", [])
+    days = sorted({parse(entry["date"]).date() for entry in history if entry.get("date")})
+    for day in days:
+        _add_active_day(ranges, day)
+    recent = doc_data.setdefault("recent_actions", [])
+    recent.extend(
+        {"date": entry.get("date"), "action": entry.get("action")} for entry in history
+    )
+    del recent[:-RECENT_ACTIONS_LIMIT]
+    return doc_data
+
+
+def is_active_on(doc_data: dict, day: DT.date) -> bool:
+    """
+    Returns whether the user recorded an action on day, in O(log n) over the
+    number of active ranges.
+    """
+    ranges = doc_data.get("active_ranges", [])
+    day_iso = day.isoformat()
+    # ISO dates sort lexicographically, so the strings are compared directly.
+    lo, hi = 0, len(ranges)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if ranges[mid]["start"] <= day_iso:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo > 0 and day_iso <= ranges[lo - 1]["end"]
+
+
+def current_streak(doc_data: dict, today: DT.date) -> int:
+    """
+    Returns the streak that is still alive on today: the length of the last
+    active range if it ends today or yesterday, otherwise 0.
+    """
+    ranges = doc_data.get("active_ranges", [])
+    if not ranges:
+        return 0
+    end = DT.date.fromisoformat(ranges[-1]["end"])
+    if (today - end).days > 1:
+        return 0
+    return (end - DT.date.fromisoformat(ranges[-1]["start"])).days + 1
+
+
+def history_entries(doc_data: dict, since: DT.date = None) -> list:
+    """
+    Expands active_ranges into the history list clients expect, one
+    {"action": "completed", "date": ...} entry per active day, oldest first.
+    Days before since are skipped. The client only records "completed"
+    actions, so every active day is reported as completed.
+    """
+    history = []
+    for active in doc_data.get("active_ranges", []):
+        end = DT.date.fromisoformat(active["end"])
+        day = DT.date.fromisoformat(active["start"])
+        if since is not None and end < since:
+            continue
+        if since is not None and day < since:
+            day = since
+        while day <= end:
+            history.append({"action": "completed", "date": day.isoformat()})
+            day += DT.timedelta(days=1)
+    return history
+
+
+def status_view(doc_data: dict, today: DT.date, include_history: bool = False) -> dict:
+    """
+    Builds the chain status response from a stored chain document.
+
+    Adds ``history`` (the last HISTORY_WINDOW_DAYS days, or every active day
+    with include_history), the live ``current_streak``, which drops to 0 once
+    a day is missed even before the next update, and ``active_today``. The
+    storage layout fields are left out; with include_history the raw
+    recent_actions are returned as well.
+    """
+    doc_data = compact_history(dict(doc_data))
+    since = None if include_history else today - DT.timedelta(days=HISTORY_WINDOW_DAYS)
+    view = {
+        key: value
+        for key, value in doc_data.items()
+        if key not in ("active_ranges", "recent_actions")
+    }
+    view["history"] = history_entries(doc_data, since=since)
+    view["current_streak"] = current_streak(doc_data, today)
+    view["active_today"] = is_active_on(doc_data, today)
+    if include_history:
+        view["recent_actions"] = doc_data.get("recent_actions", [])
+    return view
+
+
+def updated_on(doc_data: dict, day: DT.date) -> bool:
+    """
+    Returns whether the chain was already updated on day. A second update on
+    the same day changes nothing, so storage backends skip the write.
+    """
+    return parse(doc_data["last_update_date"]).date() == day
+
+
+def new_chain(user_id: int, action_data: dict, now: DT.datetime) -> dict:
+    """
+    Builds the chain document of a user's first recorded action.
+    """
+    today = now.date()
+    doc_data = {
+        "user_id": user_id,
+        "chain_start_date": today.isoformat(),
+        "chain_streak": 1,
+        "max_chain_streak": 1,
+        "last_update_date": now.isoformat(),
+        "broken": False,
+    }
+    _record_action(doc_data, today, action_data)
+    return doc_data
+
+
+def advance_chain(doc_data: dict, action_data: dict, now: DT.datetime) -> dict:
+    """
+    Applies an action to an existing chain document and returns it.
+
+    The streak grows when the previous update was yesterday, restarts (and is
+    marked broken) after a gap of more than one day, and is unchanged for a
+    second update on the same day. Storage backends share this so they keep
+    identical streak semantics. Legacy documents are compacted on the way.
+
+    Backends check updated_on() first and do not call this (or write) for a
+    same-day update.
+    """
+    compact_history(doc_data)
+    today = now.date()
+    last_update = parse(doc_data["last_update_date"]).date()
+    # Check streak continuation
+    if (today - last_update).days == 1:
+        doc_data["chain_streak"] += 1
+        doc_data["max_chain_streak"] = max(doc_data["max_chain_streak"], doc_data["chain_streak"])
+        doc_data["broken"] = False
+    elif (today - last_update).days > 1:
+        doc_data["chain_streak"] = 1
+        doc_data["broken"] = True
+        doc_data["chain_start_date"] = today.isoformat()
+    # else: already updated today, only the action is recorded
+    doc_data["last_update_date"] = now.isoformat()
+    _record_action(doc_data, today, action_data)
+    return doc_data
@@ -1,110 +1,109 @@
 # firebase_commands.py
+"""
+Data-access API used by the blueprints and util modules.
 
+Every function delegates to the configured storage backend (see
+database/storage.py), so the same calls run against Firestore in production
+and against the in-memory backend in load tests and CI.
+"""
+
+import copy
 import datetime as DT
-from dateutil.parser import parse  # If using date parsing from strings
-import os
+import threading
 import bcrypt
-from google.cloud.firestore_v1.base_query import FieldFilter
-from google.cloud.firestore_v1.collection import CollectionReference
-from google.cloud.firestore_v1.transforms import SERVER_TIMESTAMP
-from config.config import firebase_config
-from config.config import FirebaseConfig
-from firebase_admin import credentials, firestore
-import firebase_admin
-
-# You can import your alias_map from your configuration (for example, using Pydantic)
-# For demonstration, we define it here:
-alias_map = {
-    "users": "database_structure/Users/rows",
-    "apps": "database_structure/Apps/rows",
-    "userlinkedapps": "database_structure/UserLinkedApps/rows",
-    "userprofiles": "database_structure/UserProfiles/rows",
-    "userchains": "database_structure/UserChains/rows",
-}
-
-
-def init_firebase(config: FirebaseConfig):
-    current_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-    cert_path = os.path.join(current_dir, "database/fb-cc-test.json")
-    cred = credentials.Certificate(cert_path)
-    # config)
-    firebase_admin.initialize_app(
-        cred,
-        {
-            "apiKey": config.api_key,
-            "authDomain": config.auth_domain,
-            "projectId": config.project_id,
-            "storageBucket": config.storage_bucket,
-            "messagingSenderId": config.messaging_sender_id,
-            "appId": config.app_id,
-            "measurementId": config.measurement_id,
-        },
-    )
-    return firestore.client()
+from config.config import settings
+from util.cache import TTLCache
+from database.chains import status_view, updated_on
+from database.invalidation import invalidation_bus
+from database.storage import get_storage
+from util.tokens import parse_expiry
+
+# email -> user_id, in front of the backend lookup. Only hits are cached so a
+# user who registers right after a failed lookup is found immediately.
+user_id_cache = TTLCache(
+    maxsize=settings.user_cache_maxsize, ttl=settings.user_cache_ttl
+)
+# A user changed on any node: drop its cached user_id.
+invalidation_bus.subscribe(
+    "users", lambda data: data.get("email") and user_id_cache.invalidate(data["email"])
+)
+
+# user_id -> chain document as of its last update by this process. Same-day
+# updates are idempotent, so while the cached document is from today repeated
+# actions are answered from here without touching the backend.
+chain_update_cache = TTLCache(
+    maxsize=settings.user_cache_maxsize, ttl=24 * 60 * 60
+)
+# Striped per-user locks: concurrent updates of one user are coalesced into a
+# single backend call while other users proceed in parallel.
+_chain_locks = [threading.Lock() for _ in range(64)]
+
+# Projections: each read transfers only the fields its caller returns.
+TOKEN_FIELDS = ["access_token", "refresh_token", "token_expires_at", "scopes"]
+PROFILE_FIELDS = ["first_name", "last_name", "avatar_url", "bio"]
+
+
+def _token_row(data: dict) -> dict:
+    return {
+        "access_token": data.get("access_token"),
+        "refresh_token": data.get("refresh_token"),
+        "token_expires_at": data.get("token_expires_at"),
+        "scopes": data.get("scopes"),
+    }
 
 
-DB = init_firebase(firebase_config)
+# ---------------------------
+# Users and Apps Commands
+# ---------------------------
 
 
-def get_collection(table: str, alias_map: dict) -> CollectionReference:
+def invalidate_user_cache(email: str = None) -> None:
     """
-    Returns a Firestore collection reference by looking up the given table alias
-    in the alias_map. If the alias is not found, it returns the table name as-is.
+    Drops the cached user_id for an email, or the whole cache when no email is given.
     """
-    collection_path = alias_map.get(table.lower(), table)
-    return DB.collection(collection_path)
-
-
-# ---------------------------
-# Users and Apps Commands
-# ---------------------------
+    if email is None:
+        user_id_cache.clear()
+    else:
+        user_id_cache.invalidate(email)
 
 
-def get_user_id_by_email(email: str, alias_map: dict = alias_map):
+def get_user_id_by_email(email: str):
     """
     Emulates:
       SELECT user_id FROM users WHERE email = ?
+
+    Looks the email up in the in-process cache first, then in the storage
+    backend (the users_by_email index on Firestore).
     """
-    col = get_collection("users", alias_map)
-    filt = FieldFilter(field_path="email", op_string="==", value=email)
-    docs = col.where(filter=filt).stream()
-    user_ids = []
-    for doc in docs:
-        data = doc.to_dict()
-        if "user_id" in data:
-            user_ids.append(data["user_id"])
-
-    if user_ids:
-        user_id = user_ids[0]
+    user_id = user_id_cache.get(email)
+    if user_id is not None:
         return user_id
-    else:
-        return None
+
+    user_id = get_storage().get_user_id_by_email(email)
+    if user_id is not None:
+        user_id_cache.set(email, user_id)
+    return user_id
 
 
-def get_app_id_by_name(app_name: str, alias_map: dict = alias_map):
+def get_app_id_by_name(app_name: str):
     """
     Emulates:
       SELECT app_id FROM Apps WHERE app_name = ?
     """
-    col = get_collection("apps", alias_map)
-    filt = FieldFilter(field_path="app_name", op_string="==", value=app_name)
-    docs = col.where(filter=filt).stream()
-    app_ids = []
-    for doc in docs:
-        data = doc.to_dict()
-        if "app_id" in data:
-            app_ids.append(data["app_id"])
-
-    if app_ids:
-        app_id = app_ids[0]
-        return app_id
-    else:
-        return None
+    return get_storage().get_app_id_by_name(app_name)
 
 
-def get_userlinkedapps_count_and_access_token(
-    app_id: int, user_id: int, alias_map: dict = alias_map
-):
+def list_apps() -> list:
+    """
+    Emulates:
+      SELECT app_id, app_name FROM Apps
+
+    Prefer database.app_registry for lookups; it keeps this table in memory.
+    """
+    return get_storage().list_apps()
+
+
+def get_userlinkedapps_count_and_access_token(app_id: int, user_id: int):
     """
     Emulates:
       SELECT
@@ -115,60 +114,35 @@ def get_userlinkedapps_count_and_access_token(
 
     Returns a tuple: (count, [list of access_tokens])
     """
-    col = get_collection("userlinkedapps", alias_map)
-    filt_app = FieldFilter(field_path="app_id", op_string="==", value=app_id)
-    filt_user = FieldFilter(
-        field_path="user_id",
-        op_string="==",
-        value=user_id)
-    query = col.where(filter=filt_app).where(filter=filt_user)
-    docs = list(query.stream())
-    count = len(docs)
-    access_tokens = [
-        doc.to_dict().get("access_token")
-        for doc in docs
-        if "access_token" in doc.to_dict()
-    ]
-    return count, access_tokens
+    data = get_storage().get_userlinkedapp(user_id, app_id, fields=["access_token"])
+    if data is None:
+        return 0, []
+    access_tokens = [data["access_token"]] if "access_token" in data else []
+    return 1, access_tokens
 
 
-def delete_userlinkedapps(user_id: int, app_id: int,
-                          alias_map: dict = alias_map):
+def delete_userlinkedapps(user_id: int, app_id: int):
     """
     Emulates:
       DELETE FROM UserLinkedApps WHERE app_id = ? AND user_id = ?
     """
-    col = get_collection("userlinkedapps", alias_map)
-    filt_app = FieldFilter(field_path="app_id", op_string="==", value=app_id)
-    filt_user = FieldFilter(
-        field_path="user_id",
-        op_string="==",
-        value=user_id)
-    query = col.where(filter=filt_app).where(filter=filt_user)
-    for doc in query.stream():
-        doc.reference.delete()
+    get_storage().delete_userlinkedapp(user_id, app_id)
 
 
 # ---------------------------
 # Auth Commands
 # ---------------------------
 
-def get_next_user_id(db: firestore.Client = DB) -> int:
-    counter_ref = db.collection("counters").document("users")
 
-    @firestore.transactional
-    def txn_increment(txn):
-        snap = counter_ref.get(transaction=txn)
-        current = snap.get("seq") or 0
-        new = current + 1
-        txn.update(counter_ref, {"seq": new})
-        return new
-
-    transaction = db.transaction()
-    return txn_increment(transaction)
+def get_next_user_id() -> int:
+    """
+    Returns the next unique numeric user ID. On Firestore IDs come from a
+    process-local block reserved on counters/users.
+    """
+    return get_storage().next_user_id()
 
 
-def insert_user(email: str, password: str, alias_map: dict = alias_map) -> int:
+def insert_user(email: str, password: str) -> int:
     """
     Emulates:
       INSERT INTO users (email, password) VALUES (?, ?)
@@ -176,48 +150,31 @@ def insert_user(email: str, password: str, alias_map: dict = alias_map) -> int:
       • numeric user_id       (from our counter)
       • bcrypt-hashed password
       • created_at & updated_at (UTC datetime)
+    and its users_by_email index entry.
 
     Returns the new user_id.
     """
-    # 1) Initialize Firestore client
-    users_col = get_collection("users", alias_map)
-
-    # 2) Hash the password
+    # 1) Hash the password
     hashed = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
     hashed_str = hashed.decode("utf-8")
 
-    # 3) Obtain the next numeric ID
-    user_id = get_next_user_id()
-
-    # 4) Prepare timestamp
-    now = DT.datetime.utcnow()
+    # 2) Obtain the next numeric ID
+    storage = get_storage()
+    user_id = storage.next_user_id()
 
-    # 5) Create the user document (ID = str(user_id))
-    users_col.document(str(user_id)).set({
-        "user_id": user_id,
-        "email": email,
-        "password": hashed_str,
-        "created_at": now,
-        "updated_at": now,
-    })
+    # 3) Create the user and its email index
+    storage.insert_user(user_id, email, hashed_str)
 
+    user_id_cache.set(email, user_id)
     return user_id
 
 
-def get_user_password_and_email(email: str, alias_map: dict = alias_map):
+def get_user_password_and_email(email: str):
     """
     Emulates:
       SELECT password, email FROM users WHERE email = ?
     """
-    col = get_collection("users", alias_map)
-    filt = FieldFilter(field_path="email", op_string="==", value=email)
-    docs = col.where(filter=filt).stream()
-    results = []
-    for doc in docs:
-        data = doc.to_dict()
-        results.append({"email": data.get("email"),
-                       "password": data.get("password")})
-    return results
+    return get_storage().get_user_password_and_email(email)
 
 
 # ---------------------------
@@ -225,33 +182,99 @@ def get_user_password_and_email(email: str, alias_map: dict = alias_map):
 # ---------------------------
 
 
-def get_userlinkedapps_tokens(
-        user_id: int, app_id: int, alias_map: dict = alias_map):
+def get_userlinkedapps_tokens(user_id: int, app_id: int):
     """
     Emulates:
       SELECT access_token, refresh_token, token_expires_at, scopes
       FROM UserLinkedApps
       WHERE user_id = ? AND app_id = ?
     """
-    col = get_collection("userlinkedapps", alias_map)
-    filt_user = FieldFilter(
-        field_path="user_id",
-        op_string="==",
-        value=user_id)
-    filt_app = FieldFilter(field_path="app_id", op_string="==", value=app_id)
-    docs = col.where(filter=filt_user).where(filter=filt_app).stream()
-    results = []
-    for doc in docs:
-        data = doc.to_dict()
-        results.append(
-            {
-                "access_token": data.get("access_token"),
-                "refresh_token": data.get("refresh_token"),
-                "token_expires_at": data.get("token_expires_at"),
-                "scopes": data.get("scopes"),
-            }
-        )
-    return results
+    data = get_storage().get_userlinkedapp(user_id, app_id, fields=TOKEN_FIELDS)
+    if data is None:
+        return []
+    return [_token_row(data)]
+
+
+def get_userlinkedapps_for_user(user_id: int, app_ids) -> dict:
+    """
+    Emulates:
+      SELECT app_id, access_token, refresh_token, token_expires_at, scopes
+      FROM UserLinkedApps
+      WHERE user_id = ? AND app_id IN (?, ?, ...)
+
+    All rows are fetched in one round trip.
+
+    Returns a dict mapping app_id to the same row shape as
+    get_userlinkedapps_tokens; apps the user has not linked are absent.
+    """
+    rows = get_storage().get_userlinkedapps_for_user(
+        user_id, list(app_ids), fields=TOKEN_FIELDS
+    )
+    return {app_id: _token_row(data) for app_id, data in rows.items()}
+
+
+def get_userlinkedapps_expiring(within_seconds: int, limit: int = None,
+                                active_since: DT.datetime = None) -> list:
+    """
+    Emulates:
+      SELECT TOP (?) user_id, app_id, refresh_token, token_expires_at, last_seen_at
+      FROM UserLinkedApps
+      WHERE token_expires_at >= GETDATE()
+        AND token_expires_at < DATEADD(SECOND, ?, GETDATE())
+        AND last_seen_at >= ?
+      ORDER BY token_expires_at
+
+    Tokens that already expired are left out: they belong to users who were
+    inactive for longer than the refresh window and are refreshed on their
+    next request.
+
+    The backends only index token_expires_at, so the last_seen_at condition
+    is applied here, paging through the range until limit active rows are
+    found; inactive rows never crowd active ones out of the result.
+    """
+    now = DT.datetime.now(DT.timezone.utc)
+    end = now + DT.timedelta(seconds=within_seconds)
+    fields = ["user_id", "app_id", "refresh_token", "token_expires_at", "last_seen_at"]
+
+    def is_active(row):
+        if active_since is None:
+            return True
+        last_seen_at = parse_expiry(row.get("last_seen_at"))
+        return last_seen_at is not None and last_seen_at >= active_since
+
+    rows, seen = [], set()
+    start, page_size = now, limit
+    while True:
+        page = get_storage().get_userlinkedapps_expiring(start, end, fields=fields, limit=page_size)
+        for row in page:
+            key = (row.get("user_id"), row.get("app_id"))
+            if key not in seen and is_active(row):
+                seen.add(key)
+                rows.append(row)
+        if limit is None or len(page) < page_size or len(rows) >= limit:
+            return rows[:limit]
+        # The next page starts at the last expiry seen; rows sharing it are
+        # read again and skipped. A page made of one expiry only would not
+        # move on, so it is read again at twice the size.
+        last_expiry = parse_expiry(page[-1].get("token_expires_at"))
+        if last_expiry is None or last_expiry <= start:
+            page_size *= 2
+        else:
+            start = last_expiry
+
+
+def touch_userlinkedapps(user_id: int, app_ids) -> None:
+    """
+    Emulates:
+      UPDATE UserLinkedApps
+      SET last_seen_at = GETDATE()
+      WHERE user_id = ? AND app_id IN (?, ...)
+
+    Rows that do not exist are skipped.
+    """
+    get_storage().update_userlinkedapps(
+        user_id, list(app_ids), {"last_seen_at": DT.datetime.now(DT.timezone.utc)}
+    )
 
 
 def insert_userlinkedapps(
@@ -261,7 +284,6 @@ def insert_userlinkedapps(
     refresh_token: str,
     token_expires_at: int,
     scopes: str,
-    alias_map: dict = alias_map,
 ):
     """
     Emulates:
@@ -269,18 +291,50 @@ def insert_userlinkedapps(
         (user_id, app_id, connected_at, access_token, refresh_token, token_expires_at, scopes)
       VALUES
         (?, ?, CURRENT_TIMESTAMP, ?, ?, ?, ?)
+
+    The row is written to its deterministic "{user_id}_{app_id}" document, so
+    inserting the same pair twice replaces the previous row instead of
+    creating a duplicate.
     """
-    col = get_collection("userlinkedapps", alias_map)
-    col.add(
+    replace_userlinkedapps(
+        user_id, (app_id,), access_token, refresh_token, token_expires_at, scopes
+    )
+
+
+def replace_userlinkedapps(
+    user_id: int,
+    app_ids,
+    access_token: str,
+    refresh_token: str,
+    token_expires_at,
+    scopes: str,
+):
+    """
+    Emulates, as one atomic write:
+      DELETE FROM UserLinkedApps WHERE user_id = ? AND app_id IN (?, ...)
+      INSERT INTO UserLinkedApps
+        (user_id, app_id, connected_at, access_token, refresh_token, token_expires_at, scopes)
+      VALUES
+        (?, ?, CURRENT_TIMESTAMP, ?, ?, ?, ?)  -- one row per app_id
+
+    On Firestore every keyed document is overwritten in a single WriteBatch,
+    so the links for all app_ids are replaced in one RPC and either all or
+    none are stored.
+
+    token_expires_at is stored as a UTC datetime whatever shape it comes in
+    (e.g. the ISO string of the Google callback), so the refresher's range
+    query on it matches every row. Linking counts as activity (last_seen_at).
+    """
+    get_storage().set_userlinkedapps(
+        user_id,
+        list(app_ids),
         {
-            "user_id": user_id,
-            "app_id": app_id,
-            "connected_at": SERVER_TIMESTAMP,
             "access_token": access_token,
             "refresh_token": refresh_token,
-            "token_expires_at": token_expires_at,
+            "token_expires_at": parse_expiry(token_expires_at) or token_expires_at,
             "scopes": scopes,
-        }
+            "last_seen_at": DT.datetime.now(DT.timezone.utc),
+        },
     )
 
 
@@ -290,7 +344,6 @@ def if_not_exists_insert_userlinkedapps(
     access_token: str,
     refresh_token: str,
     scopes: str,
-    alias_map: dict = alias_map,
 ):
     """
     Emulates:
@@ -302,25 +355,18 @@ def if_not_exists_insert_userlinkedapps(
           VALUES (?, ?, ?, ?, DATEADD(HOUR, 1, GETDATE()), ?)
       END
     """
-    col = get_collection("userlinkedapps", alias_map)
-    filt_user = FieldFilter(
-        field_path="user_id",
-        op_string="==",
-        value=user_id)
-    filt_app = FieldFilter(field_path="app_id", op_string="==", value=app_id)
-    docs = col.where(filter=filt_user).where(filter=filt_app).stream()
-    if not list(docs):
-        expires = DT.datetime.utcnow() + DT.timedelta(hours=1)
-        col.add(
-            {
-                "user_id": user_id,
-                "app_id": app_id,
-                "access_token": access_token,
-                "refresh_token": refresh_token,
-                "token_expires_at": expires,
-                "scopes": scopes,
-            }
-        )
+    expires = DT.datetime.utcnow() + DT.timedelta(hours=1)
+    get_storage().create_userlinkedapp(
+        user_id,
+        app_id,
+        {
+            "access_token": access_token,
+            "refresh_token": refresh_token,
+            "token_expires_at": expires,
+            "scopes": scopes,
+            "last_seen_at": DT.datetime.now(DT.timezone.utc),
+        },
+    )
 
 
 # ---------------------------
@@ -343,10 +389,9 @@ def if_not_exists_insert_userlinkedapps_spotify(
     access_token: str,
     refresh_token: str,
     scopes: str,
-    alias_map: dict = alias_map,
 ):
     if_not_exists_insert_userlinkedapps(
-        user_id, app_id, access_token, refresh_token, scopes, alias_map
+        user_id, app_id, access_token, refresh_token, scopes
     )
 
 
@@ -355,23 +400,15 @@ def if_not_exists_insert_userlinkedapps_spotify(
 # ---------------------------
 
 
-def get_user_profile(user_id: int, alias_map: dict = alias_map):
+def get_user_profile(user_id: int):
     """
     Emulates:
       SELECT first_name, last_name, avatar_url, bio
       FROM UserProfiles
       WHERE user_id = ?
     """
-    col = get_collection("userprofiles", alias_map)
-    filt_user = FieldFilter(
-        field_path="user_id",
-        op_string="==",
-        value=user_id)
-    docs = col.where(filter=filt_user).stream()
     profiles = []
-    for doc in docs:
-        data = doc.to_dict()
-        print(data)
+    for data in get_storage().get_user_profiles(user_id, fields=PROFILE_FIELDS):
         profiles.append(
             {
                 "first_name": data.get("first_name"),
@@ -388,32 +425,24 @@ def get_user_profile(user_id: int, alias_map: dict = alias_map):
 # ---------------------------
 
 
-def get_userlinkedapps_access_refresh(
-    user_id: int, app_id: int, alias_map: dict = alias_map
-):
+def get_userlinkedapps_access_refresh(user_id: int, app_id: int):
     """
     Emulates:
       SELECT access_token, refresh_token
       FROM UserLinkedApps
       WHERE user_id = ? AND app_id = ?
     """
-    col = get_collection("userlinkedapps", alias_map)
-    filt_user = FieldFilter(
-        field_path="user_id",
-        op_string="==",
-        value=user_id)
-    filt_app = FieldFilter(field_path="app_id", op_string="==", value=app_id)
-    docs = col.where(filter=filt_user).where(filter=filt_app).stream()
-    results = []
-    for doc in docs:
-        data = doc.to_dict()
-        results.append(
-            {
-                "access_token": data.get("access_token"),
-                "refresh_token": data.get("refresh_token"),
-            }
-        )
-    return results
+    data = get_storage().get_userlinkedapp(
+        user_id, app_id, fields=["access_token", "refresh_token"]
+    )
+    if data is None:
+        return []
+    return [
+        {
+            "access_token": data.get("access_token"),
+            "refresh_token": data.get("refresh_token"),
+        }
+    ]
 
 
 def update_userlinkedapps_tokens(
@@ -422,7 +451,6 @@ def update_userlinkedapps_tokens(
     seconds_from_now: int,
     user_id: int,
     app_id: int,
-    alias_map: dict = alias_map,
 ):
     """
     Updates the access token, refresh token, and token expiration time for a specific user and app in the UserLinkedApps collection.
@@ -440,84 +468,76 @@ def update_userlinkedapps_tokens(
     - seconds_from_now (int): The number of seconds from the current time to set as the new token expiration time.
     - user_id (int): The user ID for which the tokens need to be updated.
     - app_id (int): The app ID for which the tokens need to be updated.
-    - alias_map (dict, optional): A dictionary mapping table aliases to their actual paths in the Firestore collection. Defaults to the global `alias_map`.
 
     Returns:
-    - None. The function updates the tokens in the Firestore collection directly.
-    """
-    col = get_collection("userlinkedapps", alias_map)
-    filt_user = FieldFilter(
-        field_path="user_id",
-        op_string="==",
-        value=user_id)
-    filt_app = FieldFilter(field_path="app_id", op_string="==", value=app_id)
-    docs = col.where(filter=filt_user).where(filter=filt_app).stream()
+    - None. The function updates the tokens in the storage backend directly.
+    """
+    update_userlinkedapps_tokens_for_apps(
+        new_access_token, new_refresh_token, seconds_from_now, user_id, (app_id,)
+    )
+
+
+def update_userlinkedapps_tokens_for_apps(
+    new_access_token: str,
+    new_refresh_token: str,
+    seconds_from_now: int,
+    user_id: int,
+    app_ids,
+):
+    """
+    Same as update_userlinkedapps_tokens, but updates the rows of several apps
+    that share one set of tokens (e.g. YouTube Music and Google API) in a
+    single commit. Rows that do not exist are skipped.
+
+    Emulates:
+      UPDATE UserLinkedApps
+      SET access_token = ?,
+          refresh_token = ?,
+          token_expires_at = DATEADD(SECOND, ?, GETDATE())
+      WHERE user_id = ? AND app_id IN (?, ...)
+    """
     new_expires = DT.datetime.utcnow() + DT.timedelta(
         seconds=seconds_from_now
     )
-    for doc in docs:
-        doc.reference.update(
-            {
-                "access_token": new_access_token,
-                "refresh_token": new_refresh_token,
-                "token_expires_at": new_expires,
-            }
-        )
+    get_storage().update_userlinkedapps(
+        user_id,
+        list(app_ids),
+        {
+            "access_token": new_access_token,
+            "refresh_token": new_refresh_token,
+            "token_expires_at": new_expires,
+        },
+    )
+
 
-def get_user_chain_status(user_id: int, alias_map: dict = alias_map):
+def get_user_chain_status(user_id: int, include_history: bool = False):
     """
     Retrieve the current chain status for a user.
     Returns None if no document exists for that user.
+
+    The response carries a ``history`` list for the recent calendar window,
+    built by chains.status_view(); include_history extends it to every
+    active day and adds the recent actions log.
     """
-    col = get_collection("userchains", alias_map)
-    filt = FieldFilter(field_path="user_id", op_string="==", value=user_id)
-    docs = col.where(filter=filt).stream()
-    for doc in docs:
-        data = doc.to_dict()
-        return data  # Return first (and only) doc found
-    return None
+    doc_data = get_storage().get_user_chain_status(user_id, include_history=include_history)
+    if doc_data is None:
+        return None
+    return status_view(doc_data, DT.datetime.utcnow().date(), include_history=include_history)
 
-def upsert_user_chain(user_id: int, action_data: dict, alias_map: dict = alias_map):
+
+def upsert_user_chain(user_id: int, action_data: dict):
     """
     Upsert (update or insert) the chain status for a user.
+
+    At most one update per user and day reaches the backend from this process:
+    requests for the same user wait on one lock, and once the chain has been
+    updated today the cached document is returned as is.
     """
-    col = get_collection("userchains", alias_map)
-    today = DT.datetime.utcnow().date()
-    filt = FieldFilter(field_path="user_id", op_string="==", value=user_id)
-    docs = list(col.where(filter=filt).stream())
-
-    # CASE 1: Chain does not exist for this user
-    if not docs:
-        doc_data = {
-            "user_id": user_id,
-            "chain_start_date": today.isoformat(),
-            "chain_streak": 1,
-            "max_chain_streak": 1,
-            "last_update_date": DT.datetime.utcnow().isoformat(),
-            "broken": False,
-            "history": [{"date": today.isoformat(), "action": action_data.get("action")}]
-        }
-        # Use user_id as document name to ensure one doc per user (or generate unique doc_id if needed)
-        col.document(str(user_id)).set(doc_data)
-        return doc_data
+    with _chain_locks[hash(user_id) % len(_chain_locks)]:
+        cached = chain_update_cache.get(user_id)
+        if cached is not None and updated_on(cached, DT.datetime.utcnow().date()):
+            return copy.deepcopy(cached)
 
-    # CASE 2: Chain exists, update it
-    doc = docs[0]
-    doc_id = doc.id
-    doc_data = doc.to_dict()
-    last_update = parse(doc_data["last_update_date"]).date()
-    # Check streak continuation
-    if (today - last_update).days == 1:
-        doc_data["chain_streak"] += 1
-        doc_data["max_chain_streak"] = max(doc_data["max_chain_streak"], doc_data["chain_streak"])
-        doc_data["broken"] = False
-    elif (today - last_update).days > 1:
-        doc_data["chain_streak"] = 1
-        doc_data["broken"] = True
-        doc_data["chain_start_date"] = today.isoformat()
-    # else: already updated today (can update history if needed)
-    doc_data["last_update_date"] = DT.datetime.utcnow().isoformat()
-    doc_data.setdefault("history", []).append({"date": today.isoformat(), "action": action_data.get("action")})
-    # Update document
-    col.document(doc_id).set(doc_data)
-    return doc_data
+        doc_data = get_storage().upsert_user_chain(user_id, action_data)
+        chain_update_cache.set(user_id, copy.deepcopy(doc_data))
+        return doc_data
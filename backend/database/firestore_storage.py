@@ -0,0 +1,538 @@
+# firestore_storage.py
+
+import datetime as DT
+import os
+import threading
+import time
+from urllib.parse import quote
+from google.api_core.exceptions import Conflict, NotFound
+from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.collection import CollectionReference
+from google.cloud.firestore_v1.document import DocumentReference
+from google.cloud.firestore_v1.transforms import SERVER_TIMESTAMP
+from config.config import firebase_config, settings
+from config.config import FirebaseConfig
+from firebase_admin import credentials, firestore
+from database.chains import CHAIN_STATUS_FIELDS, advance_chain, new_chain, updated_on
+from database.id_allocator import BlockIdAllocator
+from database.metrics import count_op, instrument_storage
+from database.storage import APP_FIELDS, StorageBackend
+from util.deadline import timeout_for
+from util.logit import get_logger
+
+logger = get_logger("logs", "FirestoreStorage")
+
+# You can import your alias_map from your configuration (for example, using Pydantic)
+# For demonstration, we define it here:
+alias_map = {
+    "users": "database_structure/Users/rows",
+    "users_by_email": "database_structure/UsersByEmail/rows",
+    "apps": "database_structure/Apps/rows",
+    "userlinkedapps": "database_structure/UserLinkedApps/rows",
+    "userlinkedapps_removed": "database_structure/UserLinkedAppsRemoved/rows",
+    "userprofiles": "database_structure/UserProfiles/rows",
+    "userchains": "database_structure/UserChains/rows",
+}
+
+# The users and userlinkedapps listeners only match documents updated since
+# their lower bound, which moves forward every WATCH_WINDOW_SECONDS, so their
+# result sets stay small however long the process runs.
+WATCH_WINDOW_SECONDS = 600
+# Lower bounds start this much earlier, to absorb clock skew between this host
+# and Firestore's server timestamps.
+WATCH_OVERLAP_SECONDS = 30
+
+
+def init_firebase(config: FirebaseConfig, client_class=firestore.Client):
+    """
+    Creates a Firestore client for the current process.
+
+    The client is built directly from the service-account credentials instead
+    of through firebase_admin's global app registry, so a forked worker can
+    create its own client (and gRPC channel) rather than reuse the parent's.
+    Pass client_class=firestore.AsyncClient for the asyncio layer.
+    """
+    started = time.perf_counter()
+    current_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    cert_path = os.path.join(current_dir, "database/fb-cc-test.json")
+    cred = credentials.Certificate(cert_path)
+    client = client_class(
+        project=config.project_id or cred.project_id,
+        credentials=cred.get_credential(),
+    )
+    logger.info(
+        "%s created for pid %s in %.1f ms",
+        client_class.__name__,
+        os.getpid(),
+        (time.perf_counter() - started) * 1000,
+    )
+    return client
+
+
+def get_userlinkedapps_doc_id(user_id: int, app_id: int) -> str:
+    """
+    Returns the deterministic document ID of the UserLinkedApps row for a
+    (user_id, app_id) pair, e.g. "42_1".
+    """
+    return f"{user_id}_{app_id}"
+
+
+def get_users_by_email_doc_id(email: str) -> str:
+    """
+    Returns the users_by_email document ID for an email. Characters that are
+    not allowed in Firestore document IDs (such as "/") are percent-encoded.
+    """
+    return quote(email, safe="@")
+
+
+@instrument_storage
+class FirestoreStorage(StorageBackend):
+    """
+    StorageBackend on Cloud Firestore, using the collections in alias_map.
+    """
+
+    def __init__(self, alias_map: dict = alias_map):
+        self.alias_map = alias_map
+        self._db = None
+        self._db_pid = None
+        self._db_lock = threading.Lock()
+        # Reserves blocks of user IDs on counters/users so most registrations
+        # need no transaction at all.
+        self.user_id_allocator = BlockIdAllocator(
+            lambda: self.db, "counters", "users",
+            block_size=settings.user_id_block_size,
+        )
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self) -> None:
+        # The parent's lock may have been held by another thread at fork time.
+        self._db_lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+
+    @property
+    def db(self):
+        """
+        The Firestore client of the current process, created on first use.
+
+        Nothing is loaded or connected until a request actually touches the
+        database, and a forked worker never reuses a client (or its gRPC
+        channel) inherited from its parent.
+        """
+        pid = os.getpid()
+        if self._db is None or self._db_pid != pid:
+            with self._db_lock:
+                if self._db is None or self._db_pid != pid:
+                    self._db = init_firebase(firebase_config)
+                    self._db_pid = pid
+        return self._db
+
+    def warm_up(self) -> None:
+        """
+        Creates the client and issues one small read so credentials are
+        loaded and the gRPC channel is open before the first request.
+        """
+        list(self.get_collection("apps").limit(1).stream())
+
+    def watch(self, publish) -> None:
+        """
+        Attaches the on_snapshot listeners. The small Apps table is watched
+        whole and its initial snapshot is skipped; Users, UserLinkedApps and
+        the UserLinkedApps tombstones (see delete_userlinkedapp) are watched
+        through updated_at-filtered listeners that are rotated every
+        WATCH_WINDOW_SECONDS (see _watch_recent).
+        """
+        self.get_collection("apps").on_snapshot(
+            self._snapshot_handler("apps", publish, skip_initial=True)
+        )
+        self._watch_recent(publish, [])
+
+    def _watch_recent(self, publish, previous: list) -> None:
+        """
+        Attaches the updated_at >= now listeners, detaches the previous ones
+        and schedules the next rotation.
+
+        The new listeners are attached before the old ones go away, so no
+        change is missed; the few changes both see are published twice, which
+        subscribers tolerate (they only drop cache entries).
+        """
+        watches = previous
+        try:
+            since = DT.datetime.now(DT.timezone.utc) - DT.timedelta(seconds=WATCH_OVERLAP_SECONDS)
+            filt = FieldFilter(field_path="updated_at", op_string=">=", value=since)
+            watches = [
+                self.get_collection(collection).where(filter=filt).on_snapshot(
+                    self._snapshot_handler(table, publish, skip_initial=False)
+                )
+                for table, collection in (
+                    ("users", "users"),
+                    ("userlinkedapps", "userlinkedapps"),
+                    ("userlinkedapps", "userlinkedapps_removed"),
+                )
+            ]
+            for watch in previous:
+                watch.unsubscribe()
+        except Exception as e:
+            # Keep the running listeners and try again next window.
+            logger.error("Could not rotate the invalidation listeners: %s", e)
+        timer = threading.Timer(WATCH_WINDOW_SECONDS, self._watch_recent, args=(publish, watches))
+        timer.daemon = True
+        timer.start()
+
+    @staticmethod
+    def _snapshot_handler(table: str, publish, skip_initial: bool):
+        state = {"initial": skip_initial}
+
+        def on_snapshot(doc_snapshots, changes, read_time):
+            if state["initial"]:
+                state["initial"] = False
+                return
+            for change in changes:
+                data = change.document.to_dict() or {}
+                if change.type.name == "REMOVED":
+                    data["removed"] = True
+                publish(table, data)
+
+        return on_snapshot
+
+    @staticmethod
+    def read_timeout() -> float:
+        """
+        Timeout of a read: bounded by the request's remaining budget (see
+        util/deadline.py); raises DeadlineExceeded once it is spent.
+        """
+        return timeout_for(settings.firestore_timeout, what="Firestore read")
+
+    @staticmethod
+    def write_timeout() -> float:
+        """
+        Timeout of a write: bounded by the remaining budget but never below
+        firestore_min_write_timeout, so a token refreshed near the deadline is
+        still stored.
+        """
+        return timeout_for(settings.firestore_timeout, minimum=settings.firestore_min_write_timeout)
+
+    def get_collection(self, table: str) -> CollectionReference:
+        """
+        Returns a Firestore collection reference by looking up the given table alias
+        in the alias_map. If the alias is not found, it returns the table name as-is.
+        """
+        collection_path = self.alias_map.get(table.lower(), table)
+        return self.db.collection(collection_path)
+
+    def get_userlinkedapps_ref(self, user_id: int, app_id: int) -> DocumentReference:
+        """
+        Returns the document reference of the UserLinkedApps row keyed as
+        "{user_id}_{app_id}", so every lookup is a single point read.
+        """
+        col = self.get_collection("userlinkedapps")
+        return col.document(get_userlinkedapps_doc_id(user_id, app_id))
+
+    # ---------------------------
+    # Users and Apps
+    # ---------------------------
+
+    def get_user_id_by_email(self, email: str):
+        """
+        Reads only the user_id field of the users_by_email/{email} index
+        document. Users created before the index existed fall back to a
+        (projected) query on the users collection and are backfilled into the
+        index.
+        """
+        index_ref = self.get_collection("users_by_email").document(
+            get_users_by_email_doc_id(email)
+        )
+        snap = index_ref.get(field_paths=["user_id"], timeout=self.read_timeout())
+        if snap.exists:
+            return snap.to_dict().get("user_id")
+
+        user_id = None
+        col = self.get_collection("users")
+        filt = FieldFilter(field_path="email", op_string="==", value=email)
+        query = col.where(filter=filt).select(["user_id"]).limit(1)
+        count_op("query")
+        for doc in query.stream(timeout=self.read_timeout()):
+            user_id = doc.to_dict().get("user_id")
+        if user_id is not None:
+            count_op("write")
+            index_ref.set({"email": email, "user_id": user_id}, timeout=self.write_timeout())
+        return user_id
+
+    def next_user_id(self) -> int:
+        return self.user_id_allocator.next_id()
+
+    def insert_user(self, user_id: int, email: str, hashed_password: str) -> None:
+        """
+        Creates the user document (ID = str(user_id)) and its users_by_email
+        index document in one batch.
+        """
+        now = DT.datetime.utcnow()
+        index_ref = self.get_collection("users_by_email").document(
+            get_users_by_email_doc_id(email)
+        )
+        batch = self.db.batch()
+        batch.set(self.get_collection("users").document(str(user_id)), {
+            "user_id": user_id,
+            "email": email,
+            "password": hashed_password,
+            "created_at": now,
+            "updated_at": now,
+        })
+        batch.set(index_ref, {"email": email, "user_id": user_id})
+        batch.commit(timeout=self.write_timeout())
+
+    def get_user_password_and_email(self, email: str) -> list:
+        col = self.get_collection("users")
+        filt = FieldFilter(field_path="email", op_string="==", value=email)
+        docs = col.where(filter=filt).select(["email", "password"]).stream(
+            timeout=self.read_timeout()
+        )
+        results = []
+        for doc in docs:
+            data = doc.to_dict()
+            results.append({"email": data.get("email"),
+                           "password": data.get("password")})
+        return results
+
+    def get_app_id_by_name(self, app_name: str):
+        col = self.get_collection("apps")
+        filt = FieldFilter(field_path="app_name", op_string="==", value=app_name)
+        docs = col.where(filter=filt).select(["app_id"]).stream(timeout=self.read_timeout())
+        for doc in docs:
+            data = doc.to_dict()
+            if "app_id" in data:
+                return data["app_id"]
+        return None
+
+    def list_apps(self) -> list:
+        col = self.get_collection("apps")
+        docs = col.select(APP_FIELDS).stream(timeout=self.read_timeout())
+        return [
+            {field: data[field] for field in APP_FIELDS if field in data}
+            for data in (doc.to_dict() for doc in docs)
+            if "app_id" in data
+        ]
+
+    # ---------------------------
+    # Linked Apps
+    # ---------------------------
+
+    def get_userlinkedapp(self, user_id: int, app_id: int, fields: list = None):
+        snap = self.get_userlinkedapps_ref(user_id, app_id).get(
+            field_paths=fields, timeout=self.read_timeout()
+        )
+        return snap.to_dict() if snap.exists else None
+
+    def get_userlinkedapps_for_user(self, user_id: int, app_ids: list, fields: list = None) -> dict:
+        """
+        Fetches all keyed documents with one batched get_all round trip.
+        """
+        app_ids = list(app_ids)
+        refs = [self.get_userlinkedapps_ref(user_id, app_id) for app_id in app_ids]
+        if not refs:
+            return {}
+        app_id_by_doc_id = {
+            ref.id: app_id for ref, app_id in zip(refs, app_ids)
+        }
+
+        rows = {}
+        for snap in self.db.get_all(refs, field_paths=fields, timeout=self.read_timeout()):
+            if snap.exists:
+                rows[app_id_by_doc_id[snap.id]] = snap.to_dict()
+        return rows
+
+    def get_userlinkedapps_expiring(self, start, end, fields: list = None, limit: int = None) -> list:
+        """
+        A single-field range query on token_expires_at, served by Firestore's
+        automatic index. Firestore orders values by type, so rows whose expiry
+        is stored as a string or number are not matched; they are refreshed
+        in the request path and written back as timestamps.
+        """
+        col = self.get_collection("userlinkedapps")
+        query = (
+            col.where(filter=FieldFilter(field_path="token_expires_at", op_string=">=", value=start))
+            .where(filter=FieldFilter(field_path="token_expires_at", op_string="<", value=end))
+            .order_by("token_expires_at")
+        )
+        if fields is not None:
+            query = query.select(fields)
+        if limit is not None:
+            query = query.limit(limit)
+        return [doc.to_dict() for doc in query.stream(timeout=self.read_timeout())]
+
+    def set_userlinkedapps(self, user_id: int, app_ids: list, data: dict) -> None:
+        """
+        Overwrites every keyed document in a single WriteBatch, so the links
+        for all app_ids are replaced in one RPC.
+        """
+        batch = self.db.batch()
+        for app_id in app_ids:
+            batch.set(
+                self.get_userlinkedapps_ref(user_id, app_id),
+                {
+                    "user_id": user_id,
+                    "app_id": app_id,
+                    "connected_at": SERVER_TIMESTAMP,
+                    "updated_at": SERVER_TIMESTAMP,
+                    **data,
+                },
+            )
+        batch.commit(timeout=self.write_timeout())
+
+    def create_userlinkedapp(self, user_id: int, app_id: int, data: dict) -> bool:
+        """
+        Uses a single create() on the keyed document; Firestore rejects it
+        when the row already exists.
+        """
+        try:
+            self.get_userlinkedapps_ref(user_id, app_id).create(
+                {"user_id": user_id, "app_id": app_id, "updated_at": SERVER_TIMESTAMP, **data},
+                timeout=self.write_timeout(),
+            )
+        except Conflict:
+            return False
+        return True
+
+    def update_userlinkedapps(self, user_id: int, app_ids: list, data: dict) -> None:
+        app_ids = list(app_ids)
+        data = {**data, "updated_at": SERVER_TIMESTAMP}
+        batch = self.db.batch()
+        for app_id in app_ids:
+            batch.update(self.get_userlinkedapps_ref(user_id, app_id), data)
+        try:
+            batch.commit(timeout=self.write_timeout())
+        except NotFound:
+            # A batch fails as a whole if one row is missing; fall back to
+            # updating the rows that do exist.
+            for app_id in app_ids:
+                try:
+                    count_op("write")
+                    self.get_userlinkedapps_ref(user_id, app_id).update(
+                        data, timeout=self.write_timeout()
+                    )
+                except NotFound:
+                    pass
+
+    def delete_userlinkedapp(self, user_id: int, app_id: int) -> None:
+        """
+        Deletes the row and, in the same batch, writes its tombstone to
+        userlinkedapps_removed. The invalidation listeners only match
+        recently updated rows, so the deletion of an older row is only seen
+        through the tombstone. Tombstones are keyed like the row, so there is
+        at most one per (user, app).
+        """
+        batch = self.db.batch()
+        batch.delete(self.get_userlinkedapps_ref(user_id, app_id))
+        batch.set(
+            self.get_collection("userlinkedapps_removed").document(
+                get_userlinkedapps_doc_id(user_id, app_id)
+            ),
+            {"user_id": user_id, "app_id": app_id, "removed": True, "updated_at": SERVER_TIMESTAMP},
+        )
+        batch.commit(timeout=self.write_timeout())
+
+    # ---------------------------
+    # Profiles and Chains
+    # ---------------------------
+
+    def get_user_profiles(self, user_id: int, fields: list = None) -> list:
+        col = self.get_collection("userprofiles")
+        filt_user = FieldFilter(
+            field_path="user_id",
+            op_string="==",
+            value=user_id)
+        query = col.where(filter=filt_user)
+        if fields is not None:
+            query = query.select(fields)
+        return [doc.to_dict() for doc in query.stream(timeout=self.read_timeout())]
+
+    def get_user_chain_status(self, user_id: int, include_history: bool = False):
+        col = self.get_collection("userchains")
+        filt = FieldFilter(field_path="user_id", op_string="==", value=user_id)
+        query = col.where(filter=filt)
+        if not include_history:
+            query = query.select(CHAIN_STATUS_FIELDS)
+        docs = query.stream(timeout=self.read_timeout())
+        for doc in docs:
+            return doc.to_dict()  # Return first (and only) doc found
+        return None
+
+    def upsert_user_chain(self, user_id: int, action_data: dict) -> dict:
+        """
+        Reads and writes the chain inside one transaction, so concurrent
+        updates cannot lose a streak increment. A second update on the same
+        day performs no write at all.
+        """
+        col = self.get_collection("userchains")
+        filt = FieldFilter(field_path="user_id", op_string="==", value=user_id)
+        query = col.where(filter=filt).limit(1)
+
+        @firestore.transactional
+        def upsert(transaction):
+            now = DT.datetime.utcnow()
+            docs = list(transaction.get(query, timeout=self.write_timeout()))
+
+            # CASE 1: Chain does not exist for this user
+            if not docs:
+                doc_data = new_chain(user_id, action_data, now)
+                # Use user_id as document name to ensure one doc per user
+                transaction.set(col.document(str(user_id)), doc_data)
+                return doc_data
+
+            # CASE 2: Already updated today, nothing to write
+            doc = docs[0]
+            doc_data = doc.to_dict()
+            if updated_on(doc_data, now.date()):
+                return doc_data
+
+            # CASE 3: Chain exists, update it
+            doc_data = advance_chain(doc_data, action_data, now)
+            transaction.set(doc.reference, doc_data)
+            return doc_data
+
+        return upsert(self.db.transaction())
+
+    # ---------------------------
+    # Leases
+    # ---------------------------
+
+    def get_lease_ref(self, name: str):
+        # Leases are short-lived coordination state, so they live outside the
+        # aliased (and backed-up) collections, next to the ID counters.
+        return self.db.collection("leases").document(quote(name, safe=""))
+
+    def acquire_lease(self, name: str, owner: str, ttl_seconds: float) -> bool:
+        """
+        Checks and takes the lease inside one transaction, so two processes
+        can never both see it free.
+        """
+        lease_ref = self.get_lease_ref(name)
+
+        @firestore.transactional
+        def acquire(transaction):
+            now = DT.datetime.now(DT.timezone.utc)
+            snap = lease_ref.get(transaction=transaction, timeout=self.write_timeout())
+            if snap.exists:
+                lease = snap.to_dict()
+                expires_at = lease.get("expires_at")
+                if lease.get("owner") != owner and expires_at is not None and expires_at > now:
+                    return False
+            transaction.set(lease_ref, {
+                "owner": owner,
+                "expires_at": now + DT.timedelta(seconds=ttl_seconds),
+            })
+            return True
+
+        return acquire(self.db.transaction())
+
+    def release_lease(self, name: str, owner: str) -> None:
+        lease_ref = self.get_lease_ref(name)
+
+        @firestore.transactional
+        def release(transaction):
+            snap = lease_ref.get(transaction=transaction, timeout=self.write_timeout())
+            if snap.exists and snap.to_dict().get("owner") == owner:
+                transaction.delete(lease_ref)
+
+        release(self.db.transaction())
@@ -0,0 +1,77 @@
+# id_allocator.py
+
+import os
+import threading
+from firebase_admin import firestore
+from database.metrics import track
+
+
+class BlockIdAllocator:
+    """
+    Hands out unique, increasing integer IDs from blocks reserved on a
+    Firestore counter document (hi/lo allocation).
+
+    One transaction on the counter reserves ``block_size`` IDs for this
+    process; the following ``block_size - 1`` allocations are served from
+    memory. The counter's "seq" field always holds the highest reserved ID, so
+    every process (and every waitress worker) gets disjoint blocks, and the
+    scheme stays compatible with callers that still increment "seq" by one.
+
+    IDs left in a block when a process exits are never reused, so allocated
+    IDs are unique but may have gaps.
+
+    Parameters:
+    db_getter (callable): Returns the Firestore client to use.
+    collection (str): The collection holding the counter document.
+    document (str): The counter document ID.
+    block_size (int): How many IDs one transaction reserves.
+    """
+
+    def __init__(self, db_getter, collection: str, document: str,
+                 block_size: int = 20):
+        self._db_getter = db_getter
+        self._collection = collection
+        self._document = document
+        self.block_size = max(1, int(block_size))
+        self._lock = threading.Lock()
+        self._next = 0
+        self._high = -1
+        self._pid = os.getpid()
+
+    @track("transaction")
+    def _reserve_block(self) -> int:
+        """
+        Reserves the next block on the counter and returns its highest ID.
+        """
+        db = self._db_getter()
+        counter_ref = db.collection(self._collection).document(self._document)
+        block_size = self.block_size
+
+        @firestore.transactional
+        def txn_reserve(txn):
+            snap = counter_ref.get(transaction=txn)
+            current = snap.get("seq") or 0
+            high = current + block_size
+            txn.update(counter_ref, {"seq": high})
+            return high
+
+        return txn_reserve(db.transaction())
+
+    def next_id(self) -> int:
+        """
+        Returns the next unique ID, reserving a new block when the current one
+        is used up.
+        """
+        with self._lock:
+            # A forked child must not keep handing out its parent's block.
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._next, self._high = 0, -1
+
+            if self._next > self._high:
+                high = self._reserve_block()
+                self._next, self._high = high - self.block_size + 1, high
+
+            user_id = self._next
+            self._next += 1
+            return user_id
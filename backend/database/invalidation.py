@@ -0,0 +1,77 @@
+# invalidation.py
+"""
+Cross-process cache invalidation bus.
+
+In-process caches (the email -> user_id cache, the app registry and the token
+caches) subscribe to a collection. Whenever a document of that collection
+changes — on this process or on any other node — every subscriber is called
+with the document's data and drops what it derived from it. This lets the
+caches use long TTLs without serving stale data after another worker
+refreshes a token, unlinks an app or edits the Apps table.
+
+Change events come from the storage backend (see StorageBackend.watch):
+Firestore delivers them through on_snapshot listeners, the in-memory backend
+publishes its own writes. A deleted document is published with its last
+known data and ``"removed": True``.
+"""
+
+import os
+import threading
+from collections import defaultdict
+from database.storage import get_storage
+from util.logit import get_logger
+
+logger = get_logger("logs", "InvalidationBus")
+
+
+class InvalidationBus:
+    """
+    Fans change events of a collection ("users", "userlinkedapps", "apps")
+    out to the callbacks subscribed to it.
+    """
+
+    def __init__(self):
+        self._subscribers = defaultdict(list)
+        self._lock = threading.Lock()
+        self._started_pid = None
+
+    def subscribe(self, collection: str, callback) -> None:
+        """
+        Registers callback(data) for changes of collection. data is the
+        changed document (its last state for deletions).
+        """
+        with self._lock:
+            self._subscribers[collection].append(callback)
+
+    def publish(self, collection: str, data: dict) -> None:
+        """
+        Delivers one change event to the collection's subscribers. A failing
+        subscriber is logged and does not stop the others.
+        """
+        for callback in list(self._subscribers.get(collection, ())):
+            try:
+                callback(data)
+            except Exception as e:
+                logger.error("Invalidation subscriber for %s failed: %s", collection, e)
+
+    def ensure_started(self) -> None:
+        """
+        Starts watching the storage backend once per process. Listener
+        threads do not survive a fork, so a forked worker starts its own on
+        its first request.
+        """
+        pid = os.getpid()
+        if self._started_pid == pid:
+            return
+        with self._lock:
+            if self._started_pid == pid:
+                return
+            try:
+                get_storage().watch(self.publish)
+            except Exception as e:
+                # Caches still expire through their TTLs.
+                logger.error("Could not start invalidation listeners: %s", e)
+            self._started_pid = pid
+
+
+invalidation_bus = InvalidationBus()
@@ -0,0 +1,224 @@
+# memory_storage.py
+
+import copy
+import datetime as DT
+import itertools
+import threading
+from database.app_registry import DEFAULT_APPS
+from database.chains import CHAIN_STATUS_FIELDS, advance_chain, new_chain, updated_on
+from database.metrics import instrument_storage
+from database.storage import APP_FIELDS, StorageBackend
+from util.tokens import parse_expiry
+
+
+def _project(row: dict, fields: list = None):
+    """
+    Returns a copy of row limited to fields (all fields when fields is None).
+    """
+    if row is None:
+        return None
+    if fields is None:
+        return copy.deepcopy(row)
+    return {field: copy.deepcopy(row[field]) for field in fields if field in row}
+
+
+@instrument_storage
+class InMemoryStorage(StorageBackend):
+    """
+    Thread-safe StorageBackend kept entirely in process memory.
+
+    Meant for running and benchmarking the full Flask app without Firestore
+    credentials or network access. Every call takes one lock and works on
+    copies, so callers can never mutate stored rows by accident. Nothing is
+    persisted and nothing is shared between processes.
+    """
+
+    def __init__(self, apps: list = None):
+        self._lock = threading.RLock()
+        self._user_ids = itertools.count(1)
+        self.users = {}                # user_id -> user document
+        self.users_by_email = {}       # email -> user_id
+        self.apps = {}                 # app_id -> app document
+        self.userlinkedapps = {}       # (user_id, app_id) -> row
+        self.userprofiles = {}         # user_id -> [profile documents]
+        self.userchains = {}           # user_id -> chain document
+        self.leases = {}               # name -> {"owner", "expires_at"}
+        self._publishers = []          # watch() callbacks
+        # Seeded with the production Apps table unless told otherwise.
+        for app in DEFAULT_APPS if apps is None else apps:
+            self.apps[app["app_id"]] = dict(app)
+
+    def watch(self, publish) -> None:
+        with self._lock:
+            self._publishers.append(publish)
+
+    def _publish(self, collection: str, rows: list) -> None:
+        # Called with copies taken under the lock, after the lock is released,
+        # so subscribers may read the store.
+        for publish in list(self._publishers):
+            for row in rows:
+                publish(collection, row)
+
+    # ---------------------------
+    # Users and Apps
+    # ---------------------------
+
+    def get_user_id_by_email(self, email: str):
+        with self._lock:
+            return self.users_by_email.get(email)
+
+    def next_user_id(self) -> int:
+        with self._lock:
+            return next(self._user_ids)
+
+    def insert_user(self, user_id: int, email: str, hashed_password: str) -> None:
+        now = DT.datetime.utcnow()
+        with self._lock:
+            self.users[user_id] = {
+                "user_id": user_id,
+                "email": email,
+                "password": hashed_password,
+                "created_at": now,
+                "updated_at": now,
+            }
+            self.users_by_email[email] = user_id
+            user = copy.deepcopy(self.users[user_id])
+        self._publish("users", [user])
+
+    def get_user_password_and_email(self, email: str) -> list:
+        with self._lock:
+            user_id = self.users_by_email.get(email)
+            user = self.users.get(user_id)
+            if user is None:
+                return []
+            return [{"email": user["email"], "password": user["password"]}]
+
+    def get_app_id_by_name(self, app_name: str):
+        with self._lock:
+            for app in self.apps.values():
+                if app.get("app_name") == app_name:
+                    return app.get("app_id")
+            return None
+
+    def list_apps(self) -> list:
+        with self._lock:
+            return [_project(app, APP_FIELDS) for app in self.apps.values()]
+
+    # ---------------------------
+    # Linked Apps
+    # ---------------------------
+
+    def get_userlinkedapp(self, user_id: int, app_id: int, fields: list = None):
+        with self._lock:
+            return _project(self.userlinkedapps.get((user_id, app_id)), fields)
+
+    def get_userlinkedapps_for_user(self, user_id: int, app_ids: list, fields: list = None) -> dict:
+        with self._lock:
+            return {
+                app_id: _project(self.userlinkedapps[(user_id, app_id)], fields)
+                for app_id in app_ids
+                if (user_id, app_id) in self.userlinkedapps
+            }
+
+    def get_userlinkedapps_expiring(self, start, end, fields: list = None, limit: int = None) -> list:
+        start, end = parse_expiry(start), parse_expiry(end)
+        with self._lock:
+            expiring = []
+            for row in self.userlinkedapps.values():
+                expires_at = parse_expiry(row.get("token_expires_at"))
+                if expires_at is not None and start <= expires_at < end:
+                    expiring.append((expires_at, _project(row, fields)))
+        expiring.sort(key=lambda item: item[0])
+        return [row for _, row in expiring[:limit]]
+
+    def set_userlinkedapps(self, user_id: int, app_ids: list, data: dict) -> None:
+        now = DT.datetime.utcnow()
+        with self._lock:
+            rows = []
+            for app_id in app_ids:
+                row = {
+                    "user_id": user_id,
+                    "app_id": app_id,
+                    "connected_at": now,
+                    "updated_at": now,
+                    **copy.deepcopy(data),
+                }
+                self.userlinkedapps[(user_id, app_id)] = row
+                rows.append(copy.deepcopy(row))
+        self._publish("userlinkedapps", rows)
+
+    def create_userlinkedapp(self, user_id: int, app_id: int, data: dict) -> bool:
+        with self._lock:
+            if (user_id, app_id) in self.userlinkedapps:
+                return False
+            row = {
+                "user_id": user_id,
+                "app_id": app_id,
+                "updated_at": DT.datetime.utcnow(),
+                **copy.deepcopy(data),
+            }
+            self.userlinkedapps[(user_id, app_id)] = row
+            row = copy.deepcopy(row)
+        self._publish("userlinkedapps", [row])
+        return True
+
+    def update_userlinkedapps(self, user_id: int, app_ids: list, data: dict) -> None:
+        now = DT.datetime.utcnow()
+        with self._lock:
+            rows = []
+            for app_id in app_ids:
+                row = self.userlinkedapps.get((user_id, app_id))
+                if row is not None:
+                    row.update(copy.deepcopy(data), updated_at=now)
+                    rows.append(copy.deepcopy(row))
+        self._publish("userlinkedapps", rows)
+
+    def delete_userlinkedapp(self, user_id: int, app_id: int) -> None:
+        with self._lock:
+            row = self.userlinkedapps.pop((user_id, app_id), None)
+        if row is not None:
+            self._publish("userlinkedapps", [{**row, "removed": True}])
+
+    # ---------------------------
+    # Profiles and Chains
+    # ---------------------------
+
+    def get_user_profiles(self, user_id: int, fields: list = None) -> list:
+        with self._lock:
+            return [_project(row, fields) for row in self.userprofiles.get(user_id, [])]
+
+    def get_user_chain_status(self, user_id: int, include_history: bool = False):
+        with self._lock:
+            fields = None if include_history else CHAIN_STATUS_FIELDS
+            return _project(self.userchains.get(user_id), fields)
+
+    def upsert_user_chain(self, user_id: int, action_data: dict) -> dict:
+        now = DT.datetime.utcnow()
+        with self._lock:
+            doc_data = self.userchains.get(user_id)
+            if doc_data is None:
+                doc_data = new_chain(user_id, action_data, now)
+            elif updated_on(doc_data, now.date()):
+                return copy.deepcopy(doc_data)
+            else:
+                doc_data = advance_chain(doc_data, action_data, now)
+            self.userchains[user_id] = doc_data
+            return copy.deepcopy(doc_data)
+
+    def acquire_lease(self, name: str, owner: str, ttl_seconds: float) -> bool:
+        now = DT.datetime.utcnow()
+        with self._lock:
+            lease = self.leases.get(name)
+            if lease is not None and lease["owner"] != owner and lease["expires_at"] > now:
+                return False
+            self.leases[name] = {
+                "owner": owner,
+                "expires_at": now + DT.timedelta(seconds=ttl_seconds),
+            }
+            return True
+
+    def release_lease(self, name: str, owner: str) -> None:
+        with self._lock:
+            lease = self.leases.get(name)
+            if lease is not None and lease["owner"] == owner:
+                del self.leases[name]
@@ -0,0 +1,250 @@
+# metrics.py
+"""
+Per-request accounting of storage operations.
+
+Every storage backend method is classified as a read, query, write or
+transaction (OPERATION_KINDS) and timed. Within a Flask request the counts
+and latencies are collected on ``g`` by an OpRecorder; when the request ends
+they are folded into per-endpoint aggregates with a latency histogram per
+operation kind. Operations outside a request (CLIs, background jobs) are
+aggregated under the "<background>" endpoint.
+
+The data surfaces as:
+  - the X-Firestore-Ops response header in debug mode,
+  - one log line per request (see util/app.py),
+  - GET /firestore_metrics on the util blueprint (admin scope).
+"""
+
+import asyncio
+import bisect
+import functools
+import threading
+import time
+from flask import g, has_app_context
+
+OP_KINDS = ("read", "query", "write", "transaction")
+
+# Storage backend methods and the kind of Firestore operation each issues.
+# The decorator records one operation per call; the Firestore backend records
+# the extra RPCs of its fallback paths itself with count_op() (the users_by_email
+# backfill, the row-by-row update after a failed batch), so the counts match
+# the RPCs sent.
+OPERATION_KINDS = {
+    "get_user_id_by_email": "read",
+    "get_userlinkedapp": "read",
+    "get_userlinkedapps_for_user": "read",
+    "get_user_password_and_email": "query",
+    "get_app_id_by_name": "query",
+    "list_apps": "query",
+    "get_user_profiles": "query",
+    "get_user_chain_status": "query",
+    "get_userlinkedapps_expiring": "query",
+    "insert_user": "write",
+    "set_userlinkedapps": "write",
+    "create_userlinkedapp": "write",
+    "update_userlinkedapps": "write",
+    "delete_userlinkedapp": "write",
+    "upsert_user_chain": "transaction",
+    "acquire_lease": "transaction",
+    "release_lease": "transaction",
+}
+
+# Upper bounds (milliseconds) of the latency histogram buckets; the last
+# bucket catches everything slower.
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+BACKGROUND_ENDPOINT = "<background>"
+
+
+class OpRecorder:
+    """
+    Counts and times the storage operations of one request.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ops = []  # [(kind, elapsed_ms), ...]
+
+    def record(self, kind: str, elapsed_ms: float) -> None:
+        with self._lock:
+            self.ops.append((kind, elapsed_ms))
+
+    def summary(self) -> dict:
+        """
+        Returns {"read": {"count": n, "ms": total}, ..., "total": {...}}.
+        """
+        with self._lock:
+            ops = list(self.ops)
+        result = {kind: {"count": 0, "ms": 0.0} for kind in OP_KINDS}
+        for kind, elapsed_ms in ops:
+            result[kind]["count"] += 1
+            result[kind]["ms"] += elapsed_ms
+        result["total"] = {
+            "count": len(ops),
+            "ms": sum(elapsed_ms for _, elapsed_ms in ops),
+        }
+        for value in result.values():
+            value["ms"] = round(value["ms"], 2)
+        return result
+
+    def header_value(self) -> str:
+        """
+        Formats the summary for the X-Firestore-Ops header, e.g.
+        "read=2;query=1;write=0;transaction=0;ms=14.20".
+        """
+        summary = self.summary()
+        counts = ";".join(f"{kind}={summary[kind]['count']}" for kind in OP_KINDS)
+        return f"{counts};ms={summary['total']['ms']:.2f}"
+
+
+class EndpointStats:
+    """
+    Aggregated operations of every request served by one endpoint.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.counts = {kind: 0 for kind in OP_KINDS}
+        self.max_per_request = {kind: 0 for kind in OP_KINDS}
+        self.histograms = {kind: [0] * (len(LATENCY_BUCKETS_MS) + 1) for kind in OP_KINDS}
+        self.total_ms = {kind: 0.0 for kind in OP_KINDS}
+
+    def add_ops(self, ops: list) -> None:
+        per_request = {kind: 0 for kind in OP_KINDS}
+        for kind, elapsed_ms in ops:
+            per_request[kind] += 1
+            self.counts[kind] += 1
+            self.total_ms[kind] += elapsed_ms
+            self.histograms[kind][bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+        for kind, count in per_request.items():
+            self.max_per_request[kind] = max(self.max_per_request[kind], count)
+
+    def to_dict(self) -> dict:
+        labels = [f"<={bound}ms" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+        requests = max(self.requests, 1)
+        return {
+            "requests": self.requests,
+            "ops": {
+                kind: {
+                    "count": self.counts[kind],
+                    "avg_per_request": round(self.counts[kind] / requests, 2),
+                    "max_per_request": self.max_per_request[kind],
+                    "avg_ms": round(self.total_ms[kind] / self.counts[kind], 2) if self.counts[kind] else 0.0,
+                    "histogram": dict(zip(labels, self.histograms[kind])),
+                }
+                for kind in OP_KINDS
+            },
+        }
+
+
+class StorageMetrics:
+    """
+    Process-wide, thread-safe per-endpoint aggregates.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def _stats(self, endpoint: str) -> EndpointStats:
+        stats = self._endpoints.get(endpoint)
+        if stats is None:
+            stats = self._endpoints[endpoint] = EndpointStats()
+        return stats
+
+    def record_request(self, endpoint: str, recorder: OpRecorder) -> None:
+        with recorder._lock:
+            ops = list(recorder.ops)
+        with self._lock:
+            stats = self._stats(endpoint or "<unknown>")
+            stats.requests += 1
+            stats.add_ops(ops)
+
+    def record_background(self, kind: str, elapsed_ms: float) -> None:
+        with self._lock:
+            self._stats(BACKGROUND_ENDPOINT).add_ops([(kind, elapsed_ms)])
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {endpoint: stats.to_dict() for endpoint, stats in sorted(self._endpoints.items())}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._endpoints.clear()
+
+
+storage_metrics = StorageMetrics()
+
+
+def current_recorder():
+    """
+    Returns the OpRecorder of the running request, or None outside one.
+    """
+    if has_app_context():
+        return g.get("firestore_ops")
+    return None
+
+
+def _record(kind: str, started: float) -> None:
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    recorder = current_recorder()
+    if recorder is not None:
+        recorder.record(kind, elapsed_ms)
+    else:
+        storage_metrics.record_background(kind, elapsed_ms)
+
+
+def count_op(kind: str) -> None:
+    """
+    Records one more ``kind`` operation for a method that issues several RPCs.
+    Its time is already part of the method's own tracked operation, so it is
+    recorded as 0 ms.
+    """
+    recorder = current_recorder()
+    if recorder is not None:
+        recorder.record(kind, 0.0)
+    else:
+        storage_metrics.record_background(kind, 0.0)
+
+
+def track(kind: str):
+    """
+    Decorator recording one ``kind`` operation per call of a function or
+    coroutine function.
+    """
+
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    _record(kind, started)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _record(kind, started)
+
+        return wrapper
+
+    return decorator
+
+
+def instrument_storage(cls):
+    """
+    Class decorator wrapping every method listed in OPERATION_KINDS with
+    track(), so a storage backend is accounted without touching its methods.
+    """
+    for name, kind in OPERATION_KINDS.items():
+        method = cls.__dict__.get(name)
+        if method is not None:
+            setattr(cls, name, track(kind)(method))
+    return cls
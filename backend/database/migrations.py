@@ -0,0 +1,347 @@
+# migrations.py
+"""
+One-off data migrations for the Firestore collections in ``alias_map``.
+
+Each migration streams its collection page by page (ordered by document ID)
+and records a checkpoint after every committed page, so an interrupted run can
+be resumed with the same ``--checkpoint`` file.
+
+Usage (from the backend directory):
+  python -m database.migrations {userlinkedapps-keys,chain-history,token-expiry,
+                                 app-kinds}
+                                [--page-size 250] [--checkpoint FILE]
+                                [--dry-run]
+"""
+
+import argparse
+import json
+import os
+from google.cloud.firestore_v1.field_path import FieldPath
+from database.app_registry import DEFAULT_APPS
+from database.chains import compact_history
+from database.firestore_storage import FirestoreStorage, get_userlinkedapps_doc_id
+from database.storage import get_storage
+from util.logit import get_logger
+from util.tokens import parse_expiry
+
+logger = get_logger("logs", "Migrations")
+
+# A WriteBatch holds at most 500 writes; every migrated row costs two
+# (set the keyed document + delete the legacy one).
+MAX_PAGE_SIZE = 250
+
+
+def load_checkpoint(path: str) -> dict:
+    """
+    Loads a checkpoint written by save_checkpoint, or returns an empty one.
+    """
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    return {"last_doc_id": None, "scanned": 0, "migrated": 0}
+
+
+def save_checkpoint(path: str, checkpoint: dict) -> None:
+    """
+    Atomically writes the checkpoint so a crash never leaves a torn file.
+    """
+    if not path:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(checkpoint, file, indent=2)
+    os.replace(tmp_path, path)
+
+
+def get_firestore_storage() -> FirestoreStorage:
+    """
+    Returns the configured backend, which must be Firestore for migrations.
+
+    Raises:
+    RuntimeError: If another storage backend is configured.
+    """
+    storage = get_storage()
+    if not isinstance(storage, FirestoreStorage):
+        raise RuntimeError("Migrations require STORAGE_BACKEND=firestore.")
+    return storage
+
+
+def stream_pages(collection, page_size: int, start_after_id: str = None):
+    """
+    Yields lists of document snapshots ordered by document ID, fetching one
+    page per round trip so memory stays bounded by ``page_size``.
+    """
+    last_id = start_after_id
+    while True:
+        query = collection.order_by(FieldPath.document_id()).limit(page_size)
+        if last_id:
+            query = query.start_after(
+                {FieldPath.document_id(): collection.document(last_id)}
+            )
+        page = list(query.stream())
+        if not page:
+            return
+        yield page
+        last_id = page[-1].id
+
+
+def _expiry_sort_key(value) -> float:
+    """
+    Turns a stored token_expires_at (datetime or ISO string) into a sortable
+    number; unknown values sort first.
+    """
+    expires_at = parse_expiry(value)
+    return expires_at.timestamp() if expires_at else 0.0
+
+
+def migrate_userlinkedapps_keys(
+    page_size: int = MAX_PAGE_SIZE,
+    checkpoint_path: str = None,
+    dry_run: bool = False,
+) -> dict:
+    """
+    Rewrites UserLinkedApps rows stored under random document IDs to their
+    deterministic "{user_id}_{app_id}" document and deletes the legacy copy.
+
+    When several legacy rows exist for the same pair, the one whose token
+    expires last is kept. Rows already stored under their key are skipped, so
+    the migration is safe to re-run.
+
+    Returns the final checkpoint dictionary with scan/migration counters.
+    """
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    storage = get_firestore_storage()
+    db = storage.db
+    col = storage.get_collection("userlinkedapps")
+    checkpoint = load_checkpoint(checkpoint_path)
+    checkpoint.setdefault("duplicates", 0)
+
+    for page in stream_pages(col, page_size, checkpoint["last_doc_id"]):
+        legacy = []
+        for doc in page:
+            data = doc.to_dict()
+            if "user_id" not in data or "app_id" not in data:
+                logger.warning("Skipping row %s without user_id/app_id", doc.id)
+                continue
+            key = get_userlinkedapps_doc_id(data["user_id"], data["app_id"])
+            if doc.id != key:
+                legacy.append((doc, key, data))
+
+        if legacy:
+            # Fetch every target document of this page in one round trip.
+            targets = {
+                snap.id: snap
+                for snap in db.get_all([col.document(key) for _, key, _ in legacy])
+            }
+            batch = db.batch()
+            for doc, key, data in legacy:
+                target = targets.get(key)
+                if target is not None and target.exists and _expiry_sort_key(
+                    target.to_dict().get("token_expires_at")
+                ) >= _expiry_sort_key(data.get("token_expires_at")):
+                    checkpoint["duplicates"] += 1
+                else:
+                    batch.set(col.document(key), data)
+                    checkpoint["migrated"] += 1
+                    # Later duplicates in the same page compare against this row.
+                    targets[key] = doc
+                batch.delete(doc.reference)
+            if not dry_run:
+                batch.commit()
+
+        checkpoint["scanned"] += len(page)
+        checkpoint["last_doc_id"] = page[-1].id
+        if not dry_run:
+            save_checkpoint(checkpoint_path, checkpoint)
+        logger.info(
+            "userlinkedapps-keys: scanned=%s migrated=%s duplicates=%s last=%s",
+            checkpoint["scanned"],
+            checkpoint["migrated"],
+            checkpoint["duplicates"],
+            checkpoint["last_doc_id"],
+        )
+
+    return checkpoint
+
+
+def migrate_chain_history(
+    page_size: int = MAX_PAGE_SIZE,
+    checkpoint_path: str = None,
+    dry_run: bool = False,
+) -> dict:
+    """
+    Converts UserChains documents that still carry a ``history`` array to the
+    compact layout (active_ranges + recent_actions, see database/chains.py).
+
+    Each converted document is rewritten with one set(), which also drops the
+    history field. Documents already compacted are skipped, so the migration
+    is safe to re-run.
+
+    Returns the final checkpoint dictionary with scan/migration counters.
+    """
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    storage = get_firestore_storage()
+    col = storage.get_collection("userchains")
+    checkpoint = load_checkpoint(checkpoint_path)
+
+    for page in stream_pages(col, page_size, checkpoint["last_doc_id"]):
+        batch = storage.db.batch()
+        pending = 0
+        for doc in page:
+            data = doc.to_dict()
+            if "history" not in data:
+                continue
+            batch.set(doc.reference, compact_history(data))
+            pending += 1
+        if pending and not dry_run:
+            batch.commit()
+
+        checkpoint["migrated"] += pending
+        checkpoint["scanned"] += len(page)
+        checkpoint["last_doc_id"] = page[-1].id
+        if not dry_run:
+            save_checkpoint(checkpoint_path, checkpoint)
+        logger.info(
+            "chain-history: scanned=%s migrated=%s last=%s",
+            checkpoint["scanned"],
+            checkpoint["migrated"],
+            checkpoint["last_doc_id"],
+        )
+
+    return checkpoint
+
+
+def migrate_token_expiry(
+    page_size: int = MAX_PAGE_SIZE,
+    checkpoint_path: str = None,
+    dry_run: bool = False,
+) -> dict:
+    """
+    Rewrites UserLinkedApps token_expires_at values stored as ISO strings or
+    Unix timestamps (older Google links) as UTC datetimes. Firestore compares
+    values of different types by type, so the refresher's datetime range
+    query never matched those rows.
+
+    Rows already holding a datetime are skipped, so the migration is safe to
+    re-run.
+
+    Returns the final checkpoint dictionary with scan/migration counters.
+    """
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    storage = get_firestore_storage()
+    col = storage.get_collection("userlinkedapps")
+    checkpoint = load_checkpoint(checkpoint_path)
+
+    for page in stream_pages(col, page_size, checkpoint["last_doc_id"]):
+        batch = storage.db.batch()
+        pending = 0
+        for doc in page:
+            value = doc.to_dict().get("token_expires_at")
+            if not isinstance(value, (str, int, float)):
+                continue
+            expires_at = parse_expiry(value)
+            if expires_at is None:
+                logger.warning("Skipping row %s with unreadable token_expires_at", doc.id)
+                continue
+            batch.update(doc.reference, {"token_expires_at": expires_at})
+            pending += 1
+        if pending and not dry_run:
+            batch.commit()
+
+        checkpoint["migrated"] += pending
+        checkpoint["scanned"] += len(page)
+        checkpoint["last_doc_id"] = page[-1].id
+        if not dry_run:
+            save_checkpoint(checkpoint_path, checkpoint)
+        logger.info(
+            "token-expiry: scanned=%s migrated=%s last=%s",
+            checkpoint["scanned"],
+            checkpoint["migrated"],
+            checkpoint["last_doc_id"],
+        )
+
+    return checkpoint
+
+
+def migrate_app_kinds(
+    page_size: int = MAX_PAGE_SIZE,
+    checkpoint_path: str = None,
+    dry_run: bool = False,
+) -> dict:
+    """
+    Writes the "kind" and "display_name" fields of the known Apps documents,
+    taken from the app_registry.DEFAULT_APPS row with the same app_name, so
+    the registry stops relying on its legacy fallback. Documents that already
+    carry the fields and unknown apps are left alone.
+
+    Returns the final checkpoint dictionary with scan/migration counters.
+    """
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    defaults = {app["app_name"]: app for app in DEFAULT_APPS}
+    storage = get_firestore_storage()
+    col = storage.get_collection("apps")
+    checkpoint = load_checkpoint(checkpoint_path)
+
+    for page in stream_pages(col, page_size, checkpoint["last_doc_id"]):
+        batch = storage.db.batch()
+        pending = 0
+        for doc in page:
+            data = doc.to_dict()
+            default = defaults.get(data.get("app_name"))
+            if default is None:
+                continue
+            update = {
+                field: default[field]
+                for field in ("kind", "display_name")
+                if field in default and field not in data
+            }
+            if update:
+                batch.update(doc.reference, update)
+                pending += 1
+        if pending and not dry_run:
+            batch.commit()
+
+        checkpoint["migrated"] += pending
+        checkpoint["scanned"] += len(page)
+        checkpoint["last_doc_id"] = page[-1].id
+        if not dry_run:
+            save_checkpoint(checkpoint_path, checkpoint)
+        logger.info(
+            "app-kinds: scanned=%s migrated=%s last=%s",
+            checkpoint["scanned"],
+            checkpoint["migrated"],
+            checkpoint["last_doc_id"],
+        )
+
+    return checkpoint
+
+
+MIGRATIONS = {
+    "userlinkedapps-keys": migrate_userlinkedapps_keys,
+    "chain-history": migrate_chain_history,
+    "token-expiry": migrate_token_expiry,
+    "app-kinds": migrate_app_kinds,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a Firestore data migration.")
+    parser.add_argument("migration", choices=sorted(MIGRATIONS))
+    parser.add_argument("--page-size", type=int, default=MAX_PAGE_SIZE,
+                        help="Documents fetched and committed per round trip.")
+    parser.add_argument("--checkpoint", default=None,
+                        help="JSON file used to resume an interrupted run.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Scan and report without writing anything.")
+    args = parser.parse_args(argv)
+
+    result = MIGRATIONS[args.migration](
+        page_size=args.page_size,
+        checkpoint_path=args.checkpoint,
+        dry_run=args.dry_run,
+    )
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
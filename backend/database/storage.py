@@ -0,0 +1,200 @@
+# storage.py
+"""
+Storage backend interface behind ``database.firebase_operations``.
+
+``firebase_operations`` keeps the public, SQL-flavoured API used by the
+blueprints and delegates every read and write to the backend returned by
+get_storage(). The backend is picked by ``settings.storage_backend``:
+
+  firestore  FirestoreStorage, the production backend (default)
+  memory     InMemoryStorage, a thread-safe, network-free backend for local
+             runs, load tests and CI
+"""
+
+import threading
+from abc import ABC, abstractmethod
+from config.config import settings
+
+# Fields of an Apps document that list_apps returns. "kind" is the stable
+# identifier code looks integrations up by; "display_name" is the name shown
+# to API clients where it differs from app_name (see database/app_registry.py).
+APP_FIELDS = ["app_id", "app_name", "kind", "display_name"]
+
+
+class StorageBackend(ABC):
+    """
+    The operations the application performs on its data.
+
+    Linked-app rows are dictionaries with the keys user_id, app_id,
+    connected_at, access_token, refresh_token, token_expires_at and scopes.
+
+    Reads that take a ``fields`` list return only those fields (a projection,
+    like SELECT a, b instead of SELECT *); None returns whole documents.
+    """
+
+    def warm_up(self) -> None:
+        """
+        Optionally prepares connections ahead of the first request. Backends
+        without anything to prepare keep this no-op.
+        """
+
+    def watch(self, publish) -> None:
+        """
+        Starts delivering changes of the users, userlinkedapps and apps
+        collections as publish(collection, data) calls, including changes
+        made by other processes where the backend supports it (see
+        database/invalidation.py). The default delivers nothing.
+        """
+
+    # ---------------------------
+    # Users and Apps
+    # ---------------------------
+
+    @abstractmethod
+    def get_user_id_by_email(self, email: str):
+        """Returns the user_id registered with the email, or None."""
+
+    @abstractmethod
+    def next_user_id(self) -> int:
+        """Returns a new, unique numeric user ID."""
+
+    @abstractmethod
+    def insert_user(self, user_id: int, email: str, hashed_password: str) -> None:
+        """Stores a new user together with its email lookup entry."""
+
+    @abstractmethod
+    def get_user_password_and_email(self, email: str) -> list:
+        """Returns [{"email": ..., "password": ...}] for the email, or []."""
+
+    @abstractmethod
+    def get_app_id_by_name(self, app_name: str):
+        """Returns the app_id registered with the app name, or None."""
+
+    @abstractmethod
+    def list_apps(self) -> list:
+        """Returns the APP_FIELDS of every registered app; kind and display_name may be missing."""
+
+    # ---------------------------
+    # Linked Apps
+    # ---------------------------
+
+    @abstractmethod
+    def get_userlinkedapp(self, user_id: int, app_id: int, fields: list = None):
+        """Returns the linked-app row for the pair, or None."""
+
+    @abstractmethod
+    def get_userlinkedapps_for_user(self, user_id: int, app_ids: list, fields: list = None) -> dict:
+        """Returns {app_id: row} for the linked apps among app_ids, in one round trip."""
+
+    @abstractmethod
+    def set_userlinkedapps(self, user_id: int, app_ids: list, data: dict) -> None:
+        """
+        Atomically replaces the rows of every app in app_ids with data,
+        stamping user_id, app_id and connected_at.
+        """
+
+    @abstractmethod
+    def create_userlinkedapp(self, user_id: int, app_id: int, data: dict) -> bool:
+        """Stores the row only if none exists; returns whether it was created."""
+
+    @abstractmethod
+    def update_userlinkedapps(self, user_id: int, app_ids: list, data: dict) -> None:
+        """Updates the given fields on the existing rows of app_ids; missing rows are skipped."""
+
+    @abstractmethod
+    def delete_userlinkedapp(self, user_id: int, app_id: int) -> None:
+        """Deletes the row for the pair if it exists."""
+
+    @abstractmethod
+    def get_userlinkedapps_expiring(self, start, end, fields: list = None, limit: int = None) -> list:
+        """
+        Returns the rows whose token_expires_at lies in [start, end), soonest
+        expiry first, at most limit of them.
+        """
+
+    # ---------------------------
+    # Profiles and Chains
+    # ---------------------------
+
+    @abstractmethod
+    def get_user_profiles(self, user_id: int, fields: list = None) -> list:
+        """Returns the user's profile documents."""
+
+    @abstractmethod
+    def get_user_chain_status(self, user_id: int, include_history: bool = False):
+        """Returns the user's chain document, or None; history only when include_history is set."""
+
+    @abstractmethod
+    def upsert_user_chain(self, user_id: int, action_data: dict) -> dict:
+        """Records an action on the user's chain and returns the new chain document."""
+
+    # ---------------------------
+    # Leases
+    # ---------------------------
+
+    @abstractmethod
+    def acquire_lease(self, name: str, owner: str, ttl_seconds: float) -> bool:
+        """
+        Takes (or extends) the named lease for owner for ttl_seconds. Returns
+        False while another owner holds an unexpired lease.
+        """
+
+    @abstractmethod
+    def release_lease(self, name: str, owner: str) -> None:
+        """Releases the named lease if owner still holds it."""
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def create_storage(name: str) -> StorageBackend:
+    """
+    Builds the backend registered under name ("firestore" or "memory").
+
+    Backends are imported lazily so the in-memory backend never loads the
+    Firestore client libraries.
+
+    Raises:
+    ValueError: If the name is not a known backend.
+    """
+    if name == "firestore":
+        from database.firestore_storage import FirestoreStorage
+
+        return FirestoreStorage()
+    if name == "memory":
+        from database.memory_storage import InMemoryStorage
+
+        return InMemoryStorage()
+    raise ValueError(f"Storage backend '{name}' not configured.")
+
+
+def get_storage() -> StorageBackend:
+    """
+    Returns the process-wide backend, creating it from settings on first use.
+    """
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = create_storage(settings.storage_backend)
+    return _storage
+
+
+def warm_up_storage() -> None:
+    """
+    Explicit warm-up hook: builds the configured backend and lets it open its
+    connections. Call it in each serving process after any fork, e.g. right
+    before waitress starts serving.
+    """
+    get_storage().warm_up()
+
+
+def set_storage(storage: StorageBackend) -> None:
+    """
+    Replaces the process-wide backend, e.g. with a fresh InMemoryStorage in a
+    benchmark or test.
+    """
+    global _storage
+    with _storage_lock:
+        _storage = storage
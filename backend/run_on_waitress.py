@@ -1,5 +1,12 @@
 from waitress import serve
 from server import app  # Adjust based on your project structure
+from config.config import settings
+from database.storage import warm_up_storage
+from database.app_registry import app_registry
 
 if __name__ == '__main__':
-    serve(app, host='0.0.0.0', port=8080, ssl_context=('cert.pem', 'key.pem'))
\ No newline at end of file
+    if settings.storage_warm_up:
+        # Open the database connection before the first request is accepted.
+        warm_up_storage()
+        app_registry.refresh()
+    serve(app, host='0.0.0.0', port=8080, ssl_context=('cert.pem', 'key.pem'))
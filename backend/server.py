@@ -12,6 +12,7 @@ try:
     from util.logit import get_logger, check_log_folder
     from Blueprints.auth import auth_bp
     from Blueprints.user_profile import profile_bp
+    from util.app import register_request_hooks
     import pandas as pd
     import argparse
     from config.config import settings
@@ -59,6 +60,9 @@ def log_request():
     logger.info(f"Request received: {request.method} {request.url}")
 
 app.before_request(log_request)
+# Background services, Firestore accounting, the request budget and its 504
+# answer, shared with util/app.py. Deadline errors count towards the stats.
+register_request_hooks(app, logger, count_error=lambda code: increment_error_count(code))
 
 # Swagger documentation setup
 swaggerui_blueprint = get_swaggerui_blueprint(
@@ -282,7 +286,8 @@ error_counts = {
     405: 0,
     408: 0,
     429: 0,
-    500: 0
+    500: 0,
+    504: 0
 }
 
 def increment_error_count(status_code):
@@ -546,4 +551,10 @@ if __name__ == "__main__":
     parser.add_argument("--port", type=int, default=8080, help="Port to run the Flask app.")
     args = parser.parse_args()
 
+    if settings.storage_warm_up:
+        from database.storage import warm_up_storage
+        from database.app_registry import app_registry
+        warm_up_storage()
+        app_registry.refresh()
+
     app.run(host="0.0.0.0", port=args.port, ssl_context=('cert.pem', 'key.pem'))
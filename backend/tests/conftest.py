@@ -0,0 +1,116 @@
+import os
+import tempfile
+
+# Settings are read when config.config is imported; tests run without a .env,
+# against the in-memory backend and without network access.
+for _name in (
+    "SPOTIFY_CLIENT_ID", "SPOTIFY_CLIENT_SECRET", "AUTH_REDIRECT_URI",
+    "SALT", "MUSIXMATCH_API_KEY", "GOOGLE_CLIENT_ID", "GOOGLE_CLIENT_SECRET",
+    "GOOGLE_CLIENT_SECRET_FILE", "APPLE_TEAM_ID", "APPLE_KEY_ID",
+    "APPLE_PRIVATE_KEY_PATH", "APPLE_DEVELOPER_TOKEN", "FIREBASE_CC_JSON",
+    "FIREBASECONFIG_APIKEY", "FIREBASECONFIG_AUTHDOMAIN", "FIREBASECONFIG_PROJECTID",
+    "FIREBASECONFIG_STORAGEBUCKET", "FIREBASECONFIG_MESSAGINGSENDERID",
+    "FIREBASECONFIG_APPID", "FIREBASECONFIG_MEASUREMENTID",
+):
+    os.environ.setdefault(_name, "test")
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret-key-of-at-least-32-bytes")
+os.environ["STORAGE_BACKEND"] = "memory"
+
+import pytest  # noqa: E402
+
+
+def pytest_sessionstart(session):
+    # Loggers and file-based rate limits write relative to the working
+    # directory; keep them out of the source tree.
+    os.chdir(tempfile.mkdtemp(prefix="ygg-tests-"))
+
+
+class FakeResponse:
+    """
+    The parts of requests.Response the provider clients use.
+    """
+
+    def __init__(self, status_code=200, body=None, headers=None):
+        self.status_code = status_code
+        self._body = {} if body is None else body
+        self.headers = headers or {}
+        self.text = str(self._body)
+        self.content = self.text.encode()
+
+    def json(self):
+        return self._body
+
+
+class FakeSession:
+    """
+    Stands in for a pooled requests.Session: returns (or raises) the queued
+    outcomes in order and records every call.
+    """
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def storage():
+    """
+    A fresh InMemoryStorage as the process-wide backend, with the facade
+    caches emptied.
+    """
+    from database import firebase_operations
+    from database.memory_storage import InMemoryStorage
+    from database.storage import get_storage, set_storage
+
+    previous = get_storage()
+    backend = InMemoryStorage()
+    set_storage(backend)
+    firebase_operations.user_id_cache.clear()
+    firebase_operations.chain_update_cache.clear()
+    yield backend
+    set_storage(previous)
+    firebase_operations.user_id_cache.clear()
+    firebase_operations.chain_update_cache.clear()
+
+
+@pytest.fixture
+def app(storage):
+    """
+    The modular app (util/app.py) on top of the in-memory backend.
+    """
+    from flask import Flask
+    from util.app import create_app
+
+    return create_app(Flask("server"), testing=True)
+
+
+@pytest.fixture
+def dispatch(app):
+    """
+    Runs one request through the app's hooks and view and returns the
+    response. Requests carry a JWT of the given user with the default scopes.
+    """
+    from flask_jwt_extended import create_access_token
+    from util.authlib import default_user
+
+    def run(method, path, json=None, email=None):
+        headers = {}
+        if email is not None:
+            with app.app_context():
+                token = create_access_token(
+                    identity=email, additional_claims={"scopes": default_user}
+                )
+            headers["Authorization"] = f"Bearer {token}"
+        with app.test_request_context(
+            path, method=method, json=json, headers=headers, base_url="https://localhost"
+        ):
+            return app.full_dispatch_request()
+
+    return run
@@ -0,0 +1,39 @@
+from database.app_registry import GOOGLE, SPOTIFY, YOUTUBE_MUSIC, AppRegistry
+from util import google
+
+
+def _registry(apps):
+    registry = AppRegistry(refresh_seconds=3600, apps=apps)
+    registry._loaded_at = float("inf")  # never reload from storage
+    return registry
+
+
+def test_lookups_use_kind_and_display_name():
+    registry = _registry([
+        {"app_id": 10, "app_name": "Spotify", "kind": SPOTIFY},
+        {"app_id": 20, "app_name": "Google", "kind": GOOGLE, "display_name": "Google API"},
+    ])
+
+    assert registry.get_app_id_by_kind(SPOTIFY) == 10
+    assert registry.get_kind(20) == GOOGLE
+    assert registry.get_app_id("Google API") == registry.get_app_id("Google") == 20
+    assert registry.items() == [("Spotify", 10), ("Google API", 20)]
+
+
+def test_legacy_documents_fall_back_to_the_defaults():
+    registry = _registry([
+        {"app_id": 3, "app_name": "YoutubeMusic"},
+        {"app_id": 4, "app_name": "Google"},
+        {"app_id": 5, "app_name": "Tidal"},
+    ])
+
+    assert registry.get_app_id_by_kind(YOUTUBE_MUSIC) == 3
+    assert registry.get_alias(4) == "Google API"
+    assert registry.get_kind(5) is None
+    assert registry.get_alias(5) == "Tidal"
+
+
+def test_google_lookups_without_a_registered_google_app(storage, monkeypatch):
+    monkeypatch.setattr(google, "google_app_ids", lambda: ())
+
+    assert google._stored_fresh_access_token(7) is None
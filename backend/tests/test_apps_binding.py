@@ -0,0 +1,66 @@
+import datetime as DT
+import pytest
+import requests
+from Blueprints import apps
+from database import firebase_operations
+from util.tokens import TokenRevoked, is_revocation
+from conftest import FakeResponse
+
+EMAIL = "listener@example.com"
+SPOTIFY_APP_ID = 1
+
+
+@pytest.fixture
+def spotify_user(storage):
+    user_id = firebase_operations.insert_user(EMAIL, "password")
+    firebase_operations.insert_userlinkedapps(
+        user_id, SPOTIFY_APP_ID, "access", "refresh",
+        (DT.datetime.now(DT.timezone.utc) + DT.timedelta(hours=1)).isoformat(), "scope",
+    )
+    return user_id
+
+
+def _spotify_binding(dispatch, monkeypatch, profile):
+    def get_current_user_profile(*args, **kwargs):
+        if isinstance(profile, BaseException):
+            raise profile
+        return profile
+
+    monkeypatch.setattr(apps, "get_current_user_profile", get_current_user_profile)
+    response = dispatch("POST", "/apps/get_all_apps_binding", json={"user_email": EMAIL}, email=EMAIL)
+    assert response.status_code == 200
+    return next(app for app in response.get_json()["apps"] if app["app_name"] == "Spotify")
+
+
+def test_invalid_grant_is_a_revocation():
+    assert is_revocation(FakeResponse(400, {"error": "invalid_grant"}))
+    assert not is_revocation(FakeResponse(400, {"error": "invalid_request"}))
+    assert not is_revocation(FakeResponse(503, {"error": "invalid_grant"}))
+    assert not is_revocation(None)
+
+
+def test_linked_app_reports_its_profile(spotify_user, dispatch, monkeypatch):
+    binding = _spotify_binding(dispatch, monkeypatch, {"display_name": "Listener"})
+
+    assert binding == {"app_name": "Spotify", "user_linked": True,
+                       "user_profile": {"display_name": "Listener"}}
+
+
+@pytest.mark.parametrize("error", [
+    requests.exceptions.ConnectionError("reset"),
+    requests.exceptions.Timeout("slow"),
+    RuntimeError("unexpected"),
+])
+def test_failed_check_keeps_the_link(spotify_user, dispatch, monkeypatch, storage, error):
+    binding = _spotify_binding(dispatch, monkeypatch, error)
+
+    assert binding["user_linked"] is True
+    assert binding["user_profile"] is None
+    assert (spotify_user, SPOTIFY_APP_ID) in storage.userlinkedapps
+
+
+def test_revoked_credentials_unlink_the_app(spotify_user, dispatch, monkeypatch, storage):
+    binding = _spotify_binding(dispatch, monkeypatch, TokenRevoked("invalid_grant"))
+
+    assert binding["user_linked"] is False
+    assert (spotify_user, SPOTIFY_APP_ID) not in storage.userlinkedapps
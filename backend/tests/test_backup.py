@@ -0,0 +1,73 @@
+import gzip
+import json
+import threading
+import pytest
+from database import backup
+
+
+class FakeDoc:
+    def __init__(self, doc_id):
+        self.id = doc_id
+
+    def to_dict(self):
+        return {"n": int(self.id)}
+
+
+class FakeStorage:
+    def get_collection(self, collection):
+        return collection
+
+
+DOCS = [FakeDoc(f"{i:03d}") for i in range(7)]
+
+
+def _fake_pages(collection, page_size, start_after_id=None):
+    docs = [doc for doc in DOCS if start_after_id is None or doc.id > start_after_id]
+    for start in range(0, len(docs), page_size):
+        yield docs[start:start + page_size]
+
+
+def _export(directory, progress, checkpoint):
+    return backup.export_collection(
+        FakeStorage(), "users", str(directory), progress, 2, str(checkpoint), threading.Lock()
+    )
+
+
+def _exported_ids(directory):
+    with gzip.open(backup.export_path(str(directory), "users"), "rt", encoding="utf-8") as file:
+        return [json.loads(line)["id"] for line in file]
+
+
+def test_resumed_export_is_readable_and_complete(tmp_path, monkeypatch):
+    monkeypatch.setattr(backup, "stream_pages", _fake_pages)
+    checkpoint = tmp_path / "checkpoint.json"
+    save_checkpoint = backup.save_checkpoint
+    saves = []
+
+    def crash_on_second_page(path, progress):
+        saves.append(path)
+        if len(saves) == 2:
+            raise KeyboardInterrupt  # killed after writing page 2, before its checkpoint
+        save_checkpoint(path, progress)
+
+    monkeypatch.setattr(backup, "save_checkpoint", crash_on_second_page)
+    with pytest.raises(KeyboardInterrupt):
+        _export(tmp_path, {}, checkpoint)
+    # A member the killed process never finished.
+    with open(backup.export_path(str(tmp_path), "users"), "ab") as file:
+        file.write(gzip.compress(b'{"id":"torn"}\n')[:12])
+
+    monkeypatch.setattr(backup, "save_checkpoint", save_checkpoint)
+    progress = backup.load_progress(str(checkpoint))
+    assert progress["users"]["count"] == 2
+
+    assert _export(tmp_path, progress, checkpoint) == len(DOCS)
+    assert _exported_ids(tmp_path) == [doc.id for doc in DOCS]
+
+
+def test_checkpoint_without_file_size_starts_over(tmp_path, monkeypatch):
+    monkeypatch.setattr(backup, "stream_pages", _fake_pages)
+    progress = {"users": {"last_doc_id": "003", "count": 4, "done": False}}
+
+    assert _export(tmp_path, progress, tmp_path / "checkpoint.json") == len(DOCS)
+    assert _exported_ids(tmp_path) == [doc.id for doc in DOCS]
@@ -0,0 +1,85 @@
+import pytest
+from database import firebase_operations
+from database.invalidation import invalidation_bus
+from util import cache
+from util.cache import TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    A settable monotonic clock for the cache.
+    """
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_entries_expire_after_their_ttl(clock):
+    entries = TTLCache(ttl=10)
+    entries.set("default", 1)
+    entries.set("short", 2, ttl=1)
+
+    clock[0] += 5
+    assert entries.get("default") == 1
+    assert entries.get("short") is None
+
+    clock[0] += 5
+    assert entries.get("default", "gone") == "gone"
+    assert len(entries) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    entries = TTLCache(maxsize=2)
+    entries.set("a", 1)
+    entries.set("b", 2)
+    entries.get("a")
+
+    entries.set("c", 3)
+
+    assert entries.get("a") == 1
+    assert entries.get("b") is None
+    assert entries.get("c") == 3
+
+
+def test_invalidate_and_clear():
+    entries = TTLCache()
+    entries.set("a", 1)
+    entries.set("b", 2)
+
+    entries.invalidate("a")
+    entries.invalidate("missing")
+    assert entries.get("a") is None and entries.get("b") == 2
+
+    entries.clear()
+    assert len(entries) == 0
+
+
+def test_user_id_lookups_are_cached(storage, monkeypatch):
+    user_id = firebase_operations.insert_user("cached@example.com", "password")
+    firebase_operations.invalidate_user_cache()
+    lookups = []
+    lookup = storage.get_user_id_by_email
+    monkeypatch.setattr(storage, "get_user_id_by_email",
+                        lambda email: lookups.append(email) or lookup(email))
+
+    assert firebase_operations.get_user_id_by_email("cached@example.com") == user_id
+    assert firebase_operations.get_user_id_by_email("cached@example.com") == user_id
+    assert lookups == ["cached@example.com"]
+
+
+def test_unknown_emails_are_not_cached(storage):
+    assert firebase_operations.get_user_id_by_email("late@example.com") is None
+
+    user_id = storage.next_user_id()
+    storage.insert_user(user_id, "late@example.com", "hash")
+
+    assert firebase_operations.get_user_id_by_email("late@example.com") == user_id
+
+
+def test_user_change_drops_the_cached_id(storage):
+    firebase_operations.user_id_cache.set("moved@example.com", 41)
+
+    invalidation_bus.publish("users", {"email": "moved@example.com"})
+
+    assert firebase_operations.user_id_cache.get("moved@example.com") is None
@@ -0,0 +1,64 @@
+import datetime as DT
+import threading
+import pytest
+from database import firebase_operations
+
+ACTION = {"action": "completed"}
+
+
+@pytest.fixture
+def backend_updates(storage, monkeypatch):
+    """
+    Counts the chain updates that reach the storage backend.
+    """
+    calls = []
+    upsert = storage.upsert_user_chain
+
+    def counting_upsert(user_id, action_data):
+        calls.append(user_id)
+        return upsert(user_id, action_data)
+
+    monkeypatch.setattr(storage, "upsert_user_chain", counting_upsert)
+    return calls
+
+
+def test_concurrent_updates_reach_the_backend_once(backend_updates):
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(
+            firebase_operations.upsert_user_chain(7, ACTION)))
+        for _ in range(10)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert backend_updates == [7]
+    assert [result["chain_streak"] for result in results] == [1] * 10
+
+
+def test_cached_chain_is_a_copy(backend_updates):
+    firebase_operations.upsert_user_chain(7, ACTION)["chain_streak"] = 99
+
+    assert firebase_operations.upsert_user_chain(7, ACTION)["chain_streak"] == 1
+
+
+def test_next_day_update_reaches_the_backend(storage, backend_updates):
+    firebase_operations.upsert_user_chain(7, ACTION)
+    yesterday = (DT.datetime.utcnow() - DT.timedelta(days=1)).isoformat()
+    storage.userchains[7]["last_update_date"] = yesterday
+    cached = firebase_operations.chain_update_cache.get(7)
+    cached["last_update_date"] = yesterday
+    firebase_operations.chain_update_cache.set(7, cached)
+
+    doc = firebase_operations.upsert_user_chain(7, ACTION)
+
+    assert backend_updates == [7, 7]
+    assert doc["chain_streak"] == 2
+
+
+def test_backend_skips_same_day_writes(storage):
+    first = storage.upsert_user_chain(7, ACTION)
+
+    assert storage.upsert_user_chain(7, ACTION) == first
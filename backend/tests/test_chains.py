@@ -0,0 +1,108 @@
+import datetime as DT
+from database.chains import (
+    HISTORY_WINDOW_DAYS,
+    RECENT_ACTIONS_LIMIT,
+    advance_chain,
+    compact_history,
+    current_streak,
+    is_active_on,
+    new_chain,
+    status_view,
+)
+
+ACTION = {"action": "completed"}
+
+
+def _at(day: str) -> DT.datetime:
+    return DT.datetime.fromisoformat(f"{day}T09:00:00")
+
+
+def _chain(*days):
+    doc = new_chain(1, ACTION, _at(days[0]))
+    for day in days[1:]:
+        advance_chain(doc, ACTION, _at(day))
+    return doc
+
+
+def test_consecutive_days_extend_the_streak_and_one_range():
+    doc = _chain("2025-01-01", "2025-01-02", "2025-01-03")
+
+    assert doc["chain_streak"] == doc["max_chain_streak"] == 3
+    assert doc["broken"] is False
+    assert doc["active_ranges"] == [{"start": "2025-01-01", "end": "2025-01-03"}]
+
+
+def test_a_gap_breaks_the_streak_and_opens_a_range():
+    doc = _chain("2025-01-01", "2025-01-02", "2025-01-05")
+
+    assert doc["chain_streak"] == 1
+    assert doc["max_chain_streak"] == 2
+    assert doc["broken"] is True
+    assert doc["chain_start_date"] == "2025-01-05"
+    assert len(doc["active_ranges"]) == 2
+
+
+def test_same_day_update_keeps_the_streak():
+    doc = _chain("2025-01-01", "2025-01-02", "2025-01-02")
+
+    assert doc["chain_streak"] == 2
+    assert doc["active_ranges"] == [{"start": "2025-01-01", "end": "2025-01-02"}]
+
+
+def test_recent_actions_are_bounded():
+    doc = new_chain(1, ACTION, _at("2025-01-01"))
+    for offset in range(1, RECENT_ACTIONS_LIMIT + 10):
+        advance_chain(doc, ACTION, _at("2025-01-01") + DT.timedelta(days=offset))
+
+    assert len(doc["recent_actions"]) == RECENT_ACTIONS_LIMIT
+    assert len(doc["active_ranges"]) == 1
+
+
+def test_legacy_history_is_compacted():
+    doc = {"history": [
+        {"action": "completed", "date": "2025-01-03T10:00:00"},
+        {"action": "completed", "date": "2025-01-01T10:00:00"},
+        {"action": "completed", "date": "2025-01-02T10:00:00"},
+        {"action": "completed", "date": "2025-01-07T10:00:00"},
+    ]}
+
+    compact_history(doc)
+
+    assert "history" not in doc
+    assert doc["active_ranges"] == [
+        {"start": "2025-01-01", "end": "2025-01-03"},
+        {"start": "2025-01-07", "end": "2025-01-07"},
+    ]
+    assert is_active_on(doc, DT.date(2025, 1, 2))
+    assert not is_active_on(doc, DT.date(2025, 1, 5))
+
+
+def test_streak_is_dead_once_a_day_is_missed():
+    doc = _chain("2025-01-01", "2025-01-02")
+
+    assert current_streak(doc, DT.date(2025, 1, 3)) == 2
+    assert current_streak(doc, DT.date(2025, 1, 4)) == 0
+
+
+def test_status_view_keeps_the_client_contract():
+    doc = _chain("2024-10-01", "2025-01-01", "2025-01-02")
+
+    view = status_view(doc, DT.date(2025, 1, 2))
+
+    assert "active_ranges" not in view and "recent_actions" not in view
+    assert view["history"] == [
+        {"action": "completed", "date": "2025-01-01"},
+        {"action": "completed", "date": "2025-01-02"},
+    ]
+    assert view["active_today"] is True
+    assert view["current_streak"] == 2
+    assert (DT.date(2025, 1, 2) - DT.date(2024, 10, 1)).days > HISTORY_WINDOW_DAYS
+
+
+def test_status_view_with_full_history():
+    doc = _chain("2024-10-01", "2025-01-01")
+
+    view = status_view(doc, DT.date(2025, 1, 2), include_history=True)
+
+    assert [entry["date"] for entry in view["history"]] == ["2024-10-01", "2025-01-01"]
+    assert len(view["recent_actions"]) == 2
@@ -0,0 +1,108 @@
+import threading
+import time
+import pytest
+from flask import Flask, g
+from util import fanout
+from util.app import register_request_hooks
+from util.deadline import DeadlineExceeded, remaining, timeout_for
+from util.logit import get_logger
+from util.singleflight import SingleFlight
+
+
+@pytest.fixture
+def request_with_budget():
+    """
+    Pushes a request context whose deadline is the given number of seconds
+    away.
+    """
+    app = Flask("deadline-test")
+    contexts = []
+
+    def push(seconds):
+        ctx = app.test_request_context("/")
+        ctx.push()
+        contexts.append(ctx)
+        g.deadline = time.monotonic() + seconds
+
+    yield push
+    for ctx in reversed(contexts):
+        ctx.pop()
+
+
+def test_timeout_for_outside_a_request_uses_the_default():
+    assert remaining() is None
+    assert timeout_for(10) == 10
+
+
+def test_timeout_for_is_capped_by_the_budget(request_with_budget):
+    request_with_budget(2)
+
+    assert timeout_for(10) <= 2
+    assert timeout_for(1) == 1
+
+
+def test_timeout_for_raises_once_spent_unless_floored(request_with_budget):
+    request_with_budget(-1)
+
+    with pytest.raises(DeadlineExceeded):
+        timeout_for(10, what="Firestore read")
+    assert timeout_for(10, minimum=3) == 3
+
+
+def test_fanout_result_is_bounded_by_the_budget(request_with_budget):
+    request_with_budget(0.1)
+    release = threading.Event()
+    future = fanout.submit(release.wait, 5)
+
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        fanout.result(future, "slow call")
+    assert time.monotonic() - started < 1
+    release.set()
+
+
+def test_fanout_propagates_the_deadline(request_with_budget):
+    request_with_budget(5)
+
+    left = fanout.result(fanout.submit(remaining))
+
+    assert left is not None and 0 < left <= 5
+
+
+def test_singleflight_follower_wait_is_bounded_by_the_budget(request_with_budget):
+    flight = SingleFlight("test")
+    leader_started, release = threading.Event(), threading.Event()
+
+    def slow():
+        leader_started.set()
+        release.wait(5)
+        return "token"
+
+    leader = threading.Thread(target=flight.do, args=("key", slow))
+    leader.start()
+    leader_started.wait(1)
+
+    request_with_budget(0.1)
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        flight.do("key", lambda: "other")
+    assert time.monotonic() - started < 1
+
+    release.set()
+    leader.join(1)
+
+
+def test_shared_hooks_answer_504_and_count_it(storage):
+    app = Flask("hooks-test")
+    codes = []
+    register_request_hooks(app, get_logger("logs", "HooksTest"), count_error=codes.append)
+
+    @app.route("/slow")
+    def slow():
+        raise DeadlineExceeded("calling upstream")
+
+    with app.test_request_context("/slow"):
+        response = app.full_dispatch_request()
+
+    assert response.status_code == 504
+    assert codes == [504]
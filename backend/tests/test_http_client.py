@@ -0,0 +1,134 @@
+from email.message import Message
+import pytest
+import requests
+from requests.cookies import MockRequest, MockResponse
+from util import http_client
+from util.http_client import CircuitBreaker, CircuitOpenError, HTTPClient
+from util.rate_limit import RateLimitTimeout
+from conftest import FakeResponse, FakeSession
+
+URL = "https://upstream.test/v1/items"
+
+
+def _client(*outcomes, **kwargs):
+    """
+    An HTTPClient without backoff waits whose upstream.test session returns
+    the given outcomes.
+    """
+    client = HTTPClient(backoff_base=0, **kwargs)
+    session = FakeSession(*outcomes)
+    client._sessions[client.host_of(URL)] = session
+    return client, session
+
+
+def test_one_session_per_host():
+    client = HTTPClient()
+
+    first = client.session_for("https://api.spotify.com/v1/me")
+    assert client.session_for("https://api.spotify.com/v1/playlists") is first
+    assert client.session_for("https://www.googleapis.com/oauth2/v2/userinfo") is not first
+
+
+def test_sessions_never_keep_cookies():
+    session = HTTPClient().session_for(URL)
+    headers = Message()
+    headers["Set-Cookie"] = "sid=secret; Path=/"
+    request = requests.Request("GET", URL).prepare()
+
+    session.cookies.extract_cookies(MockResponse(headers), MockRequest(request))
+
+    assert len(session.cookies) == 0
+
+
+def test_default_timeout_unless_the_call_passes_one():
+    client, session = _client(FakeResponse(), FakeResponse(), timeout=(1, 2))
+
+    client.get(URL)
+    client.get(URL, timeout=7)
+
+    assert [kwargs["timeout"] for _, _, kwargs in session.calls] == [(1, 2), 7]
+
+
+def test_idempotent_calls_retry_transient_failures():
+    client, session = _client(
+        requests.exceptions.ConnectionError("reset"),
+        FakeResponse(503),
+        FakeResponse(200, {"ok": True}),
+    )
+
+    assert client.get(URL).json() == {"ok": True}
+    assert len(session.calls) == 3
+    assert client.breaker_for(URL).retries == 2
+
+
+def test_post_is_never_retried():
+    client, session = _client(FakeResponse(503), FakeResponse(200))
+
+    assert client.post(URL).status_code == 503
+    assert len(session.calls) == 1
+
+
+def test_long_retry_after_is_returned_to_the_caller():
+    client, session = _client(
+        FakeResponse(429, headers={"Retry-After": "60"}), FakeResponse(200), backoff_max=10
+    )
+
+    assert client.get(URL).status_code == 429
+    assert len(session.calls) == 1
+
+
+def test_circuit_opens_after_consecutive_failures():
+    client, session = _client(
+        *[FakeResponse(500)] * 2, breaker_threshold=2, breaker_reset_seconds=60
+    )
+
+    assert client.get(URL, retries=0).status_code == 500
+    assert client.get(URL, retries=0).status_code == 500
+    with pytest.raises(CircuitOpenError):
+        client.get(URL)
+    assert len(session.calls) == 2
+    assert client.stats()["https://upstream.test"]["state"] == CircuitBreaker.OPEN
+
+
+def test_half_open_circuit_lets_one_trial_through():
+    breaker = CircuitBreaker(threshold=1, reset_seconds=0)
+    breaker.record_failure()
+
+    breaker.before_call("host")  # the trial
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call("host")
+    breaker.record_success()
+    breaker.before_call("host")
+
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failed_trial_opens_the_circuit_again():
+    breaker = CircuitBreaker(threshold=5, reset_seconds=60)
+    breaker.state, breaker.opened_at = CircuitBreaker.HALF_OPEN, 0
+
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call("host")
+
+
+def test_rate_limit_timeout_frees_the_half_open_trial(monkeypatch):
+    client, session = _client(FakeResponse(200), breaker_reset_seconds=60)
+    breaker = client.breaker_for(URL)
+    breaker.state, breaker.opened_at = CircuitBreaker.OPEN, 0  # reset elapsed
+
+    def exhausted(method, url, max_wait=None):
+        raise RateLimitTimeout("spotify")
+
+    monkeypatch.setattr(http_client.rate_limiter, "acquire", exhausted)
+    with pytest.raises(RateLimitTimeout):
+        client.get(URL)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # The next caller runs the trial instead of being short-circuited.
+    monkeypatch.undo()
+    assert client.get(URL).status_code == 200
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert len(session.calls) == 1
@@ -0,0 +1,67 @@
+import threading
+from database.id_allocator import BlockIdAllocator
+
+
+class FakeCounter:
+    """
+    Stands in for the counters/users document: reserving a block moves its
+    "seq" up by the block size, as the transaction does.
+    """
+
+    def __init__(self, seq=0):
+        self.seq = seq
+        self.transactions = 0
+        self._lock = threading.Lock()
+
+    def allocator(self, block_size):
+        allocator = BlockIdAllocator(lambda: None, "counters", "users", block_size=block_size)
+
+        def reserve_block():
+            with self._lock:
+                self.transactions += 1
+                self.seq += allocator.block_size
+                return self.seq
+
+        allocator._reserve_block = reserve_block
+        return allocator
+
+
+def test_one_transaction_per_block():
+    counter = FakeCounter(seq=41)
+    allocator = counter.allocator(block_size=5)
+
+    ids = [allocator.next_id() for _ in range(7)]
+
+    assert ids == [42, 43, 44, 45, 46, 47, 48]
+    assert counter.transactions == 2
+    assert counter.seq == 51
+
+
+def test_processes_get_disjoint_ids():
+    counter = FakeCounter()
+    allocators = [counter.allocator(block_size=3) for _ in range(3)]
+    ids = []
+
+    def allocate(allocator):
+        for _ in range(10):
+            ids.append(allocator.next_id())
+
+    threads = [threading.Thread(target=allocate, args=(a,)) for a in allocators * 2]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(ids) == len(set(ids)) == 60
+    assert max(ids) <= counter.seq
+
+
+def test_forked_child_reserves_its_own_block():
+    counter = FakeCounter()
+    allocator = counter.allocator(block_size=10)
+    allocator.next_id()
+
+    allocator._pid = -1  # as seen from a forked child
+
+    assert allocator.next_id() == 11
+    assert counter.transactions == 2
@@ -0,0 +1,41 @@
+import datetime as DT
+from database import firebase_operations
+from database.invalidation import InvalidationBus
+from util.google import _invalidate_google_credentials, google_credentials
+
+
+def _expiry():
+    return DT.datetime.now(DT.timezone.utc) + DT.timedelta(hours=1)
+
+
+def test_memory_backend_publishes_deletions_as_removed(storage):
+    events = []
+    bus = InvalidationBus()
+    bus.subscribe("userlinkedapps", events.append)
+    storage.watch(bus.publish)
+
+    firebase_operations.insert_userlinkedapps(7, 3, "token", "refresh", _expiry(), "scope")
+    firebase_operations.delete_userlinkedapps(7, 3)
+
+    assert events[0]["access_token"] == "token" and not events[0].get("removed")
+    assert events[-1]["removed"] is True
+
+
+def test_google_cache_survives_events_of_its_own_token():
+    google_credentials.store(7, "token", _expiry())
+
+    _invalidate_google_credentials({"user_id": 7, "app_id": 3, "access_token": "token"})
+    assert google_credentials._cached(7) == "token"
+
+    _invalidate_google_credentials({"user_id": 7, "app_id": 3, "access_token": "other"})
+    assert google_credentials._cached(7) is None
+
+
+def test_google_cache_is_dropped_when_the_link_is_removed():
+    google_credentials.store(7, "token", _expiry())
+
+    _invalidate_google_credentials(
+        {"user_id": 7, "app_id": 4, "access_token": "token", "removed": True}
+    )
+
+    assert google_credentials._cached(7) is None
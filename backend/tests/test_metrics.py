@@ -0,0 +1,43 @@
+from flask import g
+from database import firebase_operations
+from database.metrics import OpRecorder, count_op, storage_metrics, track
+
+
+def test_op_recorder_header_value():
+    recorder = OpRecorder()
+    recorder.record("read", 1.5)
+    recorder.record("read", 0.5)
+    recorder.record("write", 2.0)
+
+    assert recorder.header_value() == "read=2;query=0;write=1;transaction=0;ms=4.00"
+
+
+def test_count_op_adds_to_the_tracked_call(app):
+    @track("write")
+    def update_then_delete():
+        count_op("write")
+
+    with app.test_request_context("/"):
+        app.preprocess_request()
+        update_then_delete()
+        summary = g.firestore_ops.summary()
+
+    assert summary["write"]["count"] == 2
+    assert summary["total"]["count"] == 2
+
+
+def test_chain_status_endpoint_op_count(dispatch):
+    user_id = firebase_operations.insert_user("ops@example.com", "secret1")
+    firebase_operations.upsert_user_chain(user_id, {"action": "completed"})
+    storage_metrics.reset()
+
+    response = dispatch("POST", "/profile/chain_status", email="ops@example.com")
+
+    assert response.status_code == 200
+    assert response.get_json()["history"][-1]["action"] == "completed"
+    # The user ID comes from the facade cache; the status is one projected query.
+    stats = storage_metrics.snapshot()["profile.get_current_user_chain_status"]
+    assert stats["requests"] == 1
+    assert {kind: value["count"] for kind, value in stats["ops"].items()} == {
+        "read": 0, "query": 1, "write": 0, "transaction": 0,
+    }
@@ -0,0 +1,85 @@
+import threading
+import pytest
+from util import rate_limit
+from util.rate_limit import (
+    YOUTUBE_SEARCH_COST,
+    FileTokenBucket,
+    RateLimiter,
+    RateLimitTimeout,
+    TokenBucket,
+    classify,
+)
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    """
+    Records the waits of the buckets instead of sleeping through them.
+    """
+    waits = []
+    monkeypatch.setattr(rate_limit.time, "sleep", waits.append)
+    return waits
+
+
+def test_calls_are_classified_by_provider_and_cost():
+    assert classify("GET", "https://api.spotify.com/v1/me") == ("spotify", 1)
+    assert classify("GET", "https://www.googleapis.com/youtube/v3/search?q=x") == (
+        "youtube", YOUTUBE_SEARCH_COST)
+    assert classify("POST", "https://www.googleapis.com/youtube/v3/playlists")[1] > 1
+    assert classify("POST", "https://accounts.spotify.com/api/token") == (None, 0)
+
+
+def test_bucket_allows_a_burst_then_queues(no_sleep):
+    bucket = TokenBucket(rate=10, capacity=3)
+
+    assert all(bucket.acquire(max_wait=1) for _ in range(3))
+    assert no_sleep == []
+    assert bucket.acquire(max_wait=1)
+    assert len(no_sleep) == 1 and 0 < no_sleep[0] <= 0.1
+
+
+def test_bucket_refuses_waits_longer_than_max_wait(no_sleep):
+    bucket = TokenBucket(rate=1, capacity=1)
+    bucket.acquire()
+
+    assert not bucket.acquire(max_wait=0.5)
+    assert no_sleep == []
+
+
+def test_bucket_is_shared_by_threads(no_sleep):
+    bucket = TokenBucket(rate=0.001, capacity=50)
+    granted = []
+
+    def take():
+        granted.append(bucket.acquire(max_wait=0))
+
+    threads = [threading.Thread(target=take) for _ in range(80)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert granted.count(True) == 50
+
+
+@pytest.mark.skipif(rate_limit.fcntl is None, reason="needs fcntl")
+def test_file_buckets_share_their_tokens(tmp_path, no_sleep):
+    path = str(tmp_path / "spotify.json")
+    first = FileTokenBucket(path, rate=0.001, capacity=2)
+    second = FileTokenBucket(path, rate=0.001, capacity=2)
+
+    assert first.acquire()
+    assert second.acquire()
+    assert not first.acquire()
+    assert not second.acquire()
+
+
+def test_limiter_raises_when_the_queue_is_too_long(no_sleep):
+    limiter = RateLimiter(limits={"spotify": (1, 1)}, max_wait=0.5)
+    limiter.acquire("GET", "https://api.spotify.com/v1/me")
+
+    with pytest.raises(RateLimitTimeout) as raised:
+        limiter.acquire("GET", "https://api.spotify.com/v1/me")
+    assert raised.value.bucket == "spotify"
+    # Unlimited endpoints never wait.
+    limiter.acquire("POST", "https://accounts.spotify.com/api/token")
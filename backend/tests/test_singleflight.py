@@ -0,0 +1,94 @@
+import threading
+import time
+import pytest
+from util.singleflight import SingleFlight
+
+
+def _run_concurrently(count, target):
+    results = [None] * count
+
+    def run(index):
+        try:
+            results[index] = target()
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def _slow(calls, result="token", error=None):
+    def fn():
+        calls.append(1)
+        time.sleep(0.1)
+        if error is not None:
+            raise error
+        return result
+
+    return fn
+
+
+def test_concurrent_callers_share_one_run():
+    flight, calls = SingleFlight("test"), []
+
+    results = _run_concurrently(8, lambda: flight.do(("spotify", 1), _slow(calls)))
+
+    assert calls == [1]
+    assert results == ["token"] * 8
+
+
+def test_different_keys_run_separately():
+    flight, calls = SingleFlight("test"), []
+
+    _run_concurrently(2, lambda: flight.do(threading.get_ident(), _slow(calls)))
+
+    assert len(calls) == 2
+
+
+def test_waiting_callers_receive_the_error():
+    flight, calls = SingleFlight("test"), []
+    error = RuntimeError("refresh failed")
+
+    results = _run_concurrently(4, lambda: flight.do("key", _slow(calls, error=error)))
+
+    assert calls == [1]
+    assert results == [error] * 4
+
+
+def test_result_is_shared_for_share_seconds():
+    flight, calls = SingleFlight("test", share_seconds=60), []
+
+    flight.do("key", _slow(calls, "first"))
+
+    assert flight.do("key", _slow(calls, "second")) == "first"
+    assert calls == [1]
+
+
+def test_lease_holder_elsewhere_is_followed(storage):
+    flight = SingleFlight("test", lease_seconds=0.3, poll_interval=0.05)
+    storage.acquire_lease("test:key", "another-host:1", 0.2)
+    calls = []
+
+    result = flight.do("key", _slow(calls), follower=lambda: "from-another-process")
+
+    assert result == "from-another-process"
+    assert calls == []
+
+
+def test_lease_is_released_after_the_run(storage):
+    flight = SingleFlight("test", lease_seconds=5)
+
+    assert flight.do("key", lambda: "token") == "token"
+    assert storage.leases == {}
+
+
+@pytest.mark.parametrize("follower", [None, lambda: None])
+def test_runs_itself_when_the_follower_has_nothing(storage, follower):
+    flight = SingleFlight("test", lease_seconds=0.2, poll_interval=0.05)
+    storage.acquire_lease("test:key", "another-host:1", 60)
+
+    assert flight.do("key", lambda: "own", follower=follower) == "own"
@@ -0,0 +1,66 @@
+import datetime as DT
+from database import firebase_operations
+from util.token_refresher import TokenRefresher
+
+
+def _link(user_id, app_id, expires_in_minutes):
+    firebase_operations.insert_userlinkedapps(
+        user_id, app_id, f"access-{user_id}", f"refresh-{user_id}",
+        (DT.datetime.now(DT.timezone.utc) + DT.timedelta(minutes=expires_in_minutes)).isoformat(),
+        "scope",
+    )
+
+
+def _refreshed_users(refresher):
+    refreshed = []
+    refresher._refresh_spotify = lambda row: refreshed.append(row["user_id"]) or "token"
+    refresher._refresh_google = lambda row: refreshed.append(row["user_id"]) or "token"
+    refresher.run_once()
+    return sorted(refreshed)
+
+
+def test_iso_expiry_is_stored_as_a_datetime(storage):
+    _link(1, 1, 5)
+
+    assert isinstance(storage.userlinkedapps[(1, 1)]["token_expires_at"], DT.datetime)
+
+
+def test_only_recently_active_links_are_refreshed(storage):
+    _link(1, 1, 5)
+    _link(2, 1, 5)
+    _link(3, 3, 5)
+    _link(4, 1, 60)  # not expiring yet
+    storage.userlinkedapps[(2, 1)]["last_seen_at"] = (
+        DT.datetime.now(DT.timezone.utc) - DT.timedelta(days=30)
+    )
+
+    assert _refreshed_users(TokenRefresher(ahead_seconds=600, active_days=7)) == [1, 3]
+
+
+def test_links_without_activity_are_skipped(storage):
+    _link(1, 1, 5)
+    del storage.userlinkedapps[(1, 1)]["last_seen_at"]
+
+    assert _refreshed_users(TokenRefresher(ahead_seconds=600)) == []
+
+
+def test_inactive_links_do_not_fill_the_batch(storage):
+    for user_id in range(1, 6):
+        _link(user_id, 1, 2)
+        del storage.userlinkedapps[(user_id, 1)]["last_seen_at"]
+    _link(6, 1, 5)
+    _link(7, 1, 6)
+
+    assert _refreshed_users(TokenRefresher(ahead_seconds=600, batch_size=2)) == [6, 7]
+
+
+def test_rows_sharing_an_expiry_are_paged_through(storage):
+    expires_at = DT.datetime.now(DT.timezone.utc) + DT.timedelta(minutes=5)
+    for user_id in range(1, 6):
+        firebase_operations.insert_userlinkedapps(
+            user_id, 1, "access", "refresh", expires_at, "scope"
+        )
+    for user_id in range(1, 4):
+        del storage.userlinkedapps[(user_id, 1)]["last_seen_at"]
+
+    assert _refreshed_users(TokenRefresher(ahead_seconds=600, batch_size=2)) == [4, 5]
@@ -0,0 +1,99 @@
+import datetime as DT
+import time
+import pytest
+from config.config import settings
+from database import firebase_operations
+from util import youtube
+from util.deadline import DeadlineExceeded
+from util.google import google_credentials
+from conftest import FakeResponse
+
+EMAIL = "listener@example.com"
+VIDEO = {"snippet": {"resourceId": {"videoId": "video-1"}}}
+
+
+@pytest.fixture
+def youtube_api(monkeypatch):
+    """
+    Queues the YouTube API answers and records the token of every call.
+    """
+    answers, tokens = [], []
+
+    def get(url, headers=None, **kwargs):
+        tokens.append(headers["Authorization"].split()[-1])
+        return answers.pop(0)
+
+    monkeypatch.setattr(youtube.http_client, "get", get)
+    return answers, tokens
+
+
+@pytest.fixture
+def google_user(storage):
+    user_id = firebase_operations.insert_user(EMAIL, "password")
+    expires_at = DT.datetime.now(DT.timezone.utc) + DT.timedelta(hours=1)
+    firebase_operations.replace_userlinkedapps(
+        user_id, (3, 4), "revoked", "refresh", expires_at, "scope"
+    )
+    google_credentials.invalidate(user_id)
+    yield user_id
+    google_credentials.invalidate(user_id)
+
+
+def test_rejected_token_is_renewed_once(youtube_api):
+    answers, tokens = youtube_api
+    answers.extend([FakeResponse(401), FakeResponse(200, {"items": []})])
+
+    response, access_token = youtube.youtube_get("https://yt.test", "old", lambda stale: "new")
+
+    assert response.status_code == 200
+    assert access_token == "new"
+    assert tokens == ["old", "new"]
+
+
+def test_without_a_new_token_the_401_is_returned(youtube_api):
+    answers, tokens = youtube_api
+    answers.append(FakeResponse(401))
+
+    response, access_token = youtube.youtube_get("https://yt.test", "old", lambda stale: None)
+
+    assert response.status_code == 401
+    assert tokens == ["old"]
+
+
+def test_endpoint_retries_with_a_refreshed_token(google_user, dispatch, youtube_api, monkeypatch):
+    answers, tokens = youtube_api
+    answers.extend([FakeResponse(401), FakeResponse(200, {"items": [VIDEO]})])
+    refreshes = []
+    monkeypatch.setattr(
+        "util.google.refresh_access_token_and_update_db_for_Google",
+        lambda user_id, refresh_token, raise_revoked=False: refreshes.append(user_id) or "fresh",
+    )
+
+    response = dispatch(
+        "POST", "/youtube-music/fetch_first_video_id",
+        json={"user_email": EMAIL, "playlist_id": "playlist"}, email=EMAIL,
+    )
+
+    assert response.status_code == 200
+    assert response.get_json() == {"videoId": "video-1"}
+    assert tokens == ["revoked", "fresh"]
+    assert refreshes == [google_user]
+
+
+def test_playlist_cache_is_bounded():
+    assert youtube.playlist_cache.maxsize == settings.playlist_cache_maxsize
+    assert youtube.playlist_cache.ttl > youtube.CACHE_DURATION
+
+
+def test_expired_playlist_is_served_when_out_of_time(monkeypatch):
+    stale = ([], 0, 0)
+    youtube.playlist_cache.set("playlist", (stale, time.time() - 1))
+
+    def out_of_time(*args, **kwargs):
+        raise DeadlineExceeded("calling YouTube")
+
+    monkeypatch.setattr(youtube, "youtube_get", out_of_time)
+    try:
+        assert youtube.playlist_items("token", "playlist") is stale
+    finally:
+        youtube.playlist_cache.invalidate("playlist")
@@ -1,5 +1,5 @@
 from config.config import settings
-from flask import Flask, render_template, request
+from flask import Flask, g, jsonify, render_template, request
 from flask_talisman import Talisman
 from flask_jwt_extended import JWTManager
 from flask_limiter import Limiter
@@ -7,6 +7,62 @@ from flask_cors import CORS
 from util.logit import get_logger
 from util.blueprints import register_blueprints
 from util.error_handlers import register_error_handlers
+from database.invalidation import invalidation_bus
+from util.token_refresher import token_refresher
+from util.deadline import DeadlineExceeded, start_request_deadline
+from database.metrics import OpRecorder, storage_metrics
+
+
+def register_request_hooks(app: Flask, logger, count_error=None) -> None:
+    """
+    Registers the per-request hooks shared by create_app and server.py: the
+    per-process background services, Firestore operation accounting, the
+    request time budget and its 504 answer.
+
+    Parameters:
+    app (Flask): The application.
+    logger: The service logger.
+    count_error (callable, optional): Called with 504 when a request runs
+                                      out of time, for error statistics.
+    """
+    # Cache invalidation listeners are started per process on its first request.
+    app.before_request(invalidation_bus.ensure_started)
+    # So is the background token refresher, when enabled.
+    app.before_request(token_refresher.ensure_started)
+
+    def start_firestore_accounting():
+        g.firestore_ops = OpRecorder()
+
+    def finish_firestore_accounting(response):
+        """
+        Logs the storage operations of the request, adds them to the
+        per-endpoint aggregates and, in debug mode, to the X-Firestore-Ops
+        response header.
+        """
+        recorder = g.get("firestore_ops")
+        if recorder is None:
+            return response
+        storage_metrics.record_request(request.endpoint, recorder)
+        header_value = recorder.header_value()
+        logger.info(f"Firestore ops for {request.method} {request.path}: {header_value}")
+        if str(settings.debug_mode) == "True":
+            response.headers["X-Firestore-Ops"] = header_value
+        return response
+
+    app.before_request(start_firestore_accounting)
+    app.after_request(finish_firestore_accounting)
+
+    # Every request gets a time budget; upstream and Firestore timeouts are
+    # derived from what is left of it (util/deadline.py).
+    app.before_request(start_request_deadline)
+
+    def deadline_exceeded(e):
+        if count_error is not None:
+            count_error(504)
+        logger.warning(f"Deadline exceeded for {request.method} {request.path}: {e}")
+        return jsonify({"error": "The request took too long. Please try again."}), 504
+
+    app.register_error_handler(DeadlineExceeded, deadline_exceeded)
 
 
 def create_app(app: Flask, testing=False):
@@ -51,6 +107,7 @@ def create_app(app: Flask, testing=False):
         logger.info(f"Request received: {request.method} {request.url}")
 
     app.before_request(log_request)
+    register_request_hooks(app, logger)
 
     @app.route("/", methods=["GET"])
     def index():
@@ -0,0 +1,80 @@
+import time
+from flask import g, has_app_context, request
+from config.config import settings
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when the request's time budget is used up before an upstream or
+    Firestore call could be made.
+    """
+
+    def __init__(self, what: str = "request"):
+        super().__init__(f"Deadline exceeded before {what}")
+        self.what = what
+
+
+def budget_for(endpoint: str) -> float:
+    """
+    Returns the time budget in seconds of an endpoint ("blueprint.view", as
+    in request.endpoint): its ENDPOINT_BUDGETS entry, else
+    REQUEST_BUDGET_SECONDS.
+    """
+    return float(settings.endpoint_budgets.get(endpoint, settings.request_budget_seconds))
+
+
+def start_request_deadline() -> None:
+    """
+    before_request hook: stores the request's absolute deadline on g.
+    """
+    g.deadline = time.monotonic() + budget_for(request.endpoint)
+
+
+def get_deadline():
+    """
+    Returns the running request's deadline (a time.monotonic() value), or
+    None outside a request.
+    """
+    if has_app_context():
+        return g.get("deadline")
+    return None
+
+
+def remaining():
+    """
+    Returns the seconds left in the request's budget (negative once it is
+    spent), or None outside a request.
+    """
+    deadline = get_deadline()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def timeout_for(default: float, minimum: float = 0, what: str = "request") -> float:
+    """
+    Derives a call's timeout from the remaining budget.
+
+    Parameters:
+    default (float): The timeout used outside a request, and the upper bound.
+    minimum (float): A floor for calls that must not be cut short (writes);
+                     with a floor the budget never raises.
+    what (str): Describes the call in the DeadlineExceeded message.
+
+    Returns:
+    float: min(default, remaining budget), but at least minimum.
+
+    Raises:
+    DeadlineExceeded: If the budget is spent and there is no floor.
+    """
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0 and not minimum:
+        raise DeadlineExceeded(what)
+    return min(default, max(left, minimum))
@@ -0,0 +1,65 @@
+import functools
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from flask import copy_current_request_context, g, has_request_context
+from config.config import settings
+from util.deadline import DeadlineExceeded, remaining
+
+# Request state carried into worker threads: the storage operation recorder
+# (database/metrics.py) and the request deadline (util/deadline.py).
+PROPAGATED_G = ("firestore_ops", "deadline")
+
+# One bounded pool per process for per-request fan-out, so concurrent
+# requests cannot multiply the number of threads calling upstreams.
+_executor = ThreadPoolExecutor(
+    max_workers=max(1, settings.fanout_workers), thread_name_prefix="fanout"
+)
+
+
+def submit(fn, *args, **kwargs):
+    """
+    Runs fn(*args, **kwargs) on the fan-out pool.
+
+    Within a request the call runs in a copy of the request context. Pushing
+    it creates a fresh ``g`` in the worker, so the request's storage recorder
+    and deadline are copied over: the worker's Firestore operations are
+    accounted to the request and its upstream calls respect its budget.
+
+    Returns:
+    concurrent.futures.Future: The pending result.
+    """
+    if not has_request_context():
+        return _executor.submit(fn, *args, **kwargs)
+
+    state = {name: g.get(name) for name in PROPAGATED_G}
+
+    @copy_current_request_context
+    def run():
+        for name, value in state.items():
+            if value is not None:
+                setattr(g, name, value)
+        return fn(*args, **kwargs)
+
+    return _executor.submit(functools.wraps(fn)(run))
+
+
+def result(future, what: str = "fan-out call"):
+    """
+    Waits for a submitted call, at most for the request's remaining budget.
+
+    Parameters:
+    future (concurrent.futures.Future): A future returned by submit().
+    what (str): Describes the call in the DeadlineExceeded message.
+
+    Returns:
+    The call's return value; its exception is raised as is.
+
+    Raises:
+    DeadlineExceeded: If the budget runs out first. The call keeps running
+                      on the pool, but its own upstream calls stop at the same
+                      deadline.
+    """
+    left = remaining()
+    try:
+        return future.result(timeout=None if left is None else max(left, 0))
+    except FutureTimeout:
+        raise DeadlineExceeded(what)
@@ -1,13 +1,153 @@
-import requests
+import datetime as DT
+import threading
+from util.http_client import http_client
 from config.config import settings
+from util.cache import TTLCache
 from util.logit import get_logger
+from util.tokens import (
+    TokenRevoked,
+    is_revocation,
+    is_token_fresh,
+    parse_expiry,
+    record_link_activity,
+    token_refresh,
+)
+from database.app_registry import GOOGLE, YOUTUBE_MUSIC, app_registry
+from database.invalidation import invalidation_bus
 import database.firebase_operations as firebase_operations
 
 logger = get_logger("logs", "GoogleUtils")
 
 
+def google_app_ids() -> tuple:
+    """
+    Returns the app IDs a Google link is stored under (YouTube Music, then
+    Google API). Both rows always carry the same tokens.
+    """
+    return tuple(
+        app_id
+        for app_id in (app_registry.get_app_id_by_kind(YOUTUBE_MUSIC),
+                       app_registry.get_app_id_by_kind(GOOGLE))
+        if app_id is not None
+    )
+
+
+class GoogleCredentialManager:
+    """
+    Per-user cache of Google access tokens in front of UserLinkedApps.
+
+    A token is served from memory until it is about to expire (see
+    util.tokens.is_token_fresh); only then are the stored row read and, if
+    that token is stale too, the refresh token exchanged at
+    oauth2.googleapis.com. Refreshes are collapsed per user: concurrent
+    requests of one user wait for the first refresh and reuse its token,
+    while other users proceed in parallel.
+
+    Parameters:
+    maxsize (int): The maximum number of users whose tokens are cached.
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        self._tokens = TTLCache(maxsize=maxsize, ttl=3600)
+        # Striped per-user locks, as for chain updates.
+        self._locks = [threading.Lock() for _ in range(64)]
+
+    def _lock_for(self, user_id):
+        return self._locks[hash(user_id) % len(self._locks)]
+
+    def _cached(self, user_id, stale_token: str = None):
+        entry = self._tokens.get(user_id)
+        if entry is None:
+            return None
+        access_token, expires_at = entry
+        if access_token == stale_token or not is_token_fresh(expires_at):
+            return None
+        return access_token
+
+    def store(self, user_id, access_token: str, expires_at) -> None:
+        """
+        Caches a token until its expiry (a datetime, ISO string or timestamp).
+        """
+        expires_at = parse_expiry(expires_at)
+        if not access_token or expires_at is None:
+            return
+        ttl = (expires_at - DT.datetime.now(DT.timezone.utc)).total_seconds()
+        if ttl > 0:
+            self._tokens.set(user_id, (access_token, expires_at), ttl=ttl)
+
+    def invalidate(self, user_id, unless_token: str = None) -> None:
+        """
+        Drops the user's cached token, unless it is unless_token: the change
+        event of a row that carries the cached token (e.g. this process's own
+        refresh) leaves nothing stale.
+        """
+        if unless_token is not None:
+            entry = self._tokens.get(user_id)
+            if entry is not None and entry[0] == unless_token:
+                return
+        self._tokens.invalidate(user_id)
+
+    def get_access_token(self, user_id, app_id: int, stale_token: str = None,
+                         raise_revoked: bool = False):
+        """
+        Returns a usable Google access token for the user, refreshing it only
+        when the stored one is about to expire.
+
+        Parameters:
+        user_id : The unique identifier of the user.
+        app_id (int): The linked app whose row holds the tokens, one of
+                      google_app_ids().
+        stale_token (str, optional): A token Google just rejected; it is never
+                                     returned, so the caller gets a new one.
+        raise_revoked (bool): Raise TokenRevoked instead of returning None when
+                              Google refuses the refresh token.
+
+        Returns:
+        str: The access token, or None if the user has no Google link or the
+             refresh failed.
+        """
+        access_token = self._cached(user_id, stale_token)
+        if access_token:
+            return access_token
+
+        with self._lock_for(user_id):
+            # Another request of this user may have refreshed meanwhile.
+            access_token = self._cached(user_id, stale_token)
+            if access_token:
+                return access_token
+
+            rows = firebase_operations.get_userlinkedapps_tokens(user_id, app_id)
+            if not rows:
+                return None
+            row = rows[0]
+            # Reached about once per token lifetime for an active user.
+            record_link_activity(user_id, google_app_ids())
+            if row["access_token"] != stale_token and is_token_fresh(row["token_expires_at"]):
+                self.store(user_id, row["access_token"], row["token_expires_at"])
+                return row["access_token"]
+            if not row["refresh_token"]:
+                return None
+            return refresh_access_token_and_update_db_for_Google(
+                user_id, row["refresh_token"], raise_revoked=raise_revoked
+            )
+
+
+google_credentials = GoogleCredentialManager(maxsize=settings.user_cache_maxsize)
+
+
+def _invalidate_google_credentials(data: dict) -> None:
+    # A Google row changed on any node (refresh, re-link, unlink). Our own
+    # refreshes publish the token already cached, so they keep the entry.
+    if data.get("app_id") in google_app_ids() and data.get("user_id") is not None:
+        unless_token = None if data.get("removed") else data.get("access_token")
+        google_credentials.invalidate(data["user_id"], unless_token=unless_token)
+
+
+invalidation_bus.subscribe("userlinkedapps", _invalidate_google_credentials)
+
+
 def get_current_user_profile_google(
-    access_token: str, user_id
+    access_token: str, user_id, raise_revoked: bool = False, retry_on_401: bool = True
 ) -> dict:
     """
     Fetches the Google user profile using the provided access token.
@@ -16,31 +156,36 @@ def get_current_user_profile_google(
     Parameters:
     access_token (str): The access token used to authenticate the request.
     user_id : The unique identifier of the user.
+    raise_revoked (bool): Raise TokenRevoked instead of returning None when
+                          Google rejects the link's credentials for good.
 
     Returns:
     dict: The user profile information if the request is successful, None otherwise.
+
+    Raises:
+    TokenRevoked: With raise_revoked, if the refresh token was refused or a
+                  freshly refreshed token is rejected as well.
     """
     url = "https://www.googleapis.com/oauth2/v1/userinfo"
     headers = {"Authorization": f"Bearer {access_token}"}
     params = {"client_id": settings.google_client_id}
-    response = requests.get(url, headers=headers, params=params)
+    response = http_client.get(url, headers=headers, params=params)
 
     if response.status_code == 200:
         return response.json()
-    elif response.status_code == 401:
-        # Retrieve tokens from your database; assumes result is a dict
-        result = firebase_operations.get_userlinkedapps_access_refresh(user_id, 4)[
-            0]
-        access_token, refresh_token = result["access_token"], result["refresh_token"]
-        # print(access_token)
-        # print(refresh_token)
-        new_access_token = refresh_access_token_and_update_db_for_Google(
-            user_id, refresh_token
+    elif response.status_code == 401 and retry_on_401:
+        new_access_token = google_credentials.get_access_token(
+            user_id, app_registry.get_app_id_by_kind(GOOGLE),
+            stale_token=access_token, raise_revoked=raise_revoked,
         )
-        if new_access_token:
-            return get_current_user_profile_google(new_access_token, user_id)
+        if new_access_token and new_access_token != access_token:
+            return get_current_user_profile_google(
+                new_access_token, user_id, raise_revoked=raise_revoked, retry_on_401=False
+            )
         else:
             return None
+    elif response.status_code == 401 and raise_revoked:
+        raise TokenRevoked(f"Google rejected a refreshed token of user {user_id}")
     else:
         logger.error(
             f"Failed to fetch Google user profile: {response.status_code} - {response.text}"
@@ -48,17 +193,47 @@ def get_current_user_profile_google(
         return None
 
 
-def refresh_access_token_and_update_db_for_Google(user_id, refresh_token):
+def refresh_access_token_and_update_db_for_Google(user_id, refresh_token, raise_revoked=False):
     """
     Refreshes the Google access token using the provided refresh token and updates the database with the new tokens.
+    Concurrent refreshes of the same user are collapsed into one (see
+    util.tokens.token_refresh).
 
     Parameters:
     user_id : The unique identifier of the user.
     refresh_token (str): The refresh token used to obtain a new access token.
+    raise_revoked (bool): Raise TokenRevoked instead of returning None when
+                          Google refuses the refresh token (invalid_grant).
 
     Returns:
     str: The new access token if the refresh is successful, None otherwise.
     """
+    try:
+        return token_refresh.do(
+            ("google", user_id),
+            lambda: _refresh_google_token(user_id, refresh_token),
+            follower=lambda: _stored_fresh_access_token(user_id),
+        )
+    except TokenRevoked:
+        if raise_revoked:
+            raise
+        return None
+
+
+def _stored_fresh_access_token(user_id):
+    # The token another process just stored, unless it is stale as well.
+    app_ids = google_app_ids()
+    if not app_ids:
+        # No Google app is registered, so nothing can be stored for it.
+        return None
+    rows = firebase_operations.get_userlinkedapps_tokens(user_id, app_ids[0])
+    if rows and is_token_fresh(rows[0]["token_expires_at"]):
+        google_credentials.store(user_id, rows[0]["access_token"], rows[0]["token_expires_at"])
+        return rows[0]["access_token"]
+    return None
+
+
+def _refresh_google_token(user_id, refresh_token):
     url = "https://oauth2.googleapis.com/token"
     data = {
         "client_id": settings.google_client_id,
@@ -67,7 +242,7 @@ def refresh_access_token_and_update_db_for_Google(user_id, refresh_token):
         "grant_type": "refresh_token",
     }
     headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    response = requests.post(url, headers=headers, data=data)
+    response = http_client.post(url, headers=headers, data=data)
 
     if response.status_code == 200:
         token_info = response.json()
@@ -76,15 +251,19 @@ def refresh_access_token_and_update_db_for_Google(user_id, refresh_token):
         new_refresh_token = token_info.get("refresh_token", refresh_token)
 
         logger.info("Successfully refreshed Google access token.")
-        firebase_operations.update_userlinkedapps_tokens(
-            new_access_token, new_refresh_token, expires_in, user_id, 3
+        firebase_operations.update_userlinkedapps_tokens_for_apps(
+            new_access_token, new_refresh_token, expires_in, user_id, google_app_ids()
         )
-        firebase_operations.update_userlinkedapps_tokens(
-            new_access_token, new_refresh_token, expires_in, user_id, 4
+        google_credentials.store(
+            user_id,
+            new_access_token,
+            DT.datetime.now(DT.timezone.utc) + DT.timedelta(seconds=expires_in),
         )
         return new_access_token
     else:
         logger.error(
             f"Failed to refresh Google access token: {response.status_code} - {response.text}"
         )
+        if is_revocation(response):
+            raise TokenRevoked(f"Google refused the refresh token of user {user_id}")
         return None
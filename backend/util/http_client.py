@@ -0,0 +1,386 @@
+import datetime as DT
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from config.config import settings
+from util.deadline import DeadlineExceeded, remaining
+from util.logit import get_logger
+from util.rate_limit import rate_limiter
+
+logger = get_logger("logs", "HTTPClient")
+
+# Methods that can be sent twice without changing the outcome; only these are
+# retried automatically.
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+# Responses worth retrying: rate limiting and transient upstream failures.
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Raised instead of calling a host whose circuit breaker is open.
+
+    Attributes:
+    host (str): The upstream host, e.g. "https://api.spotify.com".
+    retry_in (float): Seconds until the breaker lets a trial request through.
+    """
+
+    def __init__(self, host: str, retry_in: float):
+        super().__init__(f"Circuit open for {host}; retry in {retry_in:.1f}s")
+        self.host = host
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker.
+
+    After ``threshold`` consecutive failures (connection errors, timeouts,
+    429 and 5xx responses) the circuit opens and calls fail immediately with
+    CircuitOpenError for ``reset_seconds``. Then one trial call is let
+    through (half-open): success closes the circuit, failure opens it again.
+
+    Parameters:
+    threshold (int): Consecutive failures that open the circuit.
+    reset_seconds (float): How long the circuit stays open.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, threshold: int = 5, reset_seconds: float = 30):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.short_circuited = 0
+        self.times_opened = 0
+
+    def before_call(self, host: str) -> None:
+        """
+        Raises CircuitOpenError if the call must not be made now.
+        """
+        with self._lock:
+            if self.state == self.OPEN:
+                retry_in = self.opened_at + self.reset_seconds - time.monotonic()
+                if retry_in > 0:
+                    self.short_circuited += 1
+                    raise CircuitOpenError(host, retry_in)
+                self.state = self.HALF_OPEN
+            elif self.state == self.HALF_OPEN:
+                # A trial call is already in flight.
+                self.short_circuited += 1
+                raise CircuitOpenError(host, self.reset_seconds)
+            self.requests += 1
+
+    def release(self) -> None:
+        """
+        Hands back the trial slot taken by before_call() when the call was
+        not made after all (e.g. the rate-limit wait or the budget ran out),
+        so the next caller runs the trial instead of the circuit staying
+        half-open for good.
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic() - self.reset_seconds
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.errors += 1
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def record_retry(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "requests": self.requests,
+                "retries": self.retries,
+                "errors": self.errors,
+                "short_circuited": self.short_circuited,
+                "times_opened": self.times_opened,
+            }
+
+
+def retry_after_seconds(response: requests.Response):
+    """
+    Parses a Retry-After header (delay in seconds or an HTTP date) into
+    seconds, or returns None if the response has none.
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=DT.timezone.utc)
+    return max(0.0, (retry_at - DT.datetime.now(DT.timezone.utc)).total_seconds())
+
+
+class HTTPClient:
+    """
+    Outbound HTTP for the provider clients (Spotify, Google/YouTube, Apple
+    Music, Musixmatch), with one pooled requests.Session per upstream host.
+
+    Connections are kept alive and reused across requests and threads, so
+    only the first call to a host pays for the TCP and TLS handshakes; page
+    after page of a playlist reuses the same connection. Sessions are shared
+    by all users, so they never store cookies, and every call gets a default
+    timeout unless it passes its own.
+
+    Idempotent requests that fail with a connection error, a timeout, 429 or
+    5xx are retried up to ``max_retries`` times with full-jitter exponential
+    backoff. A Retry-After header sets the wait instead; when it asks for
+    longer than ``backoff_max`` the response is returned to the caller rather
+    than holding the thread. Each host has a CircuitBreaker, so sustained
+    failures stop the calls instead of piling more load on the upstream.
+
+    Every attempt first waits for the provider's token bucket (see
+    util.rate_limit), so the app stays within its upstream quotas.
+
+    Parameters:
+    pool_maxsize (int): Connections kept open per host; matches the number
+                        of threads that may call one host at once.
+    timeout (tuple): Default (connect, read) timeout in seconds.
+    max_retries (int): Retries per idempotent request.
+    backoff_base (float): Upper bound of the first backoff, doubled per retry.
+    backoff_max (float): Longest single wait between attempts.
+    breaker_threshold (int): Consecutive failures that open a host's circuit.
+    breaker_reset_seconds (float): How long an open circuit rejects calls.
+    """
+
+    def __init__(self, pool_maxsize: int = 20, timeout: tuple = (3.05, 20),
+                 max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 10,
+                 breaker_threshold: int = 5, breaker_reset_seconds: float = 30):
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset_seconds = breaker_reset_seconds
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._breakers = {}
+        self._pid = os.getpid()
+
+    def _new_session(self) -> requests.Session:
+        session = requests.Session()
+        # Responses of one user must never leak cookies into another's calls.
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    @staticmethod
+    def host_of(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def session_for(self, url: str) -> requests.Session:
+        """
+        Returns the session of the url's host, creating it on first use.
+        """
+        host = self.host_of(url)
+        with self._lock:
+            # Pooled sockets must not be shared with a forked child.
+            if self._pid != os.getpid():
+                self._sessions = {}
+                self._pid = os.getpid()
+            session = self._sessions.get(host)
+            if session is None:
+                session = self._sessions[host] = self._new_session()
+            return session
+
+    def breaker_for(self, url: str) -> CircuitBreaker:
+        host = self.host_of(url)
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = self._breakers[host] = CircuitBreaker(
+                    self.breaker_threshold, self.breaker_reset_seconds
+                )
+            return breaker
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Full-jitter backoff before retry number ``attempt`` (0-based).
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def request(self, method: str, url: str, retries: int = None, **kwargs) -> requests.Response:
+        """
+        Sends a request through the host's pooled session.
+
+        Parameters:
+        method (str): The HTTP method.
+        url (str): The full URL.
+        retries (int, optional): Overrides max_retries; non-idempotent methods
+                                 are never retried.
+        **kwargs: Passed on to requests.Session.request.
+
+        Returns:
+        requests.Response: The last response; retryable failures that
+                           outlasted the retries are returned as they are.
+
+        Within a request every attempt's timeout, rate-limit wait and backoff
+        is capped by the request's remaining budget (see util/deadline.py).
+
+        Raises:
+        DeadlineExceeded: If the request's budget is spent.
+        CircuitOpenError: If the host's circuit is open.
+        RateLimitTimeout: If the provider's rate limit would make the call
+                          queue longer than allowed.
+        requests.exceptions.RequestException: If the last attempt failed
+                                              without a response.
+        """
+        timeout = kwargs.pop("timeout", self.timeout)
+        method = method.upper()
+        host = self.host_of(url)
+        breaker = self.breaker_for(url)
+        session = self.session_for(url)
+        if method not in IDEMPOTENT_METHODS:
+            retries = 0
+        elif retries is None:
+            retries = self.max_retries
+
+        attempt = 0
+        last_response = None
+        while True:
+            try:
+                breaker.before_call(host)
+            except CircuitOpenError:
+                # The circuit opened during our retries: report the last answer.
+                if last_response is None:
+                    raise
+                return last_response
+            try:
+                # Queue behind the provider's rate limit instead of earning a 429.
+                rate_limiter.acquire(method, url, max_wait=self._budget(rate_limiter.max_wait, url))
+                attempt_timeout = self._attempt_timeout(timeout, url)
+            except BaseException:
+                # No call was made, so it cannot count as the half-open trial.
+                breaker.release()
+                raise
+            try:
+                response = session.request(method, url, timeout=attempt_timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                breaker.record_failure()
+                if attempt >= retries:
+                    raise
+                delay = self.backoff(attempt)
+                logger.warning("%s %s failed (%s); retrying in %.2fs", method, host, e, delay)
+            except Exception:
+                breaker.record_failure()
+                raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    breaker.record_success()
+                    return response
+                breaker.record_failure()
+                if attempt >= retries:
+                    return response
+                delay = retry_after_seconds(response)
+                if delay is None:
+                    delay = self.backoff(attempt)
+                elif delay > self.backoff_max:
+                    # Waiting that long would pin the worker thread; let the
+                    # caller degrade instead.
+                    return response
+                logger.warning(
+                    "%s %s answered %s; retrying in %.2fs",
+                    method, host, response.status_code, delay,
+                )
+                # Reading the body returns the connection to the pool.
+                last_response, _ = response, response.content
+            left = remaining()
+            if left is not None and delay >= left:
+                # No budget left for another attempt.
+                if last_response is None:
+                    raise DeadlineExceeded(f"retrying {host}")
+                return last_response
+            breaker.record_retry()
+            time.sleep(delay)
+            attempt += 1
+
+    @staticmethod
+    def _budget(seconds: float, url: str) -> float:
+        """
+        Caps seconds at the request's remaining budget (util/deadline.py).
+        """
+        left = remaining()
+        if left is None:
+            return seconds
+        if left <= 0:
+            raise DeadlineExceeded(f"calling {url}")
+        return min(seconds, left)
+
+    def _attempt_timeout(self, timeout, url: str):
+        if timeout is None:
+            timeout = self.timeout
+        if isinstance(timeout, tuple):
+            return tuple(self._budget(part, url) for part in timeout)
+        return self._budget(timeout, url)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def stats(self) -> dict:
+        """
+        Returns the circuit state and call counters of every host called so far.
+        """
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {host: breaker.to_dict() for host, breaker in sorted(breakers.items())}
+
+    def close(self) -> None:
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            session.close()
+
+
+http_client = HTTPClient(
+    pool_maxsize=settings.http_pool_maxsize,
+    timeout=(settings.http_connect_timeout, settings.http_read_timeout),
+    max_retries=settings.http_max_retries,
+    backoff_base=settings.http_backoff_base,
+    backoff_max=settings.http_backoff_max,
+    breaker_threshold=settings.http_breaker_threshold,
+    breaker_reset_seconds=settings.http_breaker_reset_seconds,
+)
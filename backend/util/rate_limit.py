@@ -0,0 +1,229 @@
+import json
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+from config.config import settings
+from util.logit import get_logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process backend is available.
+    fcntl = None
+
+logger = get_logger("logs", "RateLimit")
+
+# bucket -> (tokens per second, burst capacity). The YouTube Data API bucket
+# counts quota units (10,000 per day by default) rather than requests.
+DEFAULT_LIMITS = {
+    "spotify": (10, 30),
+    "youtube": (10000 / 86400, 2000),
+    "google": (20, 50),
+    "musixmatch": (1, 10),
+    "apple_music": (20, 40),
+}
+
+# YouTube Data API quota cost per call; list calls (playlists, playlistItems,
+# videos, channels) cost 1 unit, writes 50.
+YOUTUBE_SEARCH_COST = 100
+YOUTUBE_WRITE_COST = 50
+
+
+def classify(method: str, url: str):
+    """
+    Maps an outbound call to its bucket and cost.
+
+    Token endpoints (accounts.spotify.com, oauth2.googleapis.com) are not
+    limited, so a refresh is never starved by data calls.
+
+    Returns:
+    tuple: (bucket name, cost), or (None, 0) for unlimited calls.
+    """
+    parts = urlsplit(url)
+    host, path = parts.netloc, parts.path
+    if host == "api.spotify.com":
+        return "spotify", 1
+    if host == "www.googleapis.com" and path.startswith("/youtube/v3/"):
+        if path.startswith("/youtube/v3/search"):
+            return "youtube", YOUTUBE_SEARCH_COST
+        if method.upper() not in ("GET", "HEAD"):
+            return "youtube", YOUTUBE_WRITE_COST
+        return "youtube", 1
+    if host == "www.googleapis.com":
+        return "google", 1
+    if host == "api.musixmatch.com":
+        return "musixmatch", 1
+    if host == "api.music.apple.com":
+        return "apple_music", 1
+    return None, 0
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket holding up to ``capacity`` tokens, refilled at
+    ``rate`` tokens per second.
+
+    Callers reserve tokens up front and then sleep until their reservation
+    is covered, so waiting callers are served in arrival order and a burst
+    queues instead of firing at the upstream.
+
+    Parameters:
+    rate (float): Tokens added per second.
+    capacity (float): Largest burst allowed.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _reserve(self, cost: float, max_wait: float):
+        """
+        Takes cost tokens if they are available within max_wait seconds.
+        Returns the seconds to wait, or None without taking anything.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (cost - self._tokens) / self.rate)
+            if wait > max_wait:
+                return None
+            self._tokens -= cost
+            return wait
+
+    def acquire(self, cost: float = 1, max_wait: float = 0) -> bool:
+        """
+        Waits until cost tokens are available.
+
+        Returns:
+        bool: False (without waiting) if that would take longer than max_wait.
+        """
+        wait = self._reserve(cost, max_wait)
+        if wait is None:
+            return False
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+
+class FileTokenBucket(TokenBucket):
+    """
+    TokenBucket whose state lives in a small file guarded by flock, so every
+    worker process on the host draws from the same bucket.
+
+    Parameters:
+    path (str): The state file; created on first use.
+    rate (float): Tokens added per second.
+    capacity (float): Largest burst allowed.
+    """
+
+    def __init__(self, path: str, rate: float, capacity: float):
+        super().__init__(rate, capacity)
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def _reserve(self, cost: float, max_wait: float):
+        # The thread lock keeps this process's threads off the file lock.
+        with self._lock, open(self.path, "a+", encoding="utf-8") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                file.seek(0)
+                try:
+                    state = json.loads(file.read() or "{}")
+                except ValueError:
+                    state = {}
+                # Wall-clock time: monotonic clocks are not comparable
+                # between processes.
+                now = time.time()
+                tokens = state.get("tokens", self.capacity)
+                updated = state.get("updated", now)
+                tokens = min(self.capacity, tokens + max(0.0, now - updated) * self.rate)
+                wait = max(0.0, (cost - tokens) / self.rate)
+                if wait > max_wait:
+                    return None
+                file.seek(0)
+                file.truncate()
+                file.write(json.dumps({"tokens": tokens - cost, "updated": now}))
+                file.flush()
+                return wait
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+
+class RateLimitTimeout(Exception):
+    """
+    Raised when an outbound call would have to queue longer than allowed for
+    its provider's rate limit.
+
+    Attributes:
+    bucket (str): The exhausted bucket, e.g. "youtube".
+    """
+
+    def __init__(self, bucket: str):
+        super().__init__(f"Outbound rate limit for {bucket} exhausted")
+        self.bucket = bucket
+
+
+class RateLimiter:
+    """
+    Per-provider outbound rate limits, one bucket per provider (or per
+    endpoint class where quotas differ, like YouTube's quota units).
+
+    Parameters:
+    limits (dict): bucket -> (rate, capacity); merged over DEFAULT_LIMITS.
+    backend (str): "memory" (per process) or "file" (shared by the
+                   processes of one host through rate_limit_dir).
+    directory (str): Where the file backend keeps its state files.
+    max_wait (float): Default longest queueing time per call.
+    """
+
+    def __init__(self, limits: dict = None, backend: str = "memory",
+                 directory: str = "ratelimits", max_wait: float = 5):
+        self.limits = {**DEFAULT_LIMITS, **{k: tuple(v) for k, v in (limits or {}).items()}}
+        if backend == "file" and fcntl is None:
+            logger.warning("File rate limits need fcntl; using per-process buckets.")
+            backend = "memory"
+        self.backend = backend
+        self.directory = directory
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def bucket(self, name: str):
+        with self._lock:
+            bucket = self._buckets.get(name)
+            if bucket is None:
+                rate, capacity = self.limits[name]
+                if self.backend == "file":
+                    path = os.path.join(self.directory, f"{name}.json")
+                    bucket = FileTokenBucket(path, rate, capacity)
+                else:
+                    bucket = TokenBucket(rate, capacity)
+                self._buckets[name] = bucket
+            return bucket
+
+    def acquire(self, method: str, url: str, max_wait: float = None) -> None:
+        """
+        Waits for the call's bucket to allow it.
+
+        Raises:
+        RateLimitTimeout: If the call would wait longer than max_wait.
+        """
+        name, cost = classify(method, url)
+        if name is None or name not in self.limits:
+            return
+        max_wait = self.max_wait if max_wait is None else max_wait
+        if not self.bucket(name).acquire(cost, max_wait):
+            logger.warning("Rate limit for %s exhausted; not calling %s", name, url)
+            raise RateLimitTimeout(name)
+
+
+rate_limiter = RateLimiter(
+    limits=settings.rate_limits,
+    backend=settings.rate_limit_backend,
+    directory=settings.rate_limit_dir,
+    max_wait=settings.rate_limit_max_wait,
+)
@@ -0,0 +1,151 @@
+import os
+import socket
+import threading
+import time
+from util.cache import TTLCache
+from util.deadline import DeadlineExceeded, remaining
+from util.logit import get_logger
+
+logger = get_logger("logs", "SingleFlight")
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one execution.
+
+    The first caller of do(key, fn) runs fn; callers arriving with the same
+    key while it runs wait and receive its result (or its exception) instead
+    of running fn again. A successful result is also handed to callers that
+    arrive up to ``share_seconds`` after it was produced.
+
+    With ``lease_seconds`` set, the running caller additionally takes a lease
+    document through the storage backend (StorageBackend.acquire_lease), so
+    at most one process runs fn for a key at a time. A process that finds the
+    lease taken waits for it to be released or to expire and then calls
+    ``follower()``, which should read what the other process produced; fn
+    only runs if follower returns None.
+
+    Within a request, waiting for another caller or for the lease is bounded
+    by the request's remaining budget (util/deadline.py).
+
+    Parameters:
+    name (str): Prefix of the lease names, e.g. "token-refresh".
+    lease_seconds (float): Lifetime of the cross-process lease; 0 disables it.
+    share_seconds (float): How long a finished result is reused for the key.
+    poll_interval (float): Seconds between attempts to take a held lease.
+    """
+
+    def __init__(self, name: str, lease_seconds: float = 0, share_seconds: float = 0,
+                 poll_interval: float = 0.1):
+        self.name = name
+        self.lease_seconds = lease_seconds
+        self.share_seconds = share_seconds
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._results = TTLCache(maxsize=10000, ttl=share_seconds or 1)
+
+    def _owner(self) -> str:
+        # Per process: within a process only the running call holds a lease.
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def _lease_name(self, key) -> str:
+        parts = key if isinstance(key, tuple) else (key,)
+        return ":".join([self.name, *map(str, parts)])
+
+    def do(self, key, fn, follower=None):
+        """
+        Runs fn() once for all concurrent callers with this key.
+
+        Parameters:
+        key: A hashable key, e.g. ("spotify", user_id, app_id).
+        fn (callable): The work to run; its return value is shared.
+        follower (callable, optional): Reads the result another process
+                                       produced while holding the lease.
+
+        Returns:
+        The result of fn (or follower) for this key.
+
+        Raises:
+        DeadlineExceeded: If the request's budget runs out while waiting for
+                          the caller that runs fn.
+        """
+        if self.share_seconds:
+            result = self._results.get(key)
+            if result is not None:
+                return result
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            left = remaining()
+            if not call.done.wait(None if left is None else max(left, 0)):
+                raise DeadlineExceeded(f"waiting for {self._lease_name(key)}")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run(key, fn, follower)
+            if self.share_seconds and call.result is not None:
+                self._results.set(key, call.result, ttl=self.share_seconds)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _run(self, key, fn, follower):
+        if not self.lease_seconds:
+            return fn()
+
+        # Imported here: the storage modules import util helpers themselves.
+        from database.storage import get_storage
+
+        storage = get_storage()
+        name, owner = self._lease_name(key), self._owner()
+        acquired = contended = False
+        deadline = time.monotonic() + self.lease_seconds
+        left = remaining()
+        if left is not None:
+            # Stop waiting when the request runs out of time; the follower and
+            # fn then fail fast through their own deadline-derived timeouts.
+            deadline = min(deadline, time.monotonic() + max(left, 0))
+        try:
+            while True:
+                acquired = storage.acquire_lease(name, owner, self.lease_seconds)
+                if acquired or time.monotonic() >= deadline:
+                    break
+                contended = True
+                time.sleep(self.poll_interval)
+        except Exception as e:
+            # Coordination is best effort: without the lease we still run
+            # once per process.
+            logger.error("Could not take lease %s: %s", name, e)
+
+        try:
+            if contended and follower is not None:
+                result = follower()
+                if result is not None:
+                    return result
+            return fn()
+        finally:
+            if acquired:
+                try:
+                    storage.release_lease(name, owner)
+                except Exception as e:
+                    logger.error("Could not release lease %s: %s", name, e)
@@ -1,10 +1,20 @@
+import threading
 import time
 from cmd_gui_kit import CmdGUI
-import requests
+from util.http_client import http_client
+from util.cache import TTLCache
 import base64
 from config.config import settings
+from util.deadline import DeadlineExceeded
 from util.error_handling import log_error
 from util.logit import get_logger
+from util.tokens import (
+    TokenRevoked,
+    is_revocation,
+    is_token_fresh,
+    record_link_activity,
+    token_refresh,
+)
 from util.utils import ms2FormattedDuration
 import database.firebase_operations as firebase_operations
 
@@ -20,50 +30,125 @@ SPOTIFY_CLIENT_SECRET = settings.spotify_client_secret
 
 # Global cache for playlist durations
 # Each key is a playlist_id and the value is a tuple: (result_data,
-# expiration_time)
-playlist_cache = {}
+# expiration_time). Entries are served for CACHE_DURATION, then kept for
+# settings.playlist_cache_stale_seconds as the deadline fallback; the least
+# recently used are evicted beyond settings.playlist_cache_maxsize.
 CACHE_DURATION = 3600  # Cache duration in seconds (1 hour)
+playlist_cache = TTLCache(
+    maxsize=settings.playlist_cache_maxsize,
+    ttl=CACHE_DURATION + settings.playlist_cache_stale_seconds,
+)
 
 
-def get_access_token_for_request():
+class SpotifyTokenError(Exception):
     """
-    This function requests an access token using a single Spotify client credential
-    and caches it globally. If the token already exists, it returns the cached token.
+    Raised when Spotify refuses to issue a client-credentials token.
 
-    Parameters:
-    None
-
-    Returns:
-    str: The access token if the request is successful.
-         Raises an exception if the request fails.
+    Attributes:
+    status_code (int): The HTTP status code of the token endpoint's response.
     """
 
-    client_creds_b64 = base64.b64encode(
-        f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}".encode()
-    ).decode()
+    def __init__(self, status_code: int):
+        super().__init__(f"Could not obtain Spotify access token ({status_code})")
+        self.status_code = status_code
 
-    token_url = "https://accounts.spotify.com/api/token"
-    token_data = {"grant_type": "client_credentials"}
-    token_headers = {
-        "Authorization": f"Basic {client_creds_b64}",
-        "Content-Type": "application/x-www-form-urlencoded",
-    }
 
-    response = requests.post(token_url, data=token_data, headers=token_headers)
+class ClientCredentialsToken:
+    """
+    Process-wide holder of the app's client-credentials access token.
 
-    if response.status_code == 200:
+    The token is fetched once and served from memory until ``margin`` seconds
+    before its ``expires_in``. Refreshes are single-flight: when it expires,
+    one thread fetches a new token while the others wait for it rather than
+    all hitting accounts.spotify.com.
+
+    Parameters:
+    client_id (str): The Spotify client ID.
+    client_secret (str): The Spotify client secret.
+    margin (float): Seconds before expiry at which the token is renewed.
+    """
+
+    TOKEN_URL = "https://accounts.spotify.com/api/token"
+
+    def __init__(self, client_id: str, client_secret: str, margin: float = 60):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.margin = margin
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0.0
+
+    def _fetch(self):
+        client_creds_b64 = base64.b64encode(
+            f"{self.client_id}:{self.client_secret}".encode()
+        ).decode()
+        token_data = {"grant_type": "client_credentials"}
+        token_headers = {
+            "Authorization": f"Basic {client_creds_b64}",
+            "Content-Type": "application/x-www-form-urlencoded",
+        }
+        response = http_client.post(self.TOKEN_URL, data=token_data, headers=token_headers)
+        if response.status_code != 200:
+            raise SpotifyTokenError(response.status_code)
         response_data = response.json()
-        access_token = response_data["access_token"]
+        return response_data["access_token"], response_data.get("expires_in", 3600)
+
+    def get(self) -> str:
+        """
+        Returns a valid access token, fetching a new one only when needed.
+
+        Raises:
+        SpotifyTokenError: If a new token was needed and Spotify refused it.
+        """
+        token = self._token
+        if token is not None and time.monotonic() < self._expires_at:
+            return token
+        with self._lock:
+            # Another thread may have refreshed while we waited for the lock.
+            if self._token is not None and time.monotonic() < self._expires_at:
+                return self._token
+            token, expires_in = self._fetch()
+            self._expires_at = time.monotonic() + max(0, expires_in - self.margin)
+            self._token = token
+            logger.info("Fetched a new Spotify client-credentials token.")
+            return token
+
+    def invalidate(self, token: str = None) -> None:
+        """
+        Drops the cached token (only if it still is ``token``, when given), so
+        the next get() fetches a new one.
+        """
+        with self._lock:
+            if token is None or token == self._token:
+                self._token = None
+                self._expires_at = 0.0
+
+
+spotify_app_token = ClientCredentialsToken(SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET)
 
-        return access_token
-    else:
 
+def get_access_token_for_request():
+    """
+    Returns the app's client-credentials access token from the process-wide
+    holder; a token endpoint request is only made when the cached token is
+    about to expire.
+
+    Parameters:
+    None
+
+    Returns:
+    str: The access token if the request is successful.
+         Raises an exception if the request fails.
+    """
+    try:
+        return spotify_app_token.get()
+    except SpotifyTokenError as e:
         gui.status(
-            f"Failed to obtain token. Status code: {response.status_code}",
+            f"Failed to obtain token. Status code: {e.status_code}",
             status="error",
         )
         logger.error(
-            f"Failed to obtain token. Status code: {response.status_code}")
+            f"Failed to obtain token. Status code: {e.status_code}")
         # Optionally raise an exception or return None
         raise log_error(Exception("Could not obtain Spotify access token"))
 
@@ -73,6 +158,10 @@ def make_request(url, max_retries=5, access_token=None):
     Makes a GET request to a specified URL with retry logic for rate limiting.
     Uses a single Spotify credential for all requests.
 
+    Rate limiting (429) and transient 5xx answers are retried by http_client,
+    which waits as long as Spotify's Retry-After asks (or a jittered backoff)
+    before each retry, so a burst of 429s is not answered with more traffic.
+
     Parameters:
     url (str): The URL to which the GET request will be made.
     max_retries (int, optional): The maximum number of times the request will be retried in case of rate limiting.
@@ -81,17 +170,21 @@ def make_request(url, max_retries=5, access_token=None):
                                    using the `get_access_token_for_request` function. Defaults to None.
 
     Returns:
-    requests.Response or None: The response object if the request is successful (status code 200).
+    requests.Response or None: The response object if the request is successful (status code 200),
+                                or the 401 response when a user access_token was rejected, so the
+                                caller can refresh that user's token.
                                 Returns None if the request fails due to a 404 status code (resource not found)
                                 or if the maximum number of retries is reached.
     """
-    if access_token is None:
+    uses_app_token = access_token is None
+    if uses_app_token:
         access_token = get_access_token_for_request()
 
     headers = {"Authorization": f"Bearer {access_token}"}
 
-    for attempt in range(max_retries):
-        response = requests.get(url, headers=headers)
+    # The second pass only happens after the app token was rejected.
+    for attempt in range(2):
+        response = http_client.get(url, headers=headers, retries=max_retries)
 
         if response.status_code == 200:
             return response
@@ -105,17 +198,27 @@ def make_request(url, max_retries=5, access_token=None):
             return None
 
         elif response.status_code == 429:
-            # Rate limit exceeded
-            retry_after = int(response.headers.get("Retry-After", 1))
-
-            msg = f"Rate limit exceeded. Waiting {retry_after} seconds before retrying."
+            # Still rate limited after the retries (or Retry-After too long)
+            msg = (
+                "Rate limit exceeded. Spotify asked to wait "
+                f"{response.headers.get('Retry-After', 'unknown')} seconds."
+            )
             gui.log(msg, level="info")
             logger.info(msg)
+            break
 
-            # Optionally refresh the token (in case it helps)
+        elif response.status_code == 401 and uses_app_token:
+            if attempt:
+                break
+            # The cached app token was revoked early; fetch a fresh one.
+            spotify_app_token.invalidate(access_token)
             access_token = get_access_token_for_request()
             headers["Authorization"] = f"Bearer {access_token}"
 
+        elif response.status_code == 401:
+            # A user token was rejected; only the caller can refresh it.
+            return response
+
         else:
             # For other 4xx/5xx errors, raise an exception or handle
             response.raise_for_status()
@@ -127,10 +230,10 @@ def make_request(url, max_retries=5, access_token=None):
 
 def get_access_token():  # noqa: F811
     """
-    Requests a new access token for the Spotify client ID.
+    Returns the app's client-credentials access token from the process-wide
+    holder, together with a status code.
 
-    This function sends a POST request to the Spotify Accounts API token endpoint with the client credentials
-    to obtain a new access token. The function handles rate limit exceeded errors by returning an empty string
+    The function handles rate limit exceeded errors by returning an empty string
     and a status code of 429. For other HTTP errors, it returns an empty string and a status code of 404.
 
     Parameters:
@@ -142,40 +245,24 @@ def get_access_token():  # noqa: F811
            If the request fails due to rate limit exceeded, the status code will be 429.
            If the request fails due to other HTTP errors, the status code will be 404.
     """
-    client_creds_b64 = base64.b64encode(
-        f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}".encode()
-    ).decode()
-    token_url = "https://accounts.spotify.com/api/token"
-    token_data = {"grant_type": "client_credentials"}
-    token_headers = {
-        "Authorization": f"Basic {client_creds_b64}",
-        "Content-Type": "application/x-www-form-urlencoded",
-    }
-
-    response = requests.post(token_url, data=token_data, headers=token_headers)
-
-    if response.status_code == 200:
-        response_data = response.json()
-        access_token = response_data["access_token"]
-
-        return access_token, 200
-
-    elif response.status_code == 429:
-        return "", 429
-    else:
+    try:
+        return spotify_app_token.get(), 200
+    except SpotifyTokenError as e:
+        if e.status_code == 429:
+            return "", 429
         return "", 404
 
 
 def test_token(access_token):
     url = "https://api.spotify.com/v1/me"
     headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(url, headers=headers)
+    response = http_client.get(url, headers=headers)
 
     return response.status_code
 
 
 # Function to fetch playlists of the user
-def fetch_user_playlists(user_id, app_id):
+def fetch_user_playlists(user_id, app_id, retry_on_401=True):
     # Query to get the access token for the user
     access_token, refresh_token = get_access_token_from_db(user_id, app_id)
     # print(get_current_user_profile(access_token))
@@ -191,7 +278,14 @@ def fetch_user_playlists(user_id, app_id):
     is_playlist_count_exceeded_to_limit = False
     while True:
         url = url_template.format(offset=offset)
-        response = make_request(url, access_token=access_token)
+        try:
+            response = make_request(url, access_token=access_token)
+        except DeadlineExceeded:
+            if not formatted_playlists:
+                raise
+            # Out of time: return the pages fetched so far.
+            logger.warning("Deadline exceeded; returning partial playlists.")
+            return formatted_playlists
 
         if response.status_code == 200:
             playlists_data = response.json()
@@ -202,7 +296,7 @@ def fetch_user_playlists(user_id, app_id):
             for item in playlists_data.get("items", []):
                 # Fetch track details for each playlist
                 # tracks_url = item["tracks"]["href"]
-                # tracks_response = requests.get(tracks_url, headers=headers)
+                # tracks_response = http_client.get(tracks_url, headers=headers)
                 #
                 # if tracks_response.status_code == 200:
                 #    tracks_data = tracks_response.json()
@@ -252,10 +346,12 @@ def fetch_user_playlists(user_id, app_id):
                 break
             offset += 50
 
-        elif response.status_code == 401:
+        elif response.status_code == 401 and retry_on_401:
+            # The stored expiry said the token was valid, but Spotify disagrees
+            # (e.g. it was revoked): refresh once and start over.
             refresh_access_token_and_update_db(user_id, refresh_token, app_id)
             formatted_playlists.clear()
-            return fetch_user_playlists(user_id, app_id)
+            return fetch_user_playlists(user_id, app_id, retry_on_401=False)
         else:
             logger.error(
                 f"Failed to fetch playlists: {response.status_code} - {response.text}"
@@ -286,43 +382,57 @@ def calculate_playlist_duration(
     Raises:
       Exception: If fetching the playlist tracks fails.
     """
-    # Check if the result is in the cache and not expired
+    # Check if the result is in the cache and not expired. An expired entry
+    # is kept for a while longer, as the fallback when the request's time
+    # budget runs out.
     cached_entry = playlist_cache.get(playlist_id)
     if cached_entry:
         cached_data, expiration_time = cached_entry
         if time.time() < expiration_time:
             return cached_data
-        else:
-            # Remove expired cache entry
-            del playlist_cache[playlist_id]
 
+    try:
+        return _fetch_playlist_duration(user_email, playlist_id, access_token, refresh_token)
+    except DeadlineExceeded:
+        if cached_entry:
+            logger.warning(f"Deadline exceeded; serving cached duration of {playlist_id}")
+            return cached_entry[0]
+        raise
+
+
+def _fetch_playlist_duration(user_email, playlist_id, access_token, refresh_token):
     # Compute the playlist duration
     url_template = "https://api.spotify.com/v1/playlists/{playlist_id}/tracks?limit=50&offset={offset}"
     offset = 0
     total_duration_ms = 0
     total_track_count = 0
+    user_id = None
+    refreshed = False
 
     while True:
         url = url_template.format(playlist_id=playlist_id, offset=offset)
         # Retrieve the user_id from the email if tokens are not provided.
         if access_token is None and refresh_token is None:
             user_id = firebase_operations.get_user_id_by_email(user_email)
-            # Get the access token (and ignore the refresh token here)
-            access_token = get_access_token_from_db(user_id, app_id=1)[0]
+            access_token, refresh_token = get_access_token_from_db(user_id, app_id=1)
 
         response = make_request(url, access_token=access_token)
 
+        if (response is not None and response.status_code == 401
+                and user_id is not None and not refreshed):
+            # Reactive refresh, once, for a token rejected before its stored expiry.
+            refreshed = True
+            access_token = refresh_access_token_and_update_db(
+                user_id, refresh_token, app_id=1
+            )
+            if access_token:
+                continue
+
         if not response or response.status_code != 200:
             raise Exception(
                 f"Failed to fetch playlist tracks. Response: {response.text if response else 'None'}"
             )
 
-        if response.status_code == 401:
-            access_token = refresh_access_token_and_update_db(
-                user_id, refresh_token, app_id=1
-            )
-            calculate_playlist_duration(user_id, access_token)
-
         data = response.json()
         items = data.get("items", [])
         if not items:
@@ -346,24 +456,50 @@ def calculate_playlist_duration(
     }
 
     # Store the result in the cache with a 1-hour expiration
-    playlist_cache[playlist_id] = (result_data, time.time() + CACHE_DURATION)
+    playlist_cache.set(playlist_id, (result_data, time.time() + CACHE_DURATION))
     return result_data
 
 
 # Function to refresh access token
-def refresh_access_token_and_update_db(user_id, refresh_token, app_id):
+def refresh_access_token_and_update_db(user_id, refresh_token, app_id, raise_revoked=False):
     """
     Refreshes the Spotify access token for a given user and updates the database with the new token.
 
+    Concurrent refreshes of the same user and app are collapsed into one
+    (see util.tokens.token_refresh); the other callers get its new token.
+
     Parameters:
     user_id (str): The unique identifier of the user for whom the access token needs to be refreshed.
     refresh_token (str): The refresh token used to obtain a new access token.
     app_id (str): The unique identifier of the application.
+    raise_revoked (bool): Raise TokenRevoked instead of returning None when
+                          Spotify refuses the refresh token (invalid_grant).
 
     Returns:
     str: The new access token if the refresh is successful.
          None: If the refresh fails.
     """
+    try:
+        return token_refresh.do(
+            ("spotify", user_id, app_id),
+            lambda: _refresh_spotify_token(user_id, refresh_token, app_id),
+            follower=lambda: _stored_fresh_access_token(user_id, app_id),
+        )
+    except TokenRevoked:
+        if raise_revoked:
+            raise
+        return None
+
+
+def _stored_fresh_access_token(user_id, app_id):
+    # The token another process just stored, unless it is stale as well.
+    result = firebase_operations.get_userlinkedapps_tokens(user_id, app_id)
+    if result and is_token_fresh(result[0]["token_expires_at"]):
+        return result[0]["access_token"]
+    return None
+
+
+def _refresh_spotify_token(user_id, refresh_token, app_id):
     url = "https://accounts.spotify.com/api/token"
     auth_header = base64.b64encode(
         f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}".encode()
@@ -375,7 +511,7 @@ def refresh_access_token_and_update_db(user_id, refresh_token, app_id):
     }
     data = {"grant_type": "refresh_token", "refresh_token": refresh_token}
 
-    response = requests.post(url, headers=headers, data=data)
+    response = http_client.post(url, headers=headers, data=data)
 
     if response.status_code == 200:
         token_info = response.json()
@@ -396,10 +532,12 @@ def refresh_access_token_and_update_db(user_id, refresh_token, app_id):
         logger.error(
             f"Failed to refresh access token: {response.status_code} - {response.text}"
         )
+        if is_revocation(response):
+            raise TokenRevoked(f"Spotify refused the refresh token of user {user_id}")
         return None
 
 
-def get_current_user_profile(access_token, user_id, app_id):
+def get_current_user_profile(access_token, user_id, app_id, retry_on_401=True, raise_revoked=False):
     """
     Retrieves the current user's profile from the Spotify API using the provided access token.
     If the access token is expired, it refreshes the token and updates the database.
@@ -408,27 +546,38 @@ def get_current_user_profile(access_token, user_id, app_id):
     access_token (str): The access token used to authenticate the request.
     user_id (str): The unique identifier of the user for whom the profile is to be fetched.
     app_id (str): The unique identifier of the application.
+    raise_revoked (bool): Raise TokenRevoked instead of returning None when Spotify
+                          rejects the link's credentials for good.
 
     Returns:
     dict: A dictionary containing the user profile data if the request is successful.
           If the request fails due to an expired access token, the function will attempt to refresh the token
           and retry the request. If the request still fails, it will log the error and return None.
+
+    Raises:
+    TokenRevoked: With raise_revoked, if the refresh token was refused or a freshly
+                  refreshed token is rejected as well.
     """
     url = "https://api.spotify.com/v1/me"
     headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(url, headers=headers)
+    response = http_client.get(url, headers=headers)
 
     if response.status_code == 200:
         # user = response.json()
         # print(user["id"])
         return response.json()
-    elif response.status_code == 401:
-        result = firebase_operations.get_userlinkedapps_access_refresh(user_id, app_id)[
-            0
-        ]
-        access_token, refresh_token = result["access_token"], result["refresh_token"]
-        refresh_access_token_and_update_db(user_id, refresh_token, app_id)
-        return get_current_user_profile(access_token, user_id, app_id)
+    elif response.status_code == 401 and retry_on_401:
+        result = firebase_operations.get_userlinkedapps_access_refresh(user_id, app_id)
+        if not result:
+            return None
+        new_access_token = refresh_access_token_and_update_db(
+            user_id, result[0]["refresh_token"], app_id, raise_revoked=raise_revoked)
+        if new_access_token is None:
+            return None
+        return get_current_user_profile(
+            new_access_token, user_id, app_id, retry_on_401=False, raise_revoked=raise_revoked)
+    elif response.status_code == 401 and raise_revoked:
+        raise TokenRevoked(f"Spotify rejected a refreshed token of user {user_id}")
     else:
         logger.error(
             f"Failed to fetch user profile: {response.status_code} - {response.text}"
@@ -451,7 +600,7 @@ def get_user_profile(user_id):
     if status_code == 200:
         url = f"https://api.spotify.com/v1/users/{user_id}"
         headers = {"Authorization": f"Bearer {access_token}"}
-        response = requests.get(url, headers=headers)
+        response = http_client.get(url, headers=headers)
 
         if response.status_code == 200:
             # user = response.json()
@@ -470,7 +619,11 @@ def get_user_profile(user_id):
 def get_access_token_from_db(user_id, app_id):
     """
     Retrieves the access token and refresh token for a given user and app from the database.
-    If the access token is not valid, it refreshes the token and updates the database.
+
+    Validity is decided from the stored token_expires_at instead of probing
+    Spotify: a token that expires within the safety margin (or has no known
+    expiry) is refreshed proactively and the new token is returned. Callers
+    still refresh reactively if Spotify answers 401 anyway.
 
     Parameters:
     user_id (str): The unique identifier of the user.
@@ -479,16 +632,17 @@ def get_access_token_from_db(user_id, app_id):
     Returns:
     tuple: A tuple containing the access token and refresh token. If the access token is not found, returns None.
     """
-    result = firebase_operations.get_userlinkedapps_access_refresh(user_id, app_id)
+    result = firebase_operations.get_userlinkedapps_tokens(user_id, app_id)
 
     if not result:
         logger.error(f"Access token not found for user_id: {user_id}")
         return f"Access token not found for user_id: {user_id}", None
-    if result[0]:
-        result = result[0]
-        access_token, refresh_token = result["access_token"], result["refresh_token"]
-    if test_token(access_token) != 200:
-        refresh_access_token_and_update_db(user_id, refresh_token, app_id)
-        get_access_token_from_db(user_id, app_id)
+    result = result[0]
+    record_link_activity(user_id, (app_id,))
+    access_token, refresh_token = result["access_token"], result["refresh_token"]
+    if not is_token_fresh(result["token_expires_at"]):
+        new_access_token = refresh_access_token_and_update_db(user_id, refresh_token, app_id)
+        if new_access_token:
+            access_token = new_access_token
 
     return access_token, refresh_token
@@ -0,0 +1,164 @@
+import datetime as DT
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config.config import settings
+from util.logit import get_logger
+from util.google import refresh_access_token_and_update_db_for_Google
+from util.spotify import refresh_access_token_and_update_db
+from database.app_registry import GOOGLE, SPOTIFY, YOUTUBE_MUSIC, app_registry
+from database.storage import get_storage
+import database.firebase_operations as firebase_operations
+
+logger = get_logger("logs", "TokenRefresher")
+
+
+class TokenRefresher:
+    """
+    Background scheduler that refreshes linked-app tokens before they expire,
+    so requests find a fresh token and never wait on a provider's token
+    endpoint.
+
+    Every ``interval`` seconds the leader scans UserLinkedApps for tokens
+    expiring within ``ahead_seconds`` (a token_expires_at range query) and
+    refreshes them through the same functions the request path uses, with at
+    most ``concurrency`` refreshes in flight per provider. Only links a
+    request used within ``active_days`` (last_seen_at, see
+    util.tokens.record_link_activity) are refreshed; idle users' tokens are
+    refreshed on their next request instead. Leadership is a
+    lease in the storage backend renewed every cycle: one worker refreshes
+    while the others only keep trying to take over, which happens once the
+    leader stops renewing.
+
+    Parameters:
+    interval (float): Seconds between scans.
+    ahead_seconds (float): How far ahead of expiry tokens are refreshed.
+    concurrency (int): Maximum parallel refreshes per provider.
+    batch_size (int): Maximum rows refreshed per scan; the rest, which
+                      expire later, are picked up by the next scans.
+    active_days (float): How recently a link must have been used.
+    """
+
+    LEASE_NAME = "token-refresher"
+
+    def __init__(self, interval: float = 60, ahead_seconds: float = 600,
+                 concurrency: int = 4, batch_size: int = 500, active_days: float = 7):
+        self.interval = interval
+        self.ahead_seconds = ahead_seconds
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.active_days = active_days
+        self._lock = threading.Lock()
+        self._started_pid = None
+        self._stop = threading.Event()
+
+    def _owner(self) -> str:
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def is_leader(self) -> bool:
+        """
+        Takes or renews the leader lease. It outlives two missed scans, so a
+        slow scan does not hand leadership over.
+        """
+        try:
+            return get_storage().acquire_lease(
+                self.LEASE_NAME, self._owner(), self.interval * 3
+            )
+        except Exception as e:
+            logger.error("Could not take the token refresher lease: %s", e)
+            return False
+
+    def _refresh_spotify(self, row: dict):
+        return refresh_access_token_and_update_db(
+            row["user_id"], row["refresh_token"], row["app_id"]
+        )
+
+    def _refresh_google(self, row: dict):
+        # One refresh updates the rows of both Google app IDs.
+        return refresh_access_token_and_update_db_for_Google(
+            row["user_id"], row["refresh_token"]
+        )
+
+    def _refresh_all(self, refresh, rows: list) -> int:
+        def run(row):
+            try:
+                return refresh(row) is not None
+            except Exception as e:
+                logger.error("Refreshing tokens of user %s failed: %s", row.get("user_id"), e)
+                return False
+
+        with ThreadPoolExecutor(max_workers=max(1, self.concurrency)) as executor:
+            return sum(executor.map(run, rows))
+
+    def run_once(self) -> int:
+        """
+        Refreshes every token expiring within the window once.
+
+        Returns:
+        int: The number of successful refreshes.
+        """
+        active_since = DT.datetime.now(DT.timezone.utc) - DT.timedelta(days=self.active_days)
+        rows = firebase_operations.get_userlinkedapps_expiring(
+            self.ahead_seconds, limit=self.batch_size, active_since=active_since
+        )
+        spotify, google = [], {}
+        for row in rows:
+            if not row.get("refresh_token"):
+                continue
+            kind = app_registry.get_kind(row.get("app_id"))
+            if kind == SPOTIFY:
+                spotify.append(row)
+            elif kind in (YOUTUBE_MUSIC, GOOGLE):
+                google.setdefault(row["user_id"], row)
+
+        # Providers are refreshed side by side, each with its own bound.
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            jobs = [
+                executor.submit(self._refresh_all, self._refresh_spotify, spotify),
+                executor.submit(self._refresh_all, self._refresh_google, list(google.values())),
+            ]
+            refreshed = sum(job.result() for job in jobs)
+        if rows:
+            logger.info(
+                "Refreshed %s of %s expiring tokens (spotify=%s, google=%s).",
+                refreshed, len(spotify) + len(google), len(spotify), len(google),
+            )
+        return refreshed
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            if self.is_leader():
+                try:
+                    self.run_once()
+                except Exception as e:
+                    logger.error("Token refresh scan failed: %s", e)
+            self._stop.wait(self.interval)
+
+    def ensure_started(self) -> None:
+        """
+        Starts the scheduler thread once per process when
+        settings.token_refresher_enabled is set. Every worker runs one; only
+        the lease holder scans.
+        """
+        pid = os.getpid()
+        if self._started_pid == pid or not settings.token_refresher_enabled:
+            return
+        with self._lock:
+            if self._started_pid == pid:
+                return
+            self._stop.clear()
+            threading.Thread(target=self._run, name="token-refresher", daemon=True).start()
+            self._started_pid = pid
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+token_refresher = TokenRefresher(
+    interval=settings.token_refresher_interval_seconds,
+    ahead_seconds=settings.token_refresh_ahead_minutes * 60,
+    concurrency=settings.token_refresher_concurrency,
+    batch_size=settings.token_refresher_batch_size,
+    active_days=settings.token_refresher_active_days,
+)
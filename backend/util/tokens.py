@@ -0,0 +1,134 @@
+import datetime as DT
+from dateutil.parser import parse
+from config.config import settings
+from util.cache import TTLCache
+from util.logit import get_logger
+from util.singleflight import SingleFlight
+
+logger = get_logger("logs", "Tokens")
+
+# Tokens are treated as expired this many seconds before their stored expiry,
+# so a token never runs out between the check and the upstream call.
+EXPIRY_MARGIN_SECONDS = 120
+
+
+class TokenRevoked(Exception):
+    """
+    Raised when a provider rejects a linked app's credentials for good: the
+    refresh token is refused with invalid_grant, or the profile endpoint
+    still answers 401 to a freshly refreshed token. Transport errors, open
+    circuits and 5xx answers are not revocations.
+    """
+
+
+def is_revocation(response) -> bool:
+    """
+    Returns whether an OAuth token endpoint response means the refresh token
+    is no longer valid (RFC 6749 section 5.2, error=invalid_grant).
+    """
+    if response is None or response.status_code != 400:
+        return False
+    try:
+        return response.json().get("error") == "invalid_grant"
+    except ValueError:
+        return False
+
+
+# The refresher only needs day resolution, so each process writes a link's
+# last_seen_at at most once per LAST_SEEN_RESOLUTION_SECONDS.
+LAST_SEEN_RESOLUTION_SECONDS = 6 * 3600
+_recently_seen = TTLCache(maxsize=settings.user_cache_maxsize, ttl=LAST_SEEN_RESOLUTION_SECONDS)
+
+
+def record_link_activity(user_id, app_ids) -> None:
+    """
+    Marks the user's links as used by a request (last_seen_at), so the
+    background token refresher keeps their tokens fresh; links nobody used
+    within TOKEN_REFRESHER_ACTIVE_DAYS are left to the reactive refresh.
+
+    Does nothing when the refresher is disabled. Best effort: a failed write
+    is logged and the request goes on.
+    """
+    if not settings.token_refresher_enabled:
+        return
+    key = (user_id, tuple(app_ids))
+    if _recently_seen.get(key) is not None:
+        return
+    _recently_seen.set(key, True)
+    # Imported here: the data layer imports this module itself.
+    import database.firebase_operations as firebase_operations
+
+    try:
+        firebase_operations.touch_userlinkedapps(user_id, app_ids)
+    except Exception as e:
+        logger.error("Could not record activity of user %s: %s", user_id, e)
+
+
+# Every OAuth refresh goes through here, keyed by (provider, user_id, ...):
+# parallel requests of a user whose token just expired share one refresh
+# POST and one database write. Requests arriving right after it reuse the new
+# token. TOKEN_REFRESH_LEASE_SECONDS extends this across processes.
+token_refresh = SingleFlight(
+    "token-refresh",
+    lease_seconds=settings.token_refresh_lease_seconds,
+    share_seconds=5,
+)
+
+
+def parse_expiry(value):
+    """
+    Normalizes a stored token_expires_at to an aware UTC datetime.
+
+    UserLinkedApps rows carry the expiry in several shapes: a datetime
+    (naive values are UTC, as written by DT.datetime.utcnow()), an ISO-8601
+    string (Google callback) or a Unix timestamp.
+
+    Parameters:
+    value: The stored expiry.
+
+    Returns:
+    datetime or None: The expiry in UTC, or None if it is missing or unreadable.
+    """
+    if value is None or value == "":
+        return None
+    try:
+        if isinstance(value, (int, float)):
+            return DT.datetime.fromtimestamp(value, tz=DT.timezone.utc)
+        if isinstance(value, str):
+            value = parse(value)
+        if isinstance(value, DT.datetime):
+            if value.tzinfo is None:
+                return value.replace(tzinfo=DT.timezone.utc)
+            return value.astimezone(DT.timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        pass
+    return None
+
+
+def seconds_until_expiry(value, now: DT.datetime = None):
+    """
+    Returns the seconds left before the stored expiry, or None if unknown.
+    """
+    expires_at = parse_expiry(value)
+    if expires_at is None:
+        return None
+    now = now or DT.datetime.now(DT.timezone.utc)
+    return (expires_at - now).total_seconds()
+
+
+def is_token_fresh(value, margin: float = EXPIRY_MARGIN_SECONDS, now: DT.datetime = None) -> bool:
+    """
+    Returns whether a token with the stored expiry can still be used without
+    asking the provider. Tokens of unknown expiry count as stale, so they are
+    refreshed once and get a real expiry.
+
+    Parameters:
+    value: The stored token_expires_at.
+    margin (float): Seconds before the expiry at which the token is stale.
+    now (datetime, optional): The current time, for tests.
+
+    Returns:
+    bool: True if the token is valid for at least margin more seconds.
+    """
+    remaining = seconds_until_expiry(value, now)
+    return remaining is not None and remaining > margin
@@ -1,14 +1,22 @@
 import datetime
 import time
 from flask import jsonify
-import requests
+from util.deadline import DeadlineExceeded
+from util.cache import TTLCache
+from util.http_client import http_client
 import isodate
 from util.logit import get_logger
 from config.config import settings
 
 logger = get_logger("logs", "YoutubeUtils")
-playlist_cache = {}
 CACHE_DURATION = 3600  # Cache duration in seconds (1 hour)
+# playlist_id -> (result, expiration_time). Expired entries stay for
+# settings.playlist_cache_stale_seconds as the deadline fallback; the least
+# recently used are evicted beyond settings.playlist_cache_maxsize.
+playlist_cache = TTLCache(
+    maxsize=settings.playlist_cache_maxsize,
+    ttl=CACHE_DURATION + settings.playlist_cache_stale_seconds,
+)
 
 
 def iso_duration_to_milliseconds(iso_duration: str) -> int:
@@ -37,7 +45,36 @@ def iso_duration_to_milliseconds(iso_duration: str) -> int:
     return ms
 
 
-def playlist_items(access_token, playlist_id):
+def youtube_get(url, access_token, renew_token=None, **kwargs):
+    """
+    Sends a GET to the YouTube Data API with the access token.
+
+    A cached token can be revoked or rotated before its stored expiry, so on
+    a 401 the token is replaced once with renew_token(access_token) and the
+    call is retried.
+
+    Parameters:
+    url (str): The API URL.
+    access_token (str): The Google access token.
+    renew_token (callable, optional): Returns a new token for a rejected one,
+                                      or None if there is none.
+    **kwargs: Passed on to http_client.get.
+
+    Returns:
+    tuple: (the response, the access token it was sent with)
+    """
+    headers = {**kwargs.pop("headers", {}), "Authorization": f"Bearer {access_token}"}
+    response = http_client.get(url, headers=headers, **kwargs)
+    if response.status_code == 401 and renew_token is not None:
+        new_access_token = renew_token(access_token)
+        if new_access_token and new_access_token != access_token:
+            access_token = new_access_token
+            headers["Authorization"] = f"Bearer {access_token}"
+            response = http_client.get(url, headers=headers, **kwargs)
+    return response, access_token
+
+
+def playlist_items(access_token, playlist_id, renew_token=None):
     """
     Fetches all playlist items from YouTube, calculates the total duration, and returns a tuple:
     (tracks, total_duration, total_tracks). Uses caching to avoid repeated API calls for the same playlist.
@@ -45,6 +82,8 @@ def playlist_items(access_token, playlist_id):
     Parameters:
       access_token (str): The access token for YouTube API authorization.
       playlist_id (str): The YouTube playlist ID.
+      renew_token (callable, optional): Replaces a token the API rejects with
+                                        401 (see youtube_get).
 
     Returns:
       tuple: A tuple containing:
@@ -55,19 +94,17 @@ def playlist_items(access_token, playlist_id):
     Raises:
       Exception: If fetching playlist items or track details fails.
     """
-    # Check if the result is in the cache and not expired
+    # Check if the result is in the cache and not expired. An expired entry
+    # is kept for a while longer: it is still served when the request's time
+    # budget runs out before YouTube answers.
     cached_entry = playlist_cache.get(playlist_id)
     if cached_entry:
         cached_data, expiration_time = cached_entry
         if time.time() < expiration_time:
             return cached_data
-        else:
-            # Remove expired cache entry
-            del playlist_cache[playlist_id]
 
     # Now, fetch all playlist items from YouTube
     url = "https://www.googleapis.com/youtube/v3/playlistItems"
-    headers = {"Authorization": f"Bearer {access_token}"}
     tracks = []
     playlist_items_ids = []  # To store video IDs
     total_duration = 0
@@ -86,7 +123,7 @@ def playlist_items(access_token, playlist_id):
             if nextPageToken:
                 params["pageToken"] = nextPageToken
 
-            response = requests.get(url, headers=headers, params=params)
+            response, access_token = youtube_get(url, access_token, renew_token, params=params)
             if response.status_code != 200:
                 logger.error(
                     "Error fetching playlist items: %s",
@@ -115,7 +152,6 @@ def playlist_items(access_token, playlist_id):
         while True:
             print("Playlist fetching...")
             url = "https://www.googleapis.com/youtube/v3/videos"
-            headers = {"Authorization": f"Bearer {access_token}"}
             params = {
                 "part": "snippet,contentDetails",
                 "id": ",".join(map(str, playlist_items_ids)),
@@ -124,7 +160,7 @@ def playlist_items(access_token, playlist_id):
             if nextPageToken:
                 params["pageToken"] = nextPageToken
 
-            response = requests.get(url, headers=headers, params=params)
+            response, access_token = youtube_get(url, access_token, renew_token, params=params)
             if response.status_code != 200:
                 logger.error("Error fetching tracks: %s", response.text)
                 raise Exception("Failed to fetch tracks.")
@@ -162,9 +198,14 @@ def playlist_items(access_token, playlist_id):
 
         result = (tracks, total_duration, total_tracks)
         # Store the result in the cache with a CACHE_DURATION expiration
-        playlist_cache[playlist_id] = (result, time.time() + CACHE_DURATION)
+        playlist_cache.set(playlist_id, (result, time.time() + CACHE_DURATION))
         return result
 
+    except DeadlineExceeded:
+        if cached_entry:
+            logger.warning("Deadline exceeded; serving cached tracks of %s", playlist_id)
+            return cached_entry[0]
+        raise
     except Exception as e:
         logger.error("Error fetching all tracks: %s", e)
         raise Exception("An error occurred while fetching tracks.")